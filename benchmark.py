@@ -0,0 +1,182 @@
+"""
+Offline benchmark: time each stage of process_video() on synthetic media.
+
+Media is generated with ffmpeg's lavfi sources (speech-like tones, long
+silences, 1080p test video, see synthetic_media.py) and served from a local
+HTTP server. Every model
+call goes to the stub backend (MODEL_BACKEND=stub), so runs need no API key
+or quota. The result and job caches are disabled so every run is cold.
+
+Each stage's time is its wall time in the job trace: the union of the spans of
+that stage, so segments transcribed in parallel count once. A stage fails the
+run when it is more than --tolerance slower than its stored baseline (and by
+more than --min-delta seconds, so sub-second stages don't flap). A stage with
+no baseline is reported as new; --require-baselines fails the run instead, so
+a CI job with a missing or stale baseline file can't pass by measuring nothing.
+The stub injects no 429s unless STUB_RATE_LIMIT_PROBABILITY is set.
+
+Usage:
+    python benchmark.py                      # Compare against benchmark_baselines.json
+    python benchmark.py --update-baselines   # Record baselines on the reference machine
+    python benchmark.py --require-baselines  # CI: a stage without a baseline fails
+    python benchmark.py --cases speech_5min video_1080p_1min --repeat 3
+    python benchmark.py --long               # Include the multi-hour cases
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Set before the analyzer is imported: it reads its configuration at import time
+os.environ.setdefault('MODEL_BACKEND', 'stub')
+os.environ.setdefault('STUB_SEED', '0')  # Same 429s on every run
+os.environ.setdefault('STUB_RATE_LIMIT_PROBABILITY', '0')  # Retry backoff would dominate the timings
+os.environ['RESULT_CACHE_PATH'] = ''
+os.environ['JOB_STORE_PATH'] = ''
+
+import gemini_video_analyzer as analyzer
+from synthetic_media import CASES, generate_media, serve_media
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+
+def stage_seconds(trace):
+    """Wall time per stage from a job trace: the union of each stage's spans, plus the total"""
+    
+    intervals = {}
+    for event in trace['traceEvents']:
+        if event['ph'] != 'X' or event['cat'] not in ('stage', 'job'):
+            continue
+        name = 'total' if event['cat'] == 'job' else event['name']
+        intervals.setdefault(name, []).append((event['ts'], event['ts'] + event['dur']))
+    
+    seconds = {}
+    for name, spans in intervals.items():
+        covered, end = 0.0, None
+        for span_start, span_end in sorted(spans):
+            if end is None or span_start > end:
+                covered += span_end - span_start
+                end = span_end
+            elif span_end > end:
+                covered += span_end - end
+                end = span_end
+        seconds[name] = covered / 1e6
+    return seconds
+
+def run_case(url, repeat):
+    """Process a URL repeat times; returns the median seconds per stage and the last result"""
+    
+    runs = []
+    for _ in range(repeat):
+        result = analyzer.process_video(url)
+        runs.append(stage_seconds(result['trace']))
+    
+    stages = sorted({stage for run in runs for stage in run})
+    return {stage: statistics.median(run.get(stage, 0.0) for run in runs) for stage in stages}, result
+
+def compare(measured, baselines, tolerance, min_delta):
+    """
+    Compare measured stage times against baselines.
+    
+    Returns:
+        tuple: (rows of (case, stage, baseline, measured, status), regression count, missing baseline count)
+    """
+    
+    rows = []
+    regressions = 0
+    missing = 0
+    for case, stages in measured.items():
+        for stage, seconds in stages.items():
+            baseline = baselines.get(case, {}).get(stage)
+            if baseline is None:
+                status = 'new'
+                missing += 1
+            elif seconds > baseline * (1 + tolerance) and seconds - baseline > min_delta:
+                status = 'REGRESSED'
+                regressions += 1
+            elif seconds < baseline * (1 - tolerance) and baseline - seconds > min_delta:
+                status = 'faster'
+            else:
+                status = 'ok'
+            rows.append((case, stage, baseline, seconds, status))
+    return rows, regressions, missing
+
+def print_report(rows):
+    print(f"\n{'case':<22} {'stage':<18} {'baseline':>10} {'measured':>10} {'change':>8}  status")
+    for case, stage, baseline, seconds, status in rows:
+        change = f"{(seconds - baseline) / baseline * 100:+.0f}%" if baseline else ''
+        baseline_text = f"{baseline:.2f}s" if baseline is not None else '-'
+        print(f"{case:<22} {stage:<18} {baseline_text:>10} {seconds:>9.2f}s {change:>8}  {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of process_video() on synthetic media with the stub model backend")
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), help="Cases to run (default: all but the long ones)")
+    parser.add_argument('--long', action='store_true', help="Also run the multi-hour cases")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per case; the median time of each stage is kept")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown over the baseline (0.25 = 25%%)")
+    parser.add_argument('--min-delta', type=float, default=0.5, help="Slowdowns under this many seconds never fail")
+    parser.add_argument('--baselines', default=BASELINES_PATH, help="Baseline file")
+    parser.add_argument('--update-baselines', action='store_true', help="Store the measured times as the new baselines")
+    parser.add_argument('--require-baselines', action='store_true', help="Fail when a measured stage has no baseline")
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), 'video_analyzer_benchmark'),
+                        help="Where generated media is kept between runs")
+    args = parser.parse_args()
+    
+    for tool in ('ffmpeg', 'ffprobe'):
+        if shutil.which(tool) is None:
+            print(f"{tool} is required for the benchmark")
+            return 2
+    
+    if args.require_baselines and not args.update_baselines and not os.path.exists(args.baselines):
+        print(f"No baseline file at {args.baselines}; record one with --update-baselines")
+        return 2
+    
+    if analyzer.model_backend.name != 'stub':
+        print(f"Warning: benchmarking against the {analyzer.model_backend.name} backend, not the stub")
+    
+    names = args.cases or [name for name, case in CASES.items() if args.long or not case.get('long')]
+    os.makedirs(args.media_dir, exist_ok=True)
+    base_url = serve_media(args.media_dir)
+    
+    measured = {}
+    for name in names:
+        file_name = generate_media(name, CASES[name], args.media_dir)
+        print(f"\n=== {name} ===")
+        started = time.perf_counter()
+        measured[name], result = run_case(f"{base_url}/{file_name}", args.repeat)
+        print(f"{name}: {time.perf_counter() - started:.1f}s for {args.repeat} run(s), gemini stats {result['gemini_stats']}")
+    
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    
+    rows, regressions, missing = compare(measured, baselines, args.tolerance, args.min_delta)
+    print_report(rows)
+    
+    if args.update_baselines:
+        baselines.update({case: {stage: round(seconds, 3) for stage, seconds in stages.items()}
+                          for case, stages in measured.items()})
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaselines for {len(measured)} case(s) written to {args.baselines}")
+        return 0
+    
+    if regressions:
+        print(f"\n{regressions} stage(s) regressed past the {args.tolerance:.0%} tolerance")
+        return 1
+    
+    if missing and args.require_baselines:
+        print(f"\n{missing} stage(s) have no baseline in {args.baselines}")
+        return 1
+    
+    print("\nNo regressions")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,34 @@
 import os
 import time
 import google.generativeai as genai
-from flask import Flask, jsonify, send_file, request
-import requests
+from google.api_core import exceptions as google_exceptions
+from googleapiclient.errors import HttpError  # Raised by genai.upload_file (discovery client)
+from flask import Flask, Response, jsonify, send_file, request
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+import asyncio
 import tempfile
 import subprocess
 import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import csv
+import random
+import re
+import shutil
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import deque
+from types import SimpleNamespace
+import uuid
+import hashlib
+import sqlite3
+import queue
+import numpy as np
+import bisect
+import math
+import struct
+from array import array
 
 app = Flask(__name__)
 
@@ -17,11 +39,477 @@ VERSION = "1.5.0"  # Semantic versioning: MAJOR.MINOR.PATCH
 GOOGLE_API_KEY = os.environ.get('GOOGLE_API_KEY')
 genai.configure(api_key=GOOGLE_API_KEY)
 
-def download_video(video_url):
-    """Download video or audio file from URL"""
+# Background job settings
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 8))  # Jobs processed at the same time (async tasks, not threads)
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 20))  # Jobs allowed to wait for a worker
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 6 * 3600))  # Keep finished jobs this long
+
+# Download settings (one pooled HTTP client shared by all jobs)
+DOWNLOAD_CONNECTIONS = int(os.environ.get('DOWNLOAD_CONNECTIONS', 4))  # Concurrent range requests per download
+DOWNLOAD_RANGE_MIN_BYTES = 32 * 1024 * 1024  # Smaller files come in one stream
+DOWNLOAD_RANGE_BYTES = 16 * 1024 * 1024  # Size of each range request
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Read buffer
+DOWNLOAD_RETRIES = 5  # Resumes per stream or range after a dropped connection
+DOWNLOAD_TIMEOUT = 60  # Seconds without data before a connection counts as dropped
+DOWNLOAD_LOG_INTERVAL = 5.0  # Seconds between progress and throughput log lines
+
+# Audio energy map settings (one low-rate decode per job answers all silence questions)
+ENERGY_SAMPLE_RATE = 8000  # Hz, mono PCM decoded for loudness analysis
+ENERGY_FRAME_SECONDS = 0.1  # Length of one RMS frame
+SILENCE_THRESHOLD_DB = -35  # Frames quieter than this count as silent
+MIN_SILENCE_DURATION = 2.0  # Silent runs shorter than this are ignored (seconds)
+
+# Segment planner settings
+SEGMENT_DURATIONS = {'sparse': 600, 'moderate': 300, 'dense': 180}  # Target length by local density
+DENSITY_WINDOW = 300  # Seconds of upcoming audio used to judge local density
+LONG_SILENCE_DURATION = 30.0  # Silent stretches this long become their own skipped segment
+SILENCE_PADDING = 1.0  # Seconds of a long silence left attached to neighbouring speech
+CUT_PAUSE_DURATION = 0.3  # Shortest pause considered as a cut point between sentences
+CUT_SEARCH_RANGE = 0.25  # Look for a pause within +/-25% of the target segment length
+
+# Transcription media: 'audio' uploads a small mono Opus proxy of each segment,
+# 'original' uploads stream-copied segments of the source file
+TRANSCRIPTION_MEDIA = os.environ.get('TRANSCRIPTION_MEDIA', 'audio')
+PROXY_SAMPLE_RATE = 16000  # Hz, plenty for speech recognition
+PROXY_BITRATE = '24k'  # Opus bitrate for speech proxies
+
+# Live segmenting: with audio proxies, cut and transcribe segments while the file is
+# still downloading. Cuts are fixed-length, since silence-aware planning needs the whole file
+STREAM_SEGMENTS = os.environ.get('STREAM_SEGMENTS', 'false').lower() == 'true'
+STREAM_SEGMENT_DURATION = int(os.environ.get('STREAM_SEGMENT_DURATION', SEGMENT_DURATIONS['moderate']))
+STREAM_PROBE_BYTES = 256 * 1024  # Downloaded before deciding whether the container can be read from a pipe
+STREAM_LIST_POLL = 1.0  # Seconds between checks of the live segment list
+
+# Analysis media: 'summary' sends a bounded set of scene keyframes inline (plus an
+# audio proxy for audio-only media), 'full' uploads the whole source file
+ANALYSIS_MEDIA = os.environ.get('ANALYSIS_MEDIA', 'summary')
+SUMMARY_AUDIO = os.environ.get('SUMMARY_AUDIO', 'audio-only')  # 'always', 'audio-only' or 'never'
+MAX_KEYFRAMES = int(os.environ.get('MAX_KEYFRAMES', 24))  # Upper bound on keyframes sent per job
+KEYFRAME_WIDTH = 512  # Pixels; keyframes are downscaled before sending
+SCENE_CHANGE_THRESHOLD = 0.3  # ffmpeg scene score that counts as a new scene
+
+# Transcript material for the context and analysis prompts: 'hierarchical' reduces
+# over per-segment summaries when the transcript exceeds the token budget,
+# 'excerpt' keeps the first and last thirds of long transcripts
+TRANSCRIPT_MODE = os.environ.get('TRANSCRIPT_MODE', 'hierarchical')
+PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 24000))  # Transcript tokens per final prompt
+SUMMARY_MIN_MEDIA_SECONDS = int(os.environ.get('SUMMARY_MIN_MEDIA_SECONDS', 3600))  # Shorter media fit the budget unsummarized
+SUMMARY_MERGE_LEVELS = 3  # Rounds of merging summaries before falling back to excerpts
+
+# Gemini file-state polling (shared by every pending upload across jobs)
+POLL_MIN_INTERVAL = 1.0  # Seconds between checks of one file, at least
+POLL_MAX_INTERVAL = 10.0  # Seconds between checks of one file, at most
+POLL_SECONDS_PER_MB = 0.05  # First check is scheduled from the file size
+POLL_BACKOFF = 0.25  # Later checks wait this fraction of the time already spent waiting
+POLL_TIMEOUT = 1800  # Give up on a file still PROCESSING after this many seconds
+
+# Gemini request scheduling (one budget shared by every job in the process)
+GEMINI_RPM = int(os.environ.get('GEMINI_RPM', 60))  # Requests per minute
+GEMINI_TPM = int(os.environ.get('GEMINI_TPM', 1000000))  # Input tokens per minute
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', 5))  # Retries per call after a retryable error
+GEMINI_BACKOFF_BASE = 2.0  # Seconds before the first retry, doubled on each attempt
+GEMINI_BACKOFF_MAX = 60.0  # Longest wait between retries
+STREAM_GENERATION = os.environ.get('STREAM_GENERATION', 'true').lower() == 'true'  # Token-stream context and analysis
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'gemini')  # 'gemini', or 'stub' for a local stand-in (benchmarks, load tests)
+# Rough input-token cost per byte of uploaded media, corrected from usage metadata afterwards
+TOKENS_PER_BYTE = {'audio': 32 / 3000, 'video': 300 / 125000}
+
+# Stub model backend (MODEL_BACKEND=stub): simulated latencies, no network or quota
+STUB_UPLOAD_MBPS = float(os.environ.get('STUB_UPLOAD_MBPS', 50))  # Simulated upload throughput, MB/s
+STUB_PROCESSING_SECONDS_PER_MB = float(os.environ.get('STUB_PROCESSING_SECONDS_PER_MB', 0.2))  # PROCESSING time before ACTIVE
+STUB_GENERATE_SECONDS = float(os.environ.get('STUB_GENERATE_SECONDS', 1.0))  # Latency of a generate call
+STUB_GENERATE_SECONDS_PER_MB = float(os.environ.get('STUB_GENERATE_SECONDS_PER_MB', 0.1))  # Extra latency per MB of attached media
+STUB_RATE_LIMIT_PROBABILITY = float(os.environ.get('STUB_RATE_LIMIT_PROBABILITY', 0.0))  # Share of upload/generate calls answered with a 429
+STUB_SEED = os.environ.get('STUB_SEED')  # Seed for reproducible 429s
+
+# Adaptive segment concurrency (AIMD, one budget shared by every job in the process)
+SEGMENT_CONCURRENCY_INITIAL = int(os.environ.get('SEGMENT_CONCURRENCY_INITIAL', 4))
+SEGMENT_CONCURRENCY_MIN = int(os.environ.get('SEGMENT_CONCURRENCY_MIN', 1))
+SEGMENT_CONCURRENCY_MAX = int(os.environ.get('SEGMENT_CONCURRENCY_MAX', 16))
+CONCURRENCY_LATENCY_WINDOW = 20  # Recent segments used for the p95 latency
+CONCURRENCY_LATENCY_GROWTH = 2.0  # Back off when p95 exceeds this multiple of the best p95 seen
+CONCURRENCY_DECREASE_FACTOR = 0.5  # Multiplicative decrease on a 429 or latency spike
+CONCURRENCY_COOLDOWN = 10.0  # Seconds after a decrease before another decrease
+
+# Pipeline stages reported by GET /jobs/<id>, in execution order
+PIPELINE_STAGES = ['download', 'probe', 'transcribe', 'upload', 'context', 'analysis']
+
+# Result cache: finished results keyed by media content hash (and by URL + ETag/Last-Modified)
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'gemini_result_cache.sqlite3'))  # '' disables
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))  # Least recently used results are evicted past this
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))  # Same, for per-segment transcripts
+
+# Job checkpoints: unfinished jobs and their intermediate results survive a restart
+# (point both at a mounted volume to survive container replacement too)
+JOB_STORE_PATH = os.environ.get('JOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'gemini_jobs.sqlite3'))  # '' disables
+JOB_WORK_DIR = os.environ.get('JOB_WORK_DIR', os.path.join(tempfile.gettempdir(), 'gemini_jobs'))  # Media of unfinished jobs
+JOB_MAX_RESUMES = int(os.environ.get('JOB_MAX_RESUMES', 3))  # A job that keeps taking the worker down is failed after this
+
+# Per-job span traces (GET /jobs/<id>/trace, Chrome trace viewer / Perfetto format)
+TRACE_MAX_SPANS = int(os.environ.get('TRACE_MAX_SPANS', 20000))  # Spans past this are counted, not recorded
+
+# Job event streams (GET /jobs/<id>/events)
+EVENT_HEARTBEAT_SECONDS = 15  # Comment line sent on idle streams so proxies keep them open
+WSGI_THREADS = int(os.environ.get('WSGI_THREADS', 32))  # Request threads under asgi_app (event streams are served without one)
+
+jobs = {}
+jobs_lock = threading.Lock()
+job_slots = asyncio.Semaphore(JOB_WORKERS)  # Bounds running jobs on the engine loop
+
+# Prometheus metrics (GET /metrics)
+STAGE_SECONDS = Histogram(
+    'video_analyzer_stage_seconds', 'Time spent in each pipeline stage, per call', ['stage'],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+)
+SEGMENTS = Counter('video_analyzer_segments_total', 'Segments finished, by outcome', ['outcome'])
+JOBS_FINISHED = Counter('video_analyzer_jobs_finished_total', 'Jobs finished, by status', ['status'])
+GEMINI_CALLS = Counter('video_analyzer_gemini_calls_total', 'Gemini API calls, by kind', ['kind'])
+GEMINI_RETRIES = Counter(
+    'video_analyzer_gemini_retries_total', 'Gemini calls retried after a retryable error', ['kind', 'reason']
+)
+GEMINI_IN_FLIGHT = Gauge('video_analyzer_gemini_calls_in_flight', 'Gemini API calls in progress', ['kind'])
+JOBS_RUNNING = Gauge('video_analyzer_jobs_running', 'Jobs being processed')
+JOBS_QUEUED = Gauge('video_analyzer_jobs_queued', 'Jobs waiting for a job slot')
+SEGMENT_CONCURRENCY_LIMIT = Gauge('video_analyzer_segment_concurrency_limit', 'Current adaptive segment concurrency limit')
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Record the time spent in a block in the stage latency histogram and the job trace"""
+    
+    started = time.perf_counter()
+    try:
+        with trace_span(stage, category='stage'):
+            yield
+    finally:
+        STAGE_SECONDS.labels(stage=stage).observe(time.perf_counter() - started)
+
+def timed_stage(stage):
+    """Decorator: record each call of an async function in the stage latency histogram"""
+    
+    def decorate(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return await fn(*args, **kwargs)
+        return wrapper
+    
+    return decorate
+
+class JobTrace:
+    """
+    Tree of timed spans recorded while one job runs.
+    
+    Spans are complete events in Chrome's trace event format. Each span runs on a
+    lane (the trace's thread id): a span opened in the same task as its parent
+    shares its lane, a span opened in another task (a segment worker, a stage run
+    concurrently) takes the lowest free lane until it ends. Concurrent work thus
+    never overlaps on one lane, and the fan-out shows as one row per worker.
+    """
+    
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.events = []
+        self.open_spans = {}
+        self.busy_lanes = set()
+        self.next_span_id = 1
+        self.dropped = 0
+    
+    def now_us(self):
+        return (time.perf_counter() - self.origin) * 1e6
+    
+    def start(self, name, category, parent, args):
+        """Open a span under parent (None for a root span) and return it"""
+        
+        owner = trace_owner()
+        with self.lock:
+            if parent is not None and parent['owner'] == owner:
+                lane, own_lane = parent['lane'], False
+            else:
+                lane, own_lane = 0, True
+                while lane in self.busy_lanes:
+                    lane += 1
+                self.busy_lanes.add(lane)
+            
+            span = {
+                'id': self.next_span_id,
+                'parent': parent['id'] if parent is not None else None,
+                'name': name,
+                'category': category,
+                'start': self.now_us(),
+                'lane': lane,
+                'own_lane': own_lane,
+                'owner': owner,
+                'args': args
+            }
+            self.next_span_id += 1
+            self.open_spans[span['id']] = span
+        return span
+    
+    def finish(self, span, error=None):
+        """Close a span, recording it as a complete event"""
+        
+        with self.lock:
+            self.open_spans.pop(span['id'], None)
+            if span['own_lane']:
+                self.busy_lanes.discard(span['lane'])
+            if error is not None:
+                span['args']['error'] = f"{type(error).__name__}: {error}"
+            if len(self.events) >= TRACE_MAX_SPANS:
+                self.dropped += 1
+                return
+            self.events.append(self.chrome_event(span, self.now_us() - span['start']))
+    
+    def chrome_event(self, span, duration):
+        return {
+            'name': span['name'],
+            'cat': span['category'],
+            'ph': 'X',
+            'ts': round(span['start'], 1),
+            'dur': round(duration, 1),
+            'pid': 1,
+            'tid': span['lane'],
+            'args': {'span_id': span['id'], 'parent_id': span['parent'], **span['args']}
+        }
+    
+    def to_chrome(self):
+        """
+        The trace as a Chrome trace viewer / Perfetto JSON object.
+        
+        Spans still open (a running job) are included up to now, with in_progress set.
+        """
+        
+        with self.lock:
+            now = self.now_us()
+            events = list(self.events)
+            for span in self.open_spans.values():
+                event = self.chrome_event(span, now - span['start'])
+                event['args']['in_progress'] = True
+                events.append(event)
+            dropped = self.dropped
+        
+        events.sort(key=lambda event: event['ts'])
+        lanes = sorted({event['tid'] for event in events})
+        metadata = [{'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': f"job {self.job_id}"}}]
+        metadata += [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': lane,
+             'args': {'name': 'pipeline' if lane == 0 else f"worker {lane}"}}
+            for lane in lanes
+        ]
+        
+        return {
+            'traceEvents': metadata + events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'job_id': self.job_id, 'started_at': self.started_at, 'dropped_spans': dropped}
+        }
+
+current_span = contextvars.ContextVar('current_span', default=None)  # (trace, span) of the running code
+
+def trace_owner():
+    """The asyncio task (or, off the loop, the thread) a span is opened from"""
+    
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else ('thread', threading.get_ident())
+
+@contextlib.contextmanager
+def trace_span(name, category='step', trace=None, **args):
+    """
+    Record a block as a span of the current job's trace.
+    
+    Without a trace argument the span nests under the span of the running code;
+    outside any trace it records nothing. Yields the span's args dict, so byte
+    counts and similar results can be added once known.
+    
+    Args:
+        name: Span name shown in the trace viewer
+        category: Span category ('stage', 'segment', 'gemini', 'ffmpeg', ...)
+        trace: JobTrace to start a root span in
+        **args: Attributes recorded on the span
+    """
+    
+    parent = current_span.get()
+    if trace is None:
+        if parent is None:
+            yield args
+            return
+        trace, parent_span = parent
+    else:
+        parent_span = None
+    
+    span = trace.start(name, category, parent_span, args)
+    token = current_span.set((trace, span))
+    try:
+        yield args
+    except BaseException as e:
+        trace.finish(span, error=e)
+        raise
+    else:
+        trace.finish(span)
+    finally:
+        current_span.reset(token)
+
+def annotate_span(**args):
+    """Add attributes (e.g. bytes) to the span of the running code, if any"""
+    
+    parent = current_span.get()
+    if parent is not None:
+        parent[1]['args'].update(args)
+
+async def traced(coro, name, category='step', **args):
+    """Await a coroutine inside a span - wraps the coroutine of a task so the span runs in that task"""
+    
+    with trace_span(name, category, **args):
+        return await coro
+
+# The pipeline runs on one asyncio event loop: the ASGI server's loop when served
+# through asgi_app, otherwise a loop on a background thread started on first use
+engine_loop = None
+engine_loop_lock = threading.Lock()
+
+def get_engine_loop():
+    """Return the event loop that runs pipeline jobs, starting one if needed"""
+    
+    global engine_loop
+    
+    with engine_loop_lock:
+        if engine_loop is None or engine_loop.is_closed():
+            engine_loop = asyncio.new_event_loop()
+            threading.Thread(target=engine_loop.run_forever, name='engine', daemon=True).start()
+        return engine_loop
+
+def attach_engine_loop(loop):
+    """Run pipeline jobs on an existing loop (the ASGI server's) instead of a private one"""
+    
+    global engine_loop
+    
+    with engine_loop_lock:
+        engine_loop = loop
+
+async def run_command(cmd, timeout):
+    """
+    Run an ffmpeg/ffprobe command without blocking the event loop.
+    
+    Args:
+        cmd: Command and arguments
+        timeout: Seconds before the process is killed
+    
+    Returns:
+        subprocess.CompletedProcess with decoded stdout and stderr
+    
+    Raises:
+        TimeoutError: If the command runs longer than timeout
+    """
+    
+    with trace_span(os.path.basename(cmd[0]), category='ffmpeg', command=' '.join(cmd)[:500]) as span:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{cmd[0]} timed out after {timeout}s")
+        finally:
+            # Timed out, or the job was cancelled: don't leave ffmpeg running
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        span['returncode'] = process.returncode
+    
+    return subprocess.CompletedProcess(
+        cmd, process.returncode,
+        stdout.decode(errors='replace'), stderr.decode(errors='replace')
+    )
+
+class DownloadProgress:
+    """Byte counter for a download that logs progress and throughput every DOWNLOAD_LOG_INTERVAL seconds"""
+    
+    def __init__(self, total_bytes=0, job=None):
+        self.total_bytes = total_bytes
+        self.job = job
+        self.done_bytes = 0
+        self.started_at = time.time()
+        self.last_log = self.started_at
+        self.last_log_bytes = 0
+    
+    def add(self, count):
+        self.done_bytes += count
+        
+        now = time.time()
+        if now - self.last_log < DOWNLOAD_LOG_INTERVAL:
+            return
+        
+        rate = (self.done_bytes - self.last_log_bytes) / (now - self.last_log)
+        self.last_log, self.last_log_bytes = now, self.done_bytes
+        
+        done_mb = self.done_bytes / (1024 * 1024)
+        if self.total_bytes:
+            print(f"Download progress: {done_mb:.0f}MB ({self.done_bytes / self.total_bytes * 100:.1f}%) at {rate / (1024 * 1024):.1f}MB/s")
+        else:
+            print(f"Download progress: {done_mb:.0f}MB at {rate / (1024 * 1024):.1f}MB/s")
+        update_job_stage(self.job, 'download', bytes_done=self.done_bytes, bytes_total=self.total_bytes or None,
+                         mb_per_second=round(rate / (1024 * 1024), 2))
+    
+    def finish(self):
+        """Log and record the average throughput of the whole download"""
+        
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        rate = self.done_bytes / elapsed / (1024 * 1024)
+        print(f"Downloaded {self.done_bytes / (1024 * 1024):.1f}MB in {elapsed:.1f}s ({rate:.1f}MB/s)")
+        update_job_stage(self.job, 'download', bytes_done=self.done_bytes, bytes_total=self.done_bytes,
+                         mb_per_second=round(rate, 2))
+
+http_client = None
+
+def get_http_client():
+    """Shared pooled HTTP client, so downloads and HEAD requests reuse connections"""
+    
+    global http_client
+    
+    # Connections belong to the loop that opened them
+    loop = asyncio.get_running_loop()
+    if http_client is None or http_client[0] is not loop:
+        http_client = (loop, httpx.AsyncClient(
+            timeout=httpx.Timeout(DOWNLOAD_TIMEOUT, connect=30),
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=JOB_WORKERS * DOWNLOAD_CONNECTIONS, max_keepalive_connections=32)
+        ))
+    return http_client[1]
+
+def is_retryable_download_error(error):
+    """Dropped connections, timeouts, 429 and 5xx responses are worth resuming"""
+    
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+@timed_stage('download')
+async def download_video(video_url, hasher=None, output_dir=None, on_chunk=None, job=None):
+    """Download video or audio file from URL
+    
+    Servers that accept byte ranges send large files over DOWNLOAD_CONNECTIONS
+    concurrent range requests into a preallocated file. Otherwise, or when the
+    bytes are needed in order (on_chunk), the file comes in one stream. Either
+    way a dropped connection resumes from the last byte received, up to
+    DOWNLOAD_RETRIES times per stream or range.
+    
+    Args:
+        video_url: URL of the media
+        hasher: Optional hashlib object updated with the downloaded bytes
+        output_dir: Directory for the downloaded file (default: the temp directory)
+        on_chunk: Optional coroutine function awaited with each downloaded chunk, in order
+        job: Optional job record that receives download progress and throughput
+    """
     
     print(f"Downloading media from URL: {video_url}")
     
+    temp_path = None
+    
     try:
         # Detect file extension from URL
         from urllib.parse import urlparse, unquote
@@ -35,31 +523,150 @@ def download_video(video_url):
         
         print(f"Detected file extension: {ext}")
         
-        response = requests.get(video_url, stream=True, timeout=600)
-        response.raise_for_status()
-        
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=ext)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=ext, dir=output_dir) as temp_file:
+            temp_path = temp_file.name
         
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded = 0
+        client = get_http_client()
+        total_size = None if on_chunk is not None else await fetch_range_size(client, video_url)
         
-        for chunk in response.iter_content(chunk_size=8192):
-            temp_file.write(chunk)
-            downloaded += len(chunk)
-            if total_size > 0:
-                percent = (downloaded / total_size) * 100
-                if downloaded % (1024 * 1024 * 10) == 0:  # Log every 10MB
-                    print(f"Download progress: {percent:.1f}%")
-        
-        temp_file.close()
+        if total_size is not None and total_size >= DOWNLOAD_RANGE_MIN_BYTES:
+            progress = DownloadProgress(total_size, job)
+            await download_ranges(client, video_url, temp_path, total_size, progress)
+            if hasher is not None:
+                await asyncio.to_thread(hash_file, temp_path, hasher)  # Ranges arrive out of order
+        else:
+            progress = DownloadProgress(0, job)
+            await download_stream(client, video_url, temp_path, progress, hasher, on_chunk)
         
-        print(f"Media downloaded to: {temp_file.name}")
-        return temp_file.name
+        progress.finish()
+        annotate_span(bytes=os.path.getsize(temp_path), ranged=total_size is not None and total_size >= DOWNLOAD_RANGE_MIN_BYTES)
+        print(f"Media downloaded to: {temp_path}")
+        return temp_path
         
     except Exception as e:
         print(f"Error downloading media: {e}")
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
         raise ValueError(f"Could not download media from URL: {video_url}. Error: {str(e)}")
 
+async def fetch_range_size(client, video_url):
+    """
+    Size of a resource if its server answers byte-range requests.
+    
+    Returns:
+        int: Total size in bytes, or None if ranges aren't supported
+    """
+    
+    try:
+        async with client.stream('GET', video_url, headers={'Range': 'bytes=0-0'}) as response:
+            content_range = response.headers.get('content-range', '')
+            if response.status_code != 206 or '/' not in content_range:
+                return None
+            total = content_range.rsplit('/', 1)[1]
+            return int(total) if total.isdigit() else None
+    except httpx.HTTPError as e:
+        print(f"Range probe failed ({e}), downloading in one stream")
+        return None
+
+async def download_stream(client, video_url, path, progress, hasher=None, on_chunk=None):
+    """Download a resource in order over one connection, resuming with a Range request if it drops"""
+    
+    downloaded = 0
+    attempt = 0
+    
+    with open(path, 'wb') as f:
+        while True:
+            headers = {'Range': f'bytes={downloaded}-'} if downloaded else {}
+            
+            try:
+                async with client.stream('GET', video_url, headers=headers) as response:
+                    response.raise_for_status()
+                    if downloaded and response.status_code != 206:
+                        raise ValueError("server ignored the Range request, can't resume")
+                    
+                    if not progress.total_bytes:
+                        progress.total_bytes = int(response.headers.get('content-length', 0))
+                    
+                    async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        if on_chunk is not None:
+                            await on_chunk(chunk)
+                        downloaded += len(chunk)
+                        progress.add(len(chunk))
+                return
+                
+            except httpx.HTTPError as e:
+                attempt += 1
+                if not is_retryable_download_error(e) or attempt > DOWNLOAD_RETRIES:
+                    raise
+                print(f"Download interrupted at {downloaded} bytes ({type(e).__name__}), resuming ({attempt}/{DOWNLOAD_RETRIES})")
+                await asyncio.sleep(min(30, 2 ** attempt))
+
+async def download_ranges(client, video_url, path, total_size, progress):
+    """
+    Download a resource over several concurrent byte-range requests.
+    
+    The file is preallocated and split into DOWNLOAD_RANGE_BYTES pieces that
+    DOWNLOAD_CONNECTIONS workers take in order, writing each at its offset. A
+    failed piece is resumed from its last received byte.
+    """
+    
+    with open(path, 'wb') as f:
+        f.truncate(total_size)
+    
+    pieces = deque((start, min(start + DOWNLOAD_RANGE_BYTES, total_size) - 1)
+                   for start in range(0, total_size, DOWNLOAD_RANGE_BYTES))
+    connections = min(DOWNLOAD_CONNECTIONS, len(pieces))
+    print(f"Downloading {total_size / (1024 * 1024):.1f}MB in {len(pieces)} ranges over {connections} connections")
+    
+    fd = os.open(path, os.O_WRONLY)
+    
+    async def fetch_piece(start, end):
+        position = start
+        attempt = 0
+        
+        while position <= end:
+            try:
+                async with client.stream('GET', video_url, headers={'Range': f'bytes={position}-{end}'}) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise ValueError("server stopped honouring Range requests")
+                    
+                    async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        chunk = chunk[:end + 1 - position]
+                        os.pwrite(fd, chunk, position)
+                        position += len(chunk)
+                        progress.add(len(chunk))
+                
+                if position <= end:
+                    raise httpx.RemoteProtocolError("range response ended early")
+                
+            except httpx.HTTPError as e:
+                attempt += 1
+                if not is_retryable_download_error(e) or attempt > DOWNLOAD_RETRIES:
+                    raise
+                print(f"Range {start}-{end} interrupted at {position} ({type(e).__name__}), resuming ({attempt}/{DOWNLOAD_RETRIES})")
+                await asyncio.sleep(min(30, 2 ** attempt))
+    
+    async def worker():
+        while pieces:
+            start, end = pieces.popleft()
+            with trace_span('range', category='download', offset=start, bytes=end + 1 - start):
+                await fetch_piece(start, end)
+    
+    try:
+        workers = [asyncio.create_task(worker()) for _ in range(connections)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    finally:
+        os.close(fd)
+
 def get_mime_type(file_path):
     """Get MIME type from file extension"""
     
@@ -92,583 +699,2639 @@ def get_mime_type(file_path):
         print(f"Unknown extension {ext}, defaulting to video/mp4")
         return 'video/mp4'
 
-def is_audio_only(file_path):
-    """Detect if file is audio-only (no video stream)"""
+class MediaInfo:
+    """
+    Everything a job needs to know about a media file, from one ffprobe call.
     
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-select_streams', 'v:0',
-            '-show_entries', 'stream=codec_type',
-            '-of', 'json',
-            file_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+    Built from `ffprobe -show_streams -show_format` JSON, which is also what
+    is checkpointed, and passed to every stage instead of probing again.
+    Cover art in audio files (attached pictures) does not count as video.
+    A failed probe (no streams at all) is treated as video, as it always was.
+    The keyframe index costs a packet scan, so it is only read on request.
+    """
+    
+    def __init__(self, path, probe):
+        self.path = path
+        self.probe = probe
+        self.streams = probe.get('streams', [])
+        self.format = probe.get('format', {})
+        self._keyframes = None
+    
+    @property
+    def duration(self):
+        """Duration in seconds, or None if unknown"""
         
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            has_video = len(data.get('streams', [])) > 0
-            is_audio = not has_video
-            print(f"File type: {'audio-only' if is_audio else 'video'}")
-            return is_audio
-        else:
-            # If we can't detect, assume it has video
-            return False
-            
-    except Exception as e:
-        print(f"Error detecting media type: {e}")
-        return False
-
-def get_video_duration(video_path):
-    """Get media duration in seconds using ffprobe"""
+        try:
+            return float(self.format['duration'])
+        except (KeyError, TypeError, ValueError):
+            return None
     
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'json',
-            video_path
+    @property
+    def bit_rate(self):
+        try:
+            return int(self.format['bit_rate'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    @property
+    def video_streams(self):
+        return [
+            s for s in self.streams
+            if s.get('codec_type') == 'video' and not s.get('disposition', {}).get('attached_pic')
         ]
+    
+    @property
+    def audio_streams(self):
+        return [s for s in self.streams if s.get('codec_type') == 'audio']
+    
+    @property
+    def has_audio(self):
+        return bool(self.audio_streams)
+    
+    @property
+    def probe_failed(self):
+        return not self.streams
+    
+    @property
+    def is_audio(self):
+        return not self.probe_failed and not self.video_streams
+    
+    @property
+    def video_codec(self):
+        return self.video_streams[0].get('codec_name') if self.video_streams else None
+    
+    @property
+    def audio_codec(self):
+        return self.audio_streams[0].get('codec_name') if self.audio_streams else None
+    
+    async def keyframe_times(self):
+        """Sorted keyframe times of the first video stream in seconds (memoized; [] for audio)"""
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if self._keyframes is None:
+            self._keyframes = await probe_keyframes(self.path) if self.video_streams else []
+        return self._keyframes
+    
+    def describe(self):
+        """Short JSON-serializable summary for job progress"""
         
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            duration = float(data['format']['duration'])
-            print(f"Media duration: {duration:.1f} seconds ({duration/60:.1f} minutes)")
-            return duration
-        else:
-            print("Could not determine media duration, assuming segments needed")
-            return None
-            
-    except Exception as e:
-        print(f"Error getting duration: {e}")
-        return None
+        return {
+            'media_type': 'audio' if self.is_audio else 'video',
+            'duration': self.duration,
+            'format': self.format.get('format_name'),
+            'bit_rate': self.bit_rate,
+            'video_codec': self.video_codec,
+            'audio_codec': self.audio_codec
+        }
 
-def detect_silence_ratio(segment_path, silence_threshold_db=-35, min_silence_duration=2.0):
+media_info_cache = {}  # (path, size, mtime) -> Task resolving to MediaInfo
+MEDIA_INFO_CACHE_SIZE = 64
+
+async def probe_media(path):
     """
-    Detect the ratio of silence in an audio/video segment.
-    
-    Args:
-        segment_path: Path to the media segment
-        silence_threshold_db: dB level below which audio is considered silent (default: -35)
-        min_silence_duration: Minimum duration of silence to count in seconds (default: 2.0)
+    Probe a media file once; later calls for the same unchanged file share the result.
     
     Returns:
-        float: Ratio of silence (0.0 to 1.0), or None if detection fails
+        MediaInfo (with no streams and no duration if ffprobe fails)
     """
     
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    
+    task = media_info_cache.get(key)
+    if task is None or task.get_loop() is not asyncio.get_running_loop():
+        task = asyncio.get_running_loop().create_task(run_media_probe(path))
+        media_info_cache[key] = task
+        while len(media_info_cache) > MEDIA_INFO_CACHE_SIZE:
+            del media_info_cache[next(iter(media_info_cache))]
+    
+    media = await asyncio.shield(task)
+    
+    # A failed probe may be a transient ffprobe error: the next caller probes again
+    if media.probe_failed and media_info_cache.get(key) is task:
+        del media_info_cache[key]
+    
+    return media
+
+@timed_stage('probe')
+async def run_media_probe(path):
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_streams',
+        '-show_format',
+        '-of', 'json',
+        path
+    ]
+    
     try:
-        # Use ffmpeg silencedetect filter to find silent periods
-        cmd = [
-            'ffmpeg',
-            '-i', segment_path,
-            '-af', f'silencedetect=noise={silence_threshold_db}dB:d={min_silence_duration}',
-            '-f', 'null',
-            '-'
-        ]
+        result = await run_command(cmd, timeout=30)
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        stderr = result.stderr
-        
-        # Parse silence_start and silence_end from output
-        import re
-        silence_starts = re.findall(r'silence_start: ([\d.]+)', stderr)
-        silence_ends = re.findall(r'silence_end: ([\d.]+)', stderr)
+        if result.returncode != 0:
+            print(f"Could not probe media: {result.stderr.strip()[-500:]}")
+            return MediaInfo(path, {})
         
-        if not silence_starts:
-            # No silence detected - segment has continuous audio
-            return 0.0
+        media = MediaInfo(path, json.loads(result.stdout))
         
-        # Get segment duration
-        duration_cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'json',
-            segment_path
-        ]
+    except Exception as e:
+        print(f"Error probing media: {e}")
+        return MediaInfo(path, {})
+    
+    duration = media.duration
+    print(f"File type: {'audio-only' if media.is_audio else 'video'} "
+          f"({media.video_codec or '-'}/{media.audio_codec or '-'})")
+    if duration:
+        print(f"Media duration: {duration:.1f} seconds ({duration/60:.1f} minutes)")
+    else:
+        print("Could not determine media duration, assuming segments needed")
+    return media
+
+async def probe_keyframes(path):
+    """Keyframe times of the first video stream, read from packet flags without decoding"""
+    
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ]
+    
+    try:
+        result = await run_command(cmd, timeout=300)
+    except TimeoutError as e:
+        print(f"Error reading keyframe index: {e}")
+        return []
+    
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    times.sort()
+    return times
+
+class AudioEnergyMap:
+    """
+    Frame-level loudness (dBFS) of a media file's audio track.
+    
+    Built once per job by compute_audio_energy_map() and used to answer every
+    silence-ratio and content-density question for any time range, instead of
+    running ffmpeg silencedetect on each segment. pcm_hash is the sha256 of the
+    decoded PCM the map was computed from.
+    """
+    
+    def __init__(self, frame_db, frame_seconds=ENERGY_FRAME_SECONDS, pcm_hash=None):
+        self.frame_db = frame_db
+        self.frame_seconds = frame_seconds
+        self.pcm_hash = pcm_hash
+    
+    @property
+    def duration(self):
+        return len(self.frame_db) * self.frame_seconds
+    
+    def _frame_range(self, start_time, end_time):
+        """Convert a time range in seconds to a clamped frame index range"""
         
-        duration_result = subprocess.run(duration_cmd, capture_output=True, text=True, timeout=30)
+        first = max(0, int(round((start_time or 0) / self.frame_seconds)))
+        if end_time is None:
+            last = len(self.frame_db)
+        else:
+            last = min(len(self.frame_db), int(round(end_time / self.frame_seconds)))
+        return first, max(first, last)
+    
+    def silent_runs(self, start_time=0, end_time=None, threshold_db=SILENCE_THRESHOLD_DB,
+                    min_silence_duration=MIN_SILENCE_DURATION):
+        """
+        Find silent stretches inside a time range.
         
-        if duration_result.returncode != 0:
-            print(f"Could not determine segment duration for silence detection")
-            return None
+        Returns:
+            tuple: (starts, ends) arrays of absolute frame indices, end exclusive
+        """
         
-        segment_duration = float(json.loads(duration_result.stdout)['format']['duration'])
+        first, last = self._frame_range(start_time, end_time)
+        silent = self.frame_db[first:last] < threshold_db
         
-        # Calculate total silence duration
-        total_silence = 0.0
+        # Run boundaries are where the padded mask flips between loud and silent
+        edges = np.diff(np.concatenate(([0], silent.view(np.int8), [0])))
+        starts = np.flatnonzero(edges == 1)
+        ends = np.flatnonzero(edges == -1)
         
-        for i in range(len(silence_ends)):
-            if i < len(silence_starts):
-                start = float(silence_starts[i])
-                end = float(silence_ends[i])
-                total_silence += (end - start)
+        min_frames = max(1, int(round(min_silence_duration / self.frame_seconds)))
+        keep = (ends - starts) >= min_frames
+        return starts[keep] + first, ends[keep] + first
+    
+    def silence_ratio(self, start_time=0, end_time=None, threshold_db=SILENCE_THRESHOLD_DB,
+                      min_silence_duration=MIN_SILENCE_DURATION):
+        """
+        Ratio of a time range covered by silent stretches (0.0 to 1.0).
         
-        # Calculate silence ratio
-        silence_ratio = total_silence / segment_duration if segment_duration > 0 else 0.0
+        Matches ffmpeg silencedetect semantics: only silent runs of at least
+        min_silence_duration seconds are counted.
+        """
         
-        return silence_ratio
+        first, last = self._frame_range(start_time, end_time)
+        if last <= first:
+            return 0.0
         
-    except Exception as e:
-        print(f"Error detecting silence: {e}")
-        return None
+        starts, ends = self.silent_runs(start_time, end_time, threshold_db, min_silence_duration)
+        return float((ends - starts).sum()) / (last - first)
 
-def analyze_media_content_density(video_path, sample_duration=60):
+async def decode_pcm(path, on_data, sample_rate=ENERGY_SAMPLE_RATE, start_time=None, duration=None,
+                     chunk_bytes=64 * 1024, timeout=1800):
     """
-    Analyze a sample of the media to determine content density.
-    Used to adaptively choose segment duration.
+    Decode an audio track to mono 16-bit PCM, passing the bytes to on_data as they arrive.
     
     Args:
-        video_path: Path to the full media file
-        sample_duration: Duration of sample to analyze in seconds (default: 60)
+        path: Path to the media file
+        on_data: Called with each chunk of little-endian samples (chunks may split a sample)
+        sample_rate: Decode sample rate in Hz
+        start_time: Start of the window to decode in seconds (default: the beginning)
+        duration: Length of the window in seconds (default: to the end)
+        chunk_bytes: Largest chunk read from ffmpeg at a time
+        timeout: Seconds before the decode is abandoned and ffmpeg killed
     
-    Returns:
-        str: 'sparse', 'moderate', or 'dense'
+    Raises:
+        RuntimeError: If ffmpeg fails
+        TimeoutError: If the decode takes longer than timeout
     """
     
+    cmd = ['ffmpeg', '-v', 'error']
+    if start_time:
+        cmd += ['-ss', f'{start_time:.3f}']
+    if duration is not None:
+        cmd += ['-t', f'{duration:.3f}']
+    cmd += [
+        '-i', path,
+        '-vn',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        'pipe:1'
+    ]
+    
+    async def read_all(stdout):
+        while True:
+            data = await stdout.read(chunk_bytes)
+            if not data:
+                break
+            on_data(data)
+    
+    process = None
+    stderr_file = tempfile.TemporaryFile()  # Not a pipe: a chatty ffmpeg can't fill it and stall
     try:
-        # Create a sample segment from the middle of the file
-        duration = get_video_duration(video_path)
-        
-        if not duration or duration < sample_duration:
-            return 'moderate'  # Default for short files
-        
-        # Sample from the middle
-        start_time = duration / 2
-        sample_path = tempfile.NamedTemporaryFile(delete=False, suffix='.tmp').name
-        
-        # Extract sample
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', str(start_time),
-            '-t', str(sample_duration),
-            '-c', 'copy',
-            '-y',
-            sample_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-        
-        if result.returncode != 0:
-            print("Could not create sample for content density analysis")
-            return 'moderate'
-        
-        # Detect silence ratio in sample
-        silence_ratio = detect_silence_ratio(sample_path)
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr_file
+        )
         
-        # Clean up sample
         try:
-            os.remove(sample_path)
-        except:
-            pass
+            await asyncio.wait_for(read_all(process.stdout), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"audio decode timed out after {timeout}s")
+        await process.wait()
         
-        if silence_ratio is None:
-            return 'moderate'
+        if process.returncode != 0:
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode(errors='replace')
+            raise RuntimeError(f"ffmpeg exited with code {process.returncode}: {stderr.strip()[-500:]}")
         
-        # Classify based on silence ratio
-        if silence_ratio > 0.6:
-            print(f"Content density: SPARSE (silence ratio: {silence_ratio:.2f})")
-            return 'sparse'
-        elif silence_ratio > 0.3:
-            print(f"Content density: MODERATE (silence ratio: {silence_ratio:.2f})")
-            return 'moderate'
-        else:
-            print(f"Content density: DENSE (silence ratio: {silence_ratio:.2f})")
-            return 'dense'
-            
-    except Exception as e:
-        print(f"Error analyzing content density: {e}")
-        return 'moderate'  # Default to moderate on error
+    finally:
+        # Timed out, failed or the job was cancelled: don't leave ffmpeg running
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_file.close()
 
-def create_video_segment(video_path, start_time, duration, output_path):
-    """Create a video or audio segment using ffmpeg"""
+@timed_stage('silence_analysis')
+async def compute_audio_energy_map(video_path, sample_rate=ENERGY_SAMPLE_RATE, frame_seconds=ENERGY_FRAME_SECONDS, timeout=1800):
+    """
+    Decode the full audio track once into low-rate mono PCM and compute frame RMS.
     
-    try:
-        cmd = [
-            'ffmpeg',
-            '-i', video_path,
-            '-ss', str(start_time),
-            '-t', str(duration),
-            '-c', 'copy',  # Fast copy without re-encoding
-            '-y',  # Overwrite output
-            output_path
-        ]
+    Args:
+        video_path: Path to the full media file
+        sample_rate: Decode sample rate in Hz (default: 8000)
+        frame_seconds: RMS frame length in seconds (default: 0.1)
+        timeout: Seconds before the decode is abandoned and ffmpeg killed
+    
+    Returns:
+        AudioEnergyMap, or None if the media has no decodable audio
+    """
+    
+    frame_len = int(sample_rate * frame_seconds)
+    frame_db_chunks = []
+    pcm_hash = hashlib.sha256()
+    state = {'leftover': np.empty(0, dtype=np.float32), 'odd_byte': b''}  # Reads can split a 16-bit sample
+    
+    def add_frames(data):
+        pcm_hash.update(data)
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        data = state['odd_byte'] + data
+        state['odd_byte'] = data[len(data) - len(data) % 2:]
+        samples = np.frombuffer(data[:len(data) - len(state['odd_byte'])], dtype='<i2').astype(np.float32) / 32768.0
+        samples = np.concatenate((state['leftover'], samples))
         
-        if result.returncode == 0:
-            print(f"Created segment: {start_time}s-{start_time+duration}s")
-            return True
-        else:
-            print(f"Error creating segment: {result.stderr}")
-            return False
-            
+        usable = len(samples) - len(samples) % frame_len
+        frames = samples[:usable].reshape(-1, frame_len)
+        state['leftover'] = samples[usable:]
+        
+        rms = np.sqrt(np.mean(frames * frames, axis=1))
+        frame_db_chunks.append(20 * np.log10(np.maximum(rms, 1e-10)))
+    
+    try:
+        # One minute of frames per read
+        await decode_pcm(video_path, add_frames, sample_rate, chunk_bytes=frame_len * 2 * 600, timeout=timeout)
     except Exception as e:
-        print(f"Error in segment creation: {e}")
-        return False
-
-def transcribe_segment(video_file, segment_num, start_time, is_audio_only=False):
-    """Transcribe a single video or audio segment with continuous timestamps"""
+        print(f"Could not decode audio for energy map: {e}")
+        return None
     
-    media_type = "audio" if is_audio_only else "video"
+    if not frame_db_chunks:
+        print("Could not decode audio for energy map: no audio samples")
+        return None
+    
+    energy_map = AudioEnergyMap(
+        np.concatenate(frame_db_chunks).astype(np.float32), frame_seconds, pcm_hash=pcm_hash.hexdigest()
+    )
+    print(f"Audio energy map: {len(energy_map.frame_db)} frames ({energy_map.duration:.1f}s)")
+    return energy_map
+
+async def hash_decoded_audio(path, start_time=None, duration=None):
+    """
+    sha256 of a window of a file's audio, decoded as for the energy map.
+    
+    Raises:
+        RuntimeError, TimeoutError: If the audio can't be decoded
+    """
+    
+    hasher = hashlib.sha256()
+    await decode_pcm(path, hasher.update, ENERGY_SAMPLE_RATE, start_time, duration, timeout=600)
+    return hasher.hexdigest()
+
+def classify_content_density(silence_ratio):
+    """Map a silence ratio to 'sparse', 'moderate', or 'dense'"""
+    
+    if silence_ratio > 0.6:
+        return 'sparse'
+    elif silence_ratio > 0.3:
+        return 'moderate'
+    else:
+        return 'dense'
+
+def plan_segments(energy_map, total_duration):
+    """
+    Plan variable-length segment boundaries that fall inside silences.
+    
+    Long silent stretches are split out as their own segments so they can be
+    skipped without uploading. Speech regions are cut into segments sized from
+    the local content density, with each cut placed in the longest pause near
+    the target length so cuts don't land mid-sentence.
+    
+    Args:
+        energy_map: AudioEnergyMap for the media
+        total_duration: Media duration in seconds
+    
+    Returns:
+        list: Dicts with 'start', 'end' and 'silent', in order, covering the whole media
+    """
+    
+    frame = energy_map.frame_seconds
+    
+    # Long silences, trimmed so a little room is left around the adjoining speech
+    silences = []
+    starts, ends = energy_map.silent_runs(min_silence_duration=LONG_SILENCE_DURATION)
+    for start, end in zip(starts * frame, ends * frame):
+        start = start + SILENCE_PADDING if start > 0 else 0.0
+        end = min(end - SILENCE_PADDING, total_duration) if end < total_duration else total_duration
+        if end > start:
+            silences.append((start, end))
+    
+    # Short pauses between sentences are the candidate cut points
+    pause_starts, pause_ends = energy_map.silent_runs(min_silence_duration=CUT_PAUSE_DURATION)
+    pause_mids = (pause_starts + pause_ends) * frame / 2
+    pause_lengths = (pause_ends - pause_starts) * frame
+    
+    plan = []
+    position = 0.0
+    
+    for silence_start, silence_end in silences + [(total_duration, total_duration)]:
+        # Cut the speech region before this silence
+        while silence_start - position > 0:
+            local_ratio = energy_map.silence_ratio(position, min(position + DENSITY_WINDOW, silence_start))
+            target = SEGMENT_DURATIONS[classify_content_density(local_ratio)]
+            
+            if silence_start - position <= target * (1 + CUT_SEARCH_RANGE):
+                cut = silence_start
+            else:
+                low = position + target * (1 - CUT_SEARCH_RANGE)
+                high = position + target * (1 + CUT_SEARCH_RANGE)
+                in_range = np.flatnonzero((pause_mids >= low) & (pause_mids <= high))
+                
+                if len(in_range):
+                    # Longest pause wins; ties go to the one closest to the target
+                    best = max(in_range, key=lambda i: (pause_lengths[i], -abs(pause_mids[i] - position - target)))
+                    cut = float(pause_mids[best])
+                else:
+                    cut = position + target
+            
+            plan.append({'start': position, 'end': cut, 'silent': False})
+            position = cut
+        
+        if silence_end > silence_start:
+            plan.append({'start': silence_start, 'end': silence_end, 'silent': True})
+            position = silence_end
+    
+    return plan
+
+@timed_stage('segmentation')
+async def split_media_into_segments(video_path, cut_points, output_dir, audio_proxy=False):
+    """
+    Split media into segments in a single ffmpeg pass using the segment muxer.
+    
+    Stream copy can only cut on keyframes, so the real segment boundaries may
+    land slightly after the requested cut points. The boundaries ffmpeg actually
+    used are read back from the segment list and returned.
+    
+    With audio_proxy, the same pass instead encodes each segment as 16 kHz mono
+    Opus audio. Re-encoded audio is cut exactly at the requested points and is
+    a small fraction of the size of the source video.
+    
+    Args:
+        video_path: Path to the full media file
+        cut_points: Sorted list of requested cut times in seconds (may be empty)
+        output_dir: Directory that receives the segment files
+        audio_proxy: Write mono Opus audio proxies instead of stream-copied segments
+    
+    Returns:
+        list: One dict per segment with 'path', 'start_time' and 'duration',
+              or None if segmentation fails
+    """
+    
+    _, source_ext = os.path.splitext(video_path)
+    output_args, segment_pattern, segment_list = segmenter_output_args(output_dir, audio_proxy, source_ext)
+    cmd = ['ffmpeg', '-i', video_path, *output_args]
+    
+    if cut_points:
+        # Truncated, not rounded: a time rounded past a snapped keyframe's pts would cut at the next one
+        cmd += ['-segment_times', ','.join(f'{math.floor(t * 1000) / 1000:.3f}' for t in cut_points)]
+    else:
+        cmd += ['-segment_time', '86400']  # One segment for the whole file
+    
+    cmd += ['-y', segment_pattern]
+    
+    try:
+        result = await run_command(cmd, timeout=1800)
+        
+        if result.returncode != 0:
+            print(f"Error creating segments: {result.stderr[-2000:]}")
+            return None
+        
+        segments = read_segment_list(segment_list, output_dir)
+        
+        if not segments:
+            print("Segmenter produced no segments")
+            return None
+        
+        for segment in segments:
+            print(f"Created segment: {segment['start_time']:.1f}s-{segment['start_time'] + segment['duration']:.1f}s")
+        
+        return segments
+        
+    except Exception as e:
+        print(f"Error in segment creation: {e}")
+        return None
+
+def snap_to_keyframes(cut_points, keyframes):
+    """Move each cut point to its nearest keyframe, dropping cuts that collapse together"""
+    
+    snapped = []
+    for cut in cut_points:
+        i = bisect.bisect_left(keyframes, cut)
+        nearest = min(keyframes[max(i - 1, 0):i + 1], key=lambda t: abs(t - cut))
+        if nearest > 0 and (not snapped or nearest > snapped[-1]):
+            snapped.append(nearest)
+    return snapped
+
+def segmenter_output_args(output_dir, audio_proxy, source_ext):
+    """
+    ffmpeg output arguments for the segment muxer, without the cut times.
+    
+    Returns:
+        tuple: (args, segment_pattern, segment_list) - the list is a CSV of
+               filename,start,end rows, one appended as each segment is closed
+    """
+    
+    if audio_proxy:
+        ext = '.ogg'
+        codec_args = [
+            '-map', '0:a:0',
+            '-ac', '1',
+            '-ar', str(PROXY_SAMPLE_RATE),
+            '-c:a', 'libopus',
+            '-b:a', PROXY_BITRATE,
+            '-application', 'voip'  # Tuned for speech
+        ]
+    else:
+        ext = source_ext
+        codec_args = ['-c', 'copy']  # Fast copy without re-encoding
+    
+    segment_pattern = os.path.join(output_dir, f'segment_%04d{ext}')
+    segment_list = os.path.join(output_dir, 'segments.csv')
+    
+    args = [
+        *codec_args,
+        '-f', 'segment',
+        '-segment_list', segment_list,
+        '-segment_list_type', 'csv',
+        '-reset_timestamps', '1',
+        # Same input and cut points give byte-identical segments (no random Ogg
+        # serials or encoder tags), so the segment cache recognizes stream copies
+        '-fflags', '+bitexact',
+        '-flags:a', '+bitexact',
+    ]
+    
+    return args, segment_pattern, segment_list
+
+def read_segment_list(segment_list, output_dir):
+    """
+    Read the segments listed so far in a segment muxer CSV list.
+    
+    Returns:
+        list: One dict per segment with 'path', 'start_time' and 'duration'
+    """
+    
+    if not os.path.exists(segment_list):
+        return []
+    
+    # Each row is: filename,start,end (actual times in the source media). A line
+    # without its newline is still being written by a running segmenter
+    with open(segment_list, newline='') as f:
+        lines = [line for line in f.read().splitlines(keepends=True) if line.endswith('\n')]
+    rows = [row for row in csv.reader(lines) if len(row) >= 3]
+    
+    if not rows:
+        return []
+    
+    base_time = float(rows[0][1])  # Normalize sources whose timestamps don't start at 0
+    segments = []
+    
+    for filename, start, end in (row[:3] for row in rows):
+        start_time = float(start) - base_time
+        end_time = float(end) - base_time
+        segments.append({
+            'path': os.path.join(output_dir, os.path.basename(filename)),
+            'start_time': start_time,
+            'duration': end_time - start_time
+        })
+    
+    return segments
+
+def is_streamable_prefix(head):
+    """
+    Whether media can be demuxed from the start of the file alone.
+    
+    MP4/MOV files can only be read from a pipe when their index (the moov box)
+    comes before the media data; other containers are read front to back.
+    """
+    
+    if head[4:8] not in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide'):
+        return True  # Not an MP4-family file
+    
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box = struct.unpack('>I4s', head[offset:offset + 8])
+        if box == b'moov':
+            return True
+        if box == b'mdat':
+            return False
+        if size == 1 and offset + 16 <= len(head):
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False  # Box runs to the end of the file, or a truncated header
+        offset += size
+    
+    return False  # No moov among the first STREAM_PROBE_BYTES
+
+class LiveSegmenter:
+    """
+    Cuts media into audio proxy segments while it is still downloading.
+    
+    Downloaded chunks are piped into one ffmpeg segment muxer run with fixed
+    STREAM_SEGMENT_DURATION cuts, and each segment is handed out as soon as
+    ffmpeg closes it and appends it to the segment list. Whether the container
+    can be read from a pipe at all is decided from its first bytes.
+    """
+    
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.process = None
+        self.head = b''
+        self.decided = asyncio.Event()  # Set once streamable is known
+        self.streamable = False
+        self.log_path = os.path.join(output_dir, 'ffmpeg.log')
+    
+    async def feed(self, chunk):
+        """Pipe a downloaded chunk to ffmpeg (the download_video on_chunk callback)"""
+        
+        if not self.decided.is_set():
+            self.head += chunk
+            if len(self.head) < STREAM_PROBE_BYTES:
+                return
+            await self._start()
+            chunk, self.head = self.head, b''
+        
+        if self.process is None or self.process.stdin.is_closing():
+            return
+        
+        try:
+            self.process.stdin.write(chunk)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg gave up; the download carries on and segments() reports the error
+            self.process.stdin.close()
+    
+    async def _start(self):
+        self.streamable = is_streamable_prefix(self.head)
+        
+        if self.streamable:
+            output_args, segment_pattern, self.segment_list = segmenter_output_args(self.output_dir, True, '')
+            with open(self.log_path, 'wb') as log:
+                self.process = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-v', 'error', '-i', 'pipe:0', *output_args,
+                    '-segment_time', str(STREAM_SEGMENT_DURATION), '-y', segment_pattern,
+                    stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=log
+                )
+        
+        self.decided.set()
+    
+    async def finish(self):
+        """Signal the end of the download; ffmpeg then closes the last segment"""
+        
+        if not self.decided.is_set():
+            await self._start()  # Smaller than STREAM_PROBE_BYTES
+            await self.feed(self.head)
+            self.head = b''
+        
+        if self.process is not None and not self.process.stdin.is_closing():
+            self.process.stdin.close()
+    
+    async def abort(self):
+        """Stop ffmpeg, e.g. after the download failed"""
+        
+        self.decided.set()
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+    
+    async def segments(self):
+        """
+        Yield segments as ffmpeg finishes them, numbered from 1.
+        
+        Yields:
+            dict: 'path', 'segment_num', 'start_time' and 'duration'
+        
+        Raises:
+            ValueError: If the media can't be read from a pipe or ffmpeg fails
+        """
+        
+        await self.decided.wait()
+        if self.process is None:
+            raise ValueError("container can't be read before it is fully downloaded")
+        
+        yielded = 0
+        while True:
+            exited = self.process.returncode is not None  # Checked first, so the final list is read after exit
+            
+            for segment in read_segment_list(self.segment_list, self.output_dir)[yielded:]:
+                yielded += 1
+                yield dict(segment, segment_num=yielded)
+            
+            if exited:
+                break
+            
+            try:
+                await asyncio.wait_for(asyncio.shield(self.process.wait()), STREAM_LIST_POLL)
+            except asyncio.TimeoutError:
+                pass
+        
+        if self.process.returncode != 0:
+            with open(self.log_path, errors='replace') as f:
+                raise ValueError(f"ffmpeg exited with {self.process.returncode}: {f.read()[-500:].strip()}")
+
+class TokenBucket:
+    """Thread-safe token bucket; reserve() returns how long the caller must wait"""
+    
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+    
+    def reserve(self, amount):
+        """
+        Take tokens from the bucket, going into debt if needed.
+        
+        Returns:
+            float: Seconds to wait before the reserved tokens are actually available
+        """
+        
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            
+            # Requests bigger than the whole bucket are allowed once it is full
+            self.tokens -= min(amount, self.capacity)
+            return max(0.0, -self.tokens / self.rate)
+    
+    def refund(self, amount):
+        """Return (or, with a negative amount, take) tokens after the real cost is known"""
+        
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class GeminiScheduler:
+    """
+    Process-wide gate around every Gemini API call.
+    
+    Enforces requests-per-minute and tokens-per-minute budgets shared by all
+    jobs, and retries rate-limit (429) and transient server errors with jittered
+    exponential backoff, honouring retry-after hints from the API. Call and retry
+    counts are recorded on the job so they show up in its result.
+    
+    Waits are asyncio sleeps, so a throttled call holds no thread. Coroutine
+    functions (the async generate API) are awaited directly; blocking SDK calls
+    such as upload_file() have no async form and run in the default executor.
+    """
+    
+    def __init__(self, rpm, tpm, max_retries):
+        self.requests = TokenBucket(rpm)
+        self.input_tokens = TokenBucket(tpm)
+        self.max_retries = max_retries
+    
+    async def call(self, kind, fn, *args, job=None, tokens=0, max_retries=None, **kwargs):
+        """
+        Run a Gemini call under the rate limits, retrying transient failures.
+        
+        Args:
+            kind: Short call name for logs ('generate', 'upload', 'get_file', 'delete')
+            fn: The genai function, bound method or coroutine function to call
+            *args, **kwargs: Passed through to fn
+            job: Optional job record that receives call and retry counts
+            tokens: Estimated input tokens, charged against the TPM budget
+            max_retries: Override the scheduler's retry limit for this call
+        """
+        
+        if max_retries is None:
+            max_retries = self.max_retries
+        
+        with trace_span(f"gemini {kind}", category='gemini', tokens=tokens) as span:
+            return await self.call_with_retries(kind, fn, args, kwargs, job, tokens, max_retries, span)
+    
+    async def call_with_retries(self, kind, fn, args, kwargs, job, tokens, max_retries, span):
+        """Retry loop of call(); span receives the attempt count and time spent throttled"""
+        
+        span['throttled_seconds'] = 0.0
+        for attempt in range(max_retries + 1):
+            span['attempts'] = attempt + 1
+            delay = max(self.requests.reserve(1), self.input_tokens.reserve(tokens))
+            if delay > 0:
+                span['throttled_seconds'] = round(span['throttled_seconds'] + delay, 3)
+                await asyncio.sleep(delay)
+            
+            record_job_stat(job, 'gemini_calls')
+            GEMINI_CALLS.labels(kind=kind).inc()
+            
+            try:
+                with GEMINI_IN_FLIGHT.labels(kind=kind).track_inprogress():
+                    if asyncio.iscoroutinefunction(fn):
+                        result = await fn(*args, **kwargs)
+                    else:
+                        result = await asyncio.to_thread(fn, *args, **kwargs)
+                
+                # Correct the token estimate from what the API actually counted
+                usage = getattr(result, 'usage_metadata', None)
+                if tokens and usage is not None and getattr(usage, 'prompt_token_count', None):
+                    self.input_tokens.refund(tokens - usage.prompt_token_count)
+                
+                return result
+                
+            except Exception as e:
+                # A 429 counts against concurrency even when it is not retried (last attempt, polls)
+                rate_limited = is_rate_limit_error(e)
+                if rate_limited:
+                    record_job_stat(job, 'gemini_rate_limited')
+                    segment_concurrency.record_rate_limit()
+                
+                if not is_retryable_error(e) or attempt == max_retries:
+                    raise
+                
+                hint = retry_after_hint(e)
+                backoff = min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * (2 ** attempt))
+                wait_seconds = hint if hint is not None else random.uniform(backoff / 2, backoff)
+                
+                record_job_stat(job, 'gemini_retries')
+                GEMINI_RETRIES.labels(kind=kind, reason='rate_limited' if rate_limited else type(e).__name__).inc()
+                
+                print(f"Gemini {kind} failed ({type(e).__name__}), retry {attempt + 1}/{max_retries} in {wait_seconds:.1f}s")
+                await asyncio.sleep(wait_seconds)
+
+def is_retryable_error(error):
+    """Rate limits, 5xx responses and dropped connections are worth retrying"""
+    
+    if isinstance(error, HttpError):
+        return error.resp.status == 429 or error.resp.status >= 500
+    
+    return isinstance(error, (
+        google_exceptions.TooManyRequests,
+        google_exceptions.ServerError,
+        ConnectionError,
+        TimeoutError
+    ))
+
+def is_rate_limit_error(error):
+    """A 429 from either client library (google.api_core, or googleapiclient for uploads)"""
+    
+    if isinstance(error, HttpError):
+        return error.resp.status == 429
+    return isinstance(error, google_exceptions.TooManyRequests)
+
+def retry_after_hint(error):
+    """
+    Extract the server's suggested retry delay from an API error, if any.
+    
+    Returns:
+        float: Seconds to wait, or None when the error carries no hint
+    """
+    
+    if isinstance(error, HttpError):
+        headers = error.resp  # httplib2 response: a dict of lower-cased headers
+    else:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+    if headers.get('retry-after'):
+        try:
+            return float(headers['retry-after'])
+        except ValueError:
+            pass
+    
+    # RetryInfo details render as "retry_delay { seconds: 17 }"; messages say "retry in 17.2s"
+    message = str(error)
+    match = re.search(r'retry_delay\s*\{\s*seconds:\s*(\d+)', message) or re.search(r'retry in ([\d.]+)\s*s', message)
+    if match:
+        return float(match.group(1))
+    
+    return None
+
+def estimate_input_tokens(contents):
+    """Rough input-token estimate for a generate_content request"""
+    
+    tokens = 0
+    for part in contents:
+        if isinstance(part, str):
+            tokens += len(part) // 4
+        elif isinstance(part, dict):
+            tokens += 258  # One inline image
+        else:
+            media_kind = (getattr(part, 'mime_type', '') or '').split('/')[0]
+            tokens += int(getattr(part, 'size_bytes', 0) * TOKENS_PER_BYTE.get(media_kind, TOKENS_PER_BYTE['video']))
+    return tokens
+
+class GeminiBackend:
+    """
+    Model backend on the google-generativeai SDK.
+    
+    Every model call in the pipeline goes through the module's model_backend, so
+    a stand-in (StubBackend) can replace Gemini without touching the call sites.
+    The methods are blocking; GeminiScheduler.call() runs them off the loop.
+    """
+    
+    name = 'gemini'
+    
+    def model(self, model_name, generation_config=None):
+        """A model with generate_content_async() and count_tokens_async()"""
+        
+        return genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+    
+    def upload_file(self, path, display_name, mime_type):
+        return genai.upload_file(path=path, display_name=display_name, mime_type=mime_type)
+    
+    def get_file(self, name):
+        return genai.get_file(name)
+    
+    def delete_file(self, name):
+        return genai.delete_file(name)
+
+class StubFile:
+    """Uploaded file of the stub backend, PROCESSING until its ready time"""
+    
+    def __init__(self, name, display_name, mime_type, size_bytes, ready_at):
+        self.name = name
+        self.display_name = display_name
+        self.mime_type = mime_type
+        self.size_bytes = size_bytes
+        self.uri = f"stub://{name}"
+        self.ready_at = ready_at
+    
+    @property
+    def state(self):
+        return SimpleNamespace(name='ACTIVE' if time.time() >= self.ready_at else 'PROCESSING')
+
+class StubResponse:
+    """generate_content result: text, usage metadata and, when streamed, chunks"""
+    
+    def __init__(self, text, prompt_tokens, chunk_delay=0.0):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(prompt_token_count=prompt_tokens)
+        self.chunk_delay = chunk_delay
+    
+    async def __aiter__(self):
+        words = self.text.split(' ')
+        for start in range(0, len(words), 20):
+            await asyncio.sleep(self.chunk_delay)
+            yield SimpleNamespace(text=' '.join(words[start:start + 20]) + (' ' if start + 20 < len(words) else ''))
+
+class StubModel:
+    """Model of the stub backend: answers after a simulated latency, sometimes with a 429"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+    
+    async def generate_content_async(self, contents, stream=False, request_options=None):
+        self.backend.maybe_rate_limit()
+        
+        files = [part for part in contents if isinstance(part, StubFile)]
+        media_mb = sum(f.size_bytes for f in files) / (1024 * 1024)
+        latency = STUB_GENERATE_SECONDS + media_mb * STUB_GENERATE_SECONDS_PER_MB
+        prompt = ' '.join(part for part in contents if isinstance(part, str))
+        
+        if files:
+            # Transcript-style output; stamps restart at 00:00, which Transcript.parse() shifts
+            text = '\n'.join(f"[{format_timestamp(i * 15)}] Speaker {i % 2 + 1}: stub line {i + 1}" for i in range(8))
+        else:
+            text = f"Stub response to a {len(prompt)}-character prompt. " * 10
+        
+        response = StubResponse(text.strip(), estimate_input_tokens(contents))
+        if stream:
+            # Time to first chunk, then the rest of the latency spread over the chunks
+            chunks = max(1, math.ceil(len(text.split(' ')) / 20))
+            await asyncio.sleep(latency / 2)
+            response.chunk_delay = latency / 2 / chunks
+        else:
+            await asyncio.sleep(latency)
+        return response
+    
+    async def count_tokens_async(self, contents):
+        return SimpleNamespace(total_tokens=estimate_input_tokens(contents))
+
+class StubBackend:
+    """
+    Local stand-in for Gemini with simulated upload, processing and generation times.
+    
+    Nothing leaves the process: uploads are timed by STUB_UPLOAD_MBPS, files
+    stay PROCESSING for STUB_PROCESSING_SECONDS_PER_MB, generate calls take
+    STUB_GENERATE_SECONDS (plus STUB_GENERATE_SECONDS_PER_MB of attached media),
+    and STUB_RATE_LIMIT_PROBABILITY of upload and generate calls fail with a 429
+    carrying a retry hint. Used for benchmarks and load tests.
+    """
+    
+    name = 'stub'
+    
+    def __init__(self, seed=None):
+        self.files = {}
+        self.random = random.Random(seed)
+        self.rate_limited = 0
+    
+    def maybe_rate_limit(self):
+        if self.random.random() < STUB_RATE_LIMIT_PROBABILITY:
+            self.rate_limited += 1
+            raise google_exceptions.TooManyRequests(f"Stub quota exceeded, retry in {self.random.uniform(0.5, 2):.1f}s")
+    
+    def model(self, model_name, generation_config=None):
+        return StubModel(self)
+    
+    async def upload_file(self, path, display_name, mime_type):
+        self.maybe_rate_limit()
+        size = os.path.getsize(path)
+        await asyncio.sleep(size / (1024 * 1024) / STUB_UPLOAD_MBPS)
+        
+        uploaded = StubFile(
+            f"files/stub-{uuid.uuid4().hex[:12]}", display_name, mime_type, size,
+            time.time() + size / (1024 * 1024) * STUB_PROCESSING_SECONDS_PER_MB
+        )
+        self.files[uploaded.name] = uploaded
+        return uploaded
+    
+    async def get_file(self, name):
+        if name not in self.files:
+            raise google_exceptions.NotFound(f"File {name} not found")
+        return self.files[name]
+    
+    async def delete_file(self, name):
+        self.files.pop(name, None)
+
+def create_model_backend(name):
+    """The model backend selected by MODEL_BACKEND"""
+    
+    backends = {'gemini': GeminiBackend, 'stub': lambda: StubBackend(STUB_SEED)}
+    if name not in backends:
+        raise ValueError(f"Unknown MODEL_BACKEND {name!r}, expected one of: {', '.join(backends)}")
+    return backends[name]()
+
+model_backend = create_model_backend(MODEL_BACKEND)
+gemini_scheduler = GeminiScheduler(GEMINI_RPM, GEMINI_TPM, GEMINI_MAX_RETRIES)
+
+async def generate_text(model, contents, job=None, stage=None, **kwargs):
+    """
+    Generate text, streaming it token by token when STREAM_GENERATION is on.
+    
+    Streamed chunks are forwarded to the job's event stream as '<stage>_delta'
+    events. If the stream breaks after some text has arrived, the partial text
+    is kept (with a note appended) instead of failing the whole stage; the
+    stage is then marked partial.
+    
+    Args:
+        model: GenerativeModel to call
+        contents: Content parts for the request
+        job: Optional job record that receives events and Gemini call counts
+        stage: Stage name used for delta events ('context' or 'analysis')
+        **kwargs: Passed through to generate_content_async (e.g. request_options)
+    
+    Returns:
+        str: The generated text
+    """
+    
+    if not STREAM_GENERATION:
+        response = await generate_content(model, contents, job=job, **kwargs)
+        return response.text
+    
+    # Errors before the first chunk are retried by the scheduler like any other call
+    response = await gemini_scheduler.call(
+        'generate', model.generate_content_async, contents,
+        job=job, tokens=estimate_input_tokens(contents), stream=True, **kwargs
+    )
+    
+    chunks = []
+    try:
+        async for chunk in response:
+            text = chunk.text
+            chunks.append(text)
+            if stage:
+                emit_job_event(job, f'{stage}_delta', text=text)
+    except Exception as e:
+        if not chunks:
+            raise
+        print(f"⚠️  Stream broke after {sum(len(c) for c in chunks)} characters ({type(e).__name__}: {e}), keeping partial output")
+        record_job_stat(job, 'partial_outputs')
+        if stage:
+            update_job_stage(job, stage, partial=True)
+        chunks.append(f"\n\n[Output incomplete: generation stopped early ({type(e).__name__})]")
+    
+    return ''.join(chunks)
+
+class ConcurrencyController:
+    """
+    AIMD limit on how many segments are in flight with Gemini across all jobs.
+    
+    A segment holds a slot from upload until its transcript comes back. The limit
+    grows by one after each full round of healthy completions and is cut
+    multiplicatively when Gemini returns a 429 or when p95 latency (per second
+    of media, so long and short segments compare fairly) rises well above the
+    best level seen.
+    
+    Slots are awaited on the engine loop; state changes happen on that loop only,
+    so snapshot() can be read from request threads without locking.
+    """
+    
+    def __init__(self, initial, min_limit, max_limit):
+        self.limit = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.waiting = 0
+        self.latencies = deque(maxlen=CONCURRENCY_LATENCY_WINDOW)
+        self.baseline_p95 = None
+        self.successes_since_change = 0
+        self.last_decrease = 0.0
+        self.rate_limited = 0
+        self.condition = asyncio.Condition()
+    
+    async def acquire(self):
+        """Wait until a segment slot is free"""
+        
+        async with self.condition:
+            self.waiting += 1
+            try:
+                await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+    
+    async def release(self, latency, media_seconds, success=True):
+        """
+        Return a slot and feed the segment's outcome into the controller.
+        
+        Args:
+            latency: Seconds the segment held its slot
+            media_seconds: Duration of media in the segment
+            success: Whether the segment was transcribed
+        """
+        
+        async with self.condition:
+            self.in_flight -= 1
+            
+            if success and media_seconds > 0:
+                self.latencies.append(latency / media_seconds)
+                self.successes_since_change += 1
+                self._adjust()
+            
+            self.condition.notify_all()
+    
+    def record_rate_limit(self):
+        """A 429 from any Gemini call means we are over quota: back off"""
+        
+        self.rate_limited += 1
+        self._decrease('rate limited')
+    
+    def _p95(self):
+        return float(np.percentile(self.latencies, 95)) if len(self.latencies) >= 5 else None
+    
+    def _adjust(self):
+        p95 = self._p95()
+        if p95 is None:
+            return
+        
+        # The best level seen drifts up slowly so a change in workload doesn't pin the limit down
+        if self.baseline_p95 is None:
+            self.baseline_p95 = p95
+        else:
+            self.baseline_p95 = min(p95, self.baseline_p95 * 1.05)
+        
+        if p95 > self.baseline_p95 * CONCURRENCY_LATENCY_GROWTH:
+            self._decrease(f'p95 latency {p95:.2f}s per media second')
+        elif self.successes_since_change >= self.limit and self.limit < self.max_limit:
+            self.limit += 1
+            self.successes_since_change = 0
+            print(f"📈 Segment concurrency raised to {self.limit}")
+    
+    def _decrease(self, reason):
+        now = time.time()
+        if now - self.last_decrease < CONCURRENCY_COOLDOWN:
+            return
+        
+        new_limit = max(self.min_limit, int(self.limit * CONCURRENCY_DECREASE_FACTOR))
+        if new_limit < self.limit:
+            print(f"📉 Segment concurrency lowered to {new_limit} ({reason})")
+        self.limit = new_limit
+        self.last_decrease = now
+        self.successes_since_change = 0
+        self.latencies.clear()
+    
+    def snapshot(self):
+        latencies = list(self.latencies)
+        return {
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'p95_seconds_per_media_second': float(np.percentile(latencies, 95)) if len(latencies) >= 5 else None,
+            'baseline_p95_seconds_per_media_second': self.baseline_p95,
+            'rate_limited_total': self.rate_limited
+        }
+
+segment_concurrency = ConcurrencyController(SEGMENT_CONCURRENCY_INITIAL, SEGMENT_CONCURRENCY_MIN, SEGMENT_CONCURRENCY_MAX)
+
+async def generate_content(model, contents, job=None, **kwargs):
+    """Call model.generate_content_async through the shared Gemini scheduler"""
+    
+    return await gemini_scheduler.call(
+        'generate', model.generate_content_async, contents,
+        job=job, tokens=estimate_input_tokens(contents), **kwargs
+    )
+
+class FilePoller:
+    """
+    Waits for uploaded Gemini files to finish PROCESSING in one engine-loop task.
+    
+    Every pending upload across all jobs is watched here instead of in a sleep loop
+    per upload. The first check is scheduled from the file size and later checks
+    back off in proportion to the time already waited, so a file that becomes
+    ready is noticed quickly without hammering get_file(). Waiters get an asyncio
+    Future that resolves to the ACTIVE file as soon as it is seen.
+    """
+    
+    def __init__(self):
+        self._pending = {}  # file name -> watch entry
+        self._wakeup = None
+        self._task = None
+    
+    def watch(self, uploaded, size_bytes=0, job=None):
+        """
+        Start watching an uploaded file (call from the engine loop).
+        
+        Args:
+            uploaded: Gemini file object returned by upload_file()
+            size_bytes: Size of the uploaded file, used to schedule the first check
+            job: Optional job record that receives Gemini call counts
+        
+        Returns:
+            asyncio.Future: Resolves to the ACTIVE file, or raises ValueError if processing fails
+        """
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        if uploaded.state.name != "PROCESSING":
+            self._resolve(future, uploaded)
+            return future
+        
+        now = time.time()
+        first_delay = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, size_bytes / (1024 * 1024) * POLL_SECONDS_PER_MB))
+        
+        self._pending[uploaded.name] = {
+            'future': future,
+            'display_name': uploaded.display_name,
+            'job': job,
+            'started_at': now,
+            'next_check': now + first_delay
+        }
+        
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        
+        self._wakeup.set()
+        return future
+    
+    def _resolve(self, future, uploaded):
+        if future.done():
+            return  # Waiter was cancelled
+        if uploaded.state.name == "FAILED":
+            future.set_exception(ValueError(f"Gemini could not process {uploaded.display_name}"))
+        else:
+            future.set_result(uploaded)
+    
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            
+            if not self._pending:
+                await self._wakeup.wait()
+                continue
+            
+            # Waiters that were cancelled (job failed or shut down) need no more checks
+            for name in [name for name, entry in self._pending.items() if entry['future'].done()]:
+                del self._pending[name]
+            if not self._pending:
+                continue
+            
+            now = time.time()
+            due = [name for name, entry in self._pending.items() if entry['next_check'] <= now]
+            
+            if not due:
+                next_check = min(entry['next_check'] for entry in self._pending.values())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=next_check - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            # Due files are checked together; each check is an independent request
+            checked = await asyncio.gather(*(self._check(name) for name in due))
+            
+            for name, uploaded in zip(due, checked):
+                entry = self._pending[name]
+                waited = time.time() - entry['started_at']
+                
+                if isinstance(uploaded, Exception):
+                    del self._pending[name]
+                    if not entry['future'].done():
+                        entry['future'].set_exception(uploaded)
+                elif uploaded is not None and uploaded.state.name != "PROCESSING":
+                    del self._pending[name]
+                    print(f"{entry['display_name']} is {uploaded.state.name} after {waited:.1f}s")
+                    self._resolve(entry['future'], uploaded)
+                elif waited > POLL_TIMEOUT:
+                    del self._pending[name]
+                    if not entry['future'].done():
+                        entry['future'].set_exception(
+                            TimeoutError(f"{entry['display_name']} still processing after {int(waited)}s")
+                        )
+                else:
+                    interval = min(POLL_MAX_INTERVAL, max(POLL_MIN_INTERVAL, waited * POLL_BACKOFF))
+                    entry['next_check'] = time.time() + interval
+    
+    async def _check(self, name):
+        """Returns the file, None to check again later, or the error if the file can never become ACTIVE"""
+        
+        try:
+            # No retries here: a failed check is simply repeated on the next interval
+            return await gemini_scheduler.call('get_file', model_backend.get_file, name, job=self._pending[name]['job'], max_retries=0)
+        except (google_exceptions.NotFound, google_exceptions.PermissionDenied) as e:
+            print(f"Giving up on {name}: {e}")
+            return e
+        except Exception as e:
+            print(f"Error checking state of {name}: {e}")
+            return None
+
+file_poller = FilePoller()
+
+TIMESTAMP_LINE = re.compile(
+    r'^\[(?:(\d+):)?(\d{1,3}):(\d{2})(?:\s*-\s*(?:\d+:)?\d{1,3}:\d{2})?\]\s*(.*)$'
+)
+SPEAKER_PREFIX = re.compile(r'^\**([^:\[\]*]{1,40}?)\**:\**\s+(.*)$')
+
+def format_timestamp(seconds, hours=False):
+    """Format seconds as MM:SS, or HH:MM:SS for an hour or more (or when hours is set)"""
+    
+    seconds = int(seconds)
+    if hours or seconds >= 3600:
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+def parse_timestamp(value):
+    """Parse seconds ('754', '754.5') or a clock time ('12:34', '01:02:03') into seconds"""
+    
+    parts = str(value).strip().split(':')
+    if len(parts) > 3:
+        raise ValueError(f"Invalid time: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if not math.isfinite(seconds):
+        raise ValueError(f"Invalid time: {value}")
+    return seconds
+
+class TranscriptLine:
+    """One transcript line: integer start/end offsets in seconds, speaker and text"""
+    
+    __slots__ = ('start', 'end', 'speaker', 'text')
+    
+    def __init__(self, start, end, speaker, text):
+        self.start = start
+        self.end = end
+        self.speaker = speaker
+        self.text = text
+    
+    def to_dict(self):
+        return {'start': self.start, 'end': self.end, 'speaker': self.speaker, 'text': self.text}
+
+class Transcript:
+    """
+    Parsed transcript stored as parallel arrays.
+    
+    Start and end offsets are integer seconds from the start of the media in
+    array('i') columns, speakers are interned to small integer ids, and starts
+    are kept sorted so time windows are found by binary search. Lines are
+    materialized as TranscriptLine records only when iterated.
+    """
+    
+    __slots__ = ('starts', 'ends', 'speaker_ids', 'texts', 'speakers', '_speaker_index')
+    
+    def __init__(self):
+        self.starts = array('i')
+        self.ends = array('i')
+        self.speaker_ids = array('h')  # -1 for lines without a speaker
+        self.texts = []
+        self.speakers = []
+        self._speaker_index = {}
+    
+    def __len__(self):
+        return len(self.texts)
+    
+    def __iter__(self):
+        for i in range(len(self.texts)):
+            yield self.line(i)
+    
+    def line(self, i):
+        speaker_id = self.speaker_ids[i]
+        return TranscriptLine(
+            self.starts[i], self.ends[i], self.speakers[speaker_id] if speaker_id >= 0 else None, self.texts[i]
+        )
+    
+    def append(self, start, end, speaker, text):
+        """Add a line after the existing ones (start must not go backwards)"""
+        
+        if speaker is None:
+            speaker_id = -1
+        else:
+            speaker_id = self._speaker_index.get(speaker)
+            if speaker_id is None:
+                speaker_id = self._speaker_index[speaker] = len(self.speakers)
+                self.speakers.append(speaker)
+        
+        self.starts.append(int(start))
+        self.ends.append(int(end))
+        self.speaker_ids.append(speaker_id)
+        self.texts.append(text)
+    
+    @classmethod
+    def parse(cls, text, start_time=0, end_time=None):
+        """
+        Parse model output ("[MM:SS] Speaker: dialogue" lines) for one segment.
+        
+        Accepts [MM:SS], [MMM:SS] and [H:MM:SS] stamps. Timestamps that restart
+        at 00:00 instead of continuing from start_time are detected from all of
+        the segment's stamps and shifted. Lines without a stamp are joined to the
+        previous line.
+        
+        Args:
+            text: Transcript text returned by the model
+            start_time: Segment start in seconds from the beginning of the media
+            end_time: Segment end in seconds, used as the end of the last line
+        
+        Returns:
+            Transcript
+        """
+        
+        entries = []  # [start, speaker, text]
+        
+        for raw in text.splitlines():
+            raw = raw.strip()
+            if not raw:
+                continue
+            
+            match = TIMESTAMP_LINE.match(raw)
+            if match is None:
+                if entries:
+                    entries[-1][2] += ' ' + raw
+                else:
+                    entries.append([None, None, raw])
+                continue
+            
+            hours, minutes, seconds, body = match.groups()
+            start = int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            
+            speaker_match = SPEAKER_PREFIX.match(body)
+            if speaker_match:
+                entries.append([start, speaker_match.group(1).strip(), speaker_match.group(2)])
+            else:
+                entries.append([start, None, body])
+        
+        stamps = [entry[0] for entry in entries if entry[0] is not None]
+        
+        # Relative stamps sit near 0 rather than near start_time, and never run past the segment length
+        if stamps and start_time > 0:
+            span = (end_time - start_time) if end_time is not None else None
+            if abs(stamps[0]) < abs(stamps[0] - start_time) and (span is None or max(stamps) <= span + 30):
+                print("Warning: Timestamps appear to restart. Adjusting...")
+                for entry in entries:
+                    if entry[0] is not None:
+                        entry[0] += int(start_time)
+        
+        transcript = cls()
+        previous = int(start_time)
+        starts = []
+        for entry in entries:
+            # Keep starts inside the segment and in order so lookups can bisect
+            start = previous if entry[0] is None else max(entry[0], previous)
+            if end_time is not None:
+                start = min(start, int(end_time))
+            starts.append(start)
+            previous = start
+        
+        for i, (start, (_, speaker, body)) in enumerate(zip(starts, entries)):
+            if i + 1 < len(starts):
+                end = starts[i + 1]
+            elif end_time is not None:
+                end = max(start, int(end_time))
+            else:
+                end = start
+            transcript.append(start, end, speaker, body)
+        
+        return transcript
+    
+    @classmethod
+    def single(cls, start, end, text):
+        """A transcript holding one speakerless line, e.g. a silence or error marker"""
+        
+        transcript = cls()
+        transcript.append(start, end, None, text)
+        return transcript
+    
+    def shifted(self, seconds):
+        """Copy of the transcript with every offset moved by seconds (never below 0)"""
+        
+        shifted = Transcript()
+        for line in self:
+            shifted.append(max(0, line.start + seconds), max(0, line.end + seconds), line.speaker, line.text)
+        return shifted
+    
+    @classmethod
+    def from_records(cls, records):
+        """Rebuild a transcript from to_records() output"""
+        
+        transcript = cls()
+        for record in records:
+            transcript.append(record['start'], record['end'], record['speaker'], record['text'])
+        return transcript
+    
+    @classmethod
+    def concat(cls, transcripts):
+        """Join segment transcripts, in time order, into one transcript"""
+        
+        combined = cls()
+        for transcript in transcripts:
+            for i in range(len(transcript)):
+                speaker_id = transcript.speaker_ids[i]
+                combined.append(
+                    max(transcript.starts[i], combined.starts[-1] if len(combined) else 0),
+                    max(transcript.ends[i], combined.ends[-1] if len(combined) else 0),
+                    transcript.speakers[speaker_id] if speaker_id >= 0 else None,
+                    transcript.texts[i]
+                )
+        return combined
+    
+    def window(self, start=None, end=None):
+        """
+        Lines overlapping [start, end) seconds, found by binary search.
+        
+        Returns:
+            Transcript: A new transcript with just those lines
+        """
+        
+        first = 0 if start is None else bisect.bisect_right(self.ends, int(start))
+        last = len(self) if end is None else bisect.bisect_left(self.starts, int(math.ceil(end)))
+        
+        # Zero-length lines at the window start still belong to it
+        while first > 0 and start is not None and self.starts[first - 1] == self.ends[first - 1] == int(start):
+            first -= 1
+        
+        window = Transcript()
+        for i in range(first, max(first, last)):
+            speaker_id = self.speaker_ids[i]
+            window.append(
+                self.starts[i], self.ends[i],
+                self.speakers[speaker_id] if speaker_id >= 0 else None,
+                self.texts[i]
+            )
+        return window
+    
+    def to_text(self):
+        """Render as "[MM:SS] Speaker: text" lines, using HH:MM:SS throughout for media past an hour"""
+        
+        hours = len(self) > 0 and self.ends[-1] >= 3600
+        rendered = []
+        for line in self:
+            prefix = f"[{format_timestamp(line.start, hours)}]"
+            rendered.append(f"{prefix} {line.speaker}: {line.text}" if line.speaker else f"{prefix} {line.text}")
+        return "\n".join(rendered)
+    
+    def to_records(self):
+        return [line.to_dict() for line in self]
+    
+    def to_ndjson(self):
+        return "".join(json.dumps(line.to_dict()) + "\n" for line in self)
+    
+    def to_srt(self):
+        cues = []
+        for number, line in enumerate(self, start=1):
+            text = f"{line.speaker}: {line.text}" if line.speaker else line.text
+            cues.append(
+                f"{number}\n{format_cue_time(line.start, ',')} --> {format_cue_time(max(line.end, line.start + 1), ',')}\n{text}\n"
+            )
+        return "\n".join(cues)
+    
+    def to_vtt(self):
+        cues = ["WEBVTT\n"]
+        for line in self:
+            text = f"<v {line.speaker}>{line.text}" if line.speaker else line.text
+            cues.append(f"{format_cue_time(line.start, '.')} --> {format_cue_time(max(line.end, line.start + 1), '.')}\n{text}\n")
+        return "\n".join(cues)
+
+def format_cue_time(seconds, separator):
+    """Subtitle cue time: HH:MM:SS,mmm (SRT) or HH:MM:SS.mmm (WebVTT)"""
+    
+    return f"{format_timestamp(seconds, hours=True)}{separator}000"
+
+@timed_stage('transcribe')
+async def transcribe_segment(video_file, segment_num, start_time, is_audio_only=False, job=None, end_time=None):
+    """Transcribe a single video or audio segment with continuous timestamps
+    
+    Returns a parsed Transcript whose offsets are relative to the start of the full media.
+    Raises the API error if the request still fails after the scheduler's retries,
+    so the caller can record the segment as failed rather than as a silent gap.
+    """
+    
+    media_type = "audio" if is_audio_only else "video"
     print(f"Transcribing {media_type} segment {segment_num} (starting at {start_time}s)...")
     
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
-        generation_config={
-            "max_output_tokens": 8192,
-            "temperature": 0.0,
-        }
-    )
+    model = model_backend.model(
+        "gemini-2.5-flash",
+        generation_config={
+            "max_output_tokens": 8192,
+            "temperature": 0.0,
+        }
+    )
+    
+    # Format start time for display; past an hour stamps need an hours field
+    start_stamp = format_timestamp(start_time)
+    stamp_format = "HH:MM:SS" if start_time >= 3600 else "MM:SS"
+    example_start = 3600 + 240 if start_time >= 3600 else 240
+    
+    prompt = f"""Transcribe ALL spoken audio in this {media_type} segment.
+
+CRITICAL: This segment is part of a longer {media_type} and starts at timestamp [{start_stamp}].
+
+Your timestamps MUST start at [{start_stamp}] and count UP from there.
+
+For example, if this segment starts at [{format_timestamp(example_start)}]:
+- First line should be [{format_timestamp(example_start)}] or [{format_timestamp(example_start + 5)}] (not [{format_timestamp(0, start_time >= 3600)}])
+- Second line might be [{format_timestamp(example_start + 15)}] (not [{format_timestamp(15, start_time >= 3600)}])
+- Continue counting up: [{format_timestamp(example_start + 30)}], [{format_timestamp(example_start + 45)}], [{format_timestamp(example_start + 60)}], etc.
+
+Format:
+[{stamp_format}] Speaker: dialogue
+
+Transcription starting at [{start_stamp}]:"""
+
+    try:
+        response = await generate_content(
+            model,
+            [video_file, prompt],
+            job=job,
+            request_options={"timeout": 300}
+        )
+        
+        transcript = Transcript.parse(response.text.strip(), start_time, end_time)
+        
+        print(f"Segment {segment_num} transcribed: {len(transcript)} lines")
+        
+        return transcript
+        
+    except Exception as e:
+        print(f"Error transcribing segment {segment_num}: {e}")
+        raise
+
+async def summarize_segment(transcript, segment_num, start_time, end_time, job=None, source="transcript excerpt"):
+    """
+    Condense one segment's transcript into a compact structured summary.
+    
+    Text-only and small, so it runs alongside the remaining transcriptions. The
+    summaries stand in for the transcript when it is too long for the final prompts.
+    
+    Args:
+        transcript: Text to summarize
+        segment_num: Segment number (for logging)
+        start_time: Start of the covered span in seconds
+        end_time: End of the covered span in seconds
+        job: Optional job record that receives Gemini call counts
+        source: What the text is, as named in the prompt
+    
+    Returns:
+        dict: 'segment_num', 'start_time', 'end_time' and 'summary', or None on failure
+    """
+    
+    model = model_backend.model(
+        "gemini-2.5-flash",
+        generation_config={
+            "max_output_tokens": 512,
+            "temperature": 0.2,
+        }
+    )
+    
+    prompt = f"""Summarize this {source} for a later psychological analysis of the whole recording.
+
+{source.upper()}:
+{transcript}
+
+---
+
+Reply in exactly this format, keeping each line short:
+Names: every person named, with how many times each is mentioned, e.g. "Ana (3), Ben (1)" (or "none")
+Speakers: who speaks and how
+Emotional beats: the main shifts in feeling, with [MM:SS] timestamps
+Themes: recurring topics, images or metaphors
+Summary: two or three sentences on what happens"""
+    
+    try:
+        response = await generate_content(model, [prompt], job=job, request_options={"timeout": 120})
+        summary = response.text.strip()
+    except Exception as e:
+        print(f"Could not summarize segment {segment_num}: {e}")
+        return None
+    
+    return {
+        'segment_num': segment_num,
+        'start_time': start_time,
+        'end_time': end_time,
+        'summary': summary
+    }
+
+async def merge_summaries(summaries, job=None):
+    """Merge consecutive segment summaries into one summary covering their whole span"""
+    
+    combined = await summarize_segment(
+        format_summaries(summaries),
+        summaries[0]['segment_num'],
+        summaries[0]['start_time'],
+        summaries[-1]['end_time'],
+        job=job,
+        source="sequence of summaries of consecutive parts of a transcript"
+    )
+    
+    if combined is None:
+        # Keep the parts rather than lose them; the next level tries again
+        return summaries
+    
+    return [combined]
+
+def format_summaries(summaries):
+    """Render summaries in time order with their [MM:SS - MM:SS] (or HH:MM:SS) ranges"""
+    
+    blocks = []
+    for item in summaries:
+        start, end = item['start_time'], item['end_time']
+        blocks.append(
+            f"[{format_timestamp(start)} - {format_timestamp(end)}]\n{item['summary']}"
+        )
+    return "\n\n".join(blocks)
+
+async def count_tokens(text, job=None):
+    """Count prompt tokens for text with the Gemini tokenizer"""
+    
+    model = model_backend.model("gemini-2.5-flash")
+    result = await gemini_scheduler.call('count_tokens', model.count_tokens_async, [text], job=job)
+    return result.total_tokens
+
+async def prepare_prompt_transcript(transcript, summaries, job=None):
+    """
+    Fit the transcript material for the context and analysis prompts into PROMPT_TOKEN_BUDGET.
+    
+    The full transcript is used when it fits. Otherwise the per-segment summaries
+    are used, merging neighbouring summaries in parallel (map-reduce) until they
+    fit, so prompt size stays bounded however long the media is.
+    
+    Args:
+        transcript: Full transcript text
+        summaries: Per-segment summaries from transcribe_video_in_segments()
+        job: Optional job record that receives Gemini call counts
+    
+    Returns:
+        str: Prompt-ready transcript material, or None to let the prompts fall
+             back to excerpting the transcript
+    """
+    
+    if TRANSCRIPT_MODE != 'hierarchical':
+        return None
+    
+    try:
+        tokens = await count_tokens(transcript, job=job)
+    except Exception as e:
+        print(f"Could not count transcript tokens: {e}")
+        return None
+    
+    if tokens <= PROMPT_TOKEN_BUDGET:
+        print(f"Transcript fits the prompt budget ({tokens} tokens)")
+        return transcript
+    
+    if not summaries:
+        print(f"Transcript is {tokens} tokens and no segment summaries are available, using excerpts")
+        return None
+    
+    for level in range(SUMMARY_MERGE_LEVELS + 1):
+        material = format_summaries(summaries)
+        try:
+            tokens = await count_tokens(material, job=job)
+        except Exception as e:
+            print(f"Could not count summary tokens: {e}")
+            return None
+        
+        print(f"📚 {len(summaries)} segment summaries: {tokens} tokens (budget {PROMPT_TOKEN_BUDGET})")
+        
+        if tokens <= PROMPT_TOKEN_BUDGET:
+            return (
+                "[The full transcript is too long to include. These are summaries of consecutive "
+                "parts of it, in order, with their time ranges.]\n\n" + material
+            )
+        
+        if level == SUMMARY_MERGE_LEVELS or len(summaries) == 1:
+            break
+        
+        # Merge groups sized so each merged input is about half the budget
+        group_size = max(2, int(len(summaries) * PROMPT_TOKEN_BUDGET / (2 * tokens)))
+        groups = [summaries[i:i + group_size] for i in range(0, len(summaries), group_size)]
+        merged = await asyncio.gather(*(merge_summaries(group, job=job) for group in groups))
+        summaries = [item for group in merged for item in group]
+    
+    print("Segment summaries still exceed the prompt budget, using excerpts")
+    return None
+
+async def transcribe_segment_worker(segment_path, segment_num, start_time, duration, is_audio, silence_ratio=None, job=None,
+                                    source_path=None, audio_hash=None):
+    """
+    Take one segment from silence check to transcript - run as a task per segment.
+    
+    Silent segments are skipped. Otherwise the segment waits for a slot in the
+    shared concurrency budget, is uploaded, waits on the shared FilePoller until
+    Gemini has processed it, and is transcribed. All waits are awaits on the
+    engine loop, so a segment in flight holds no thread.
+    
+    Args:
+        segment_path: Path to the segment file
+        segment_num: Segment number (for logging)
+        start_time: Start time in seconds from beginning of full media
+        duration: Duration of this segment
+        is_audio: Whether this is audio-only media
+        silence_ratio: Silence ratio of this segment from the job's audio energy map
+        job: Optional job record that receives Gemini call counts
+        source_path: Full media file the segment was cut from, if it is on disk
+        audio_hash: Hash of the segment file's decoded audio, if already known
+    
+    Returns:
+        dict: Result containing transcript or error info
+    """
+    
+    # Finished before a restart: nothing to redo
+    resumed = get_checkpoint(job, f"segment:{segment_num}")
+    if resumed is not None:
+        return {
+            'success': True,
+            'segment_num': segment_num,
+            'transcript': Transcript.from_records(resumed['transcript']),
+            'skipped': resumed['skipped'],
+            'cached': resumed['cached'],
+            'resumed': True
+        }
+    
+    # Check for silence first (OPTIMIZATION #1: Smart Silence Detection)
+    if silence_ratio is not None and silence_ratio > 0.80:
+        # Segment is >80% silent - skip transcription
+        print(f"⏭️  Segment {segment_num} is {silence_ratio*100:.1f}% silent - skipping transcription")
+        
+        return {
+            'success': True,
+            'segment_num': segment_num,
+            'transcript': Transcript.single(
+                start_time, start_time + duration, "[Mostly silent - no significant audio content]"
+            ),
+            'skipped': True
+        }
+    
+    # A segment with the same content as one transcribed in an earlier job is not transcribed again
+    segment_hash = None
+    if result_cache is not None:
+        try:
+            segment_hash = await segment_content_hash(segment_path, start_time, duration, is_audio, source_path, audio_hash)
+            cached = await asyncio.to_thread(result_cache.get_segment, segment_hash, start_time)
+        except (OSError, RuntimeError, sqlite3.Error) as e:
+            print(f"Segment cache lookup failed for segment {segment_num}: {e}")
+            cached = None
+        
+        if cached is not None:
+            print(f"♻️  Segment {segment_num} found in segment cache")
+            record_job_stat(job, 'segment_cache_hits')
+            return {
+                'success': True,
+                'segment_num': segment_num,
+                'transcript': cached,
+                'skipped': False,
+                'cached': True
+            }
+    
+    # Wait for a slot in the shared segment concurrency budget
+    with trace_span('wait_slot', category='segment'):
+        await segment_concurrency.acquire()
+    acquired_at = time.time()
+    success = False
+    video_file = None
+    
+    try:
+        # Upload segment to Gemini
+        print(f"Uploading segment {segment_num}...")
+        video_file = await upload_to_gemini(segment_path, f"segment_{segment_num}", job=job)
+        
+        try:
+            with stage_timer('file_wait'):
+                active_file = await file_poller.watch(video_file, os.path.getsize(segment_path), job=job)
+        except (ValueError, TimeoutError) as e:
+            print(f"Segment {segment_num} processing failed: {e}")
+            return {
+                'success': False,
+                'segment_num': segment_num,
+                'transcript': Transcript.single(
+                    start_time, start_time + duration, f"[Segment {segment_num} processing failed]"
+                ),
+                'skipped': False
+            }
+        
+        # Transcribe segment
+        transcript = await transcribe_segment(
+            active_file, segment_num, start_time, is_audio, job=job, end_time=start_time + duration
+        )
+        success = True
+        
+        if segment_hash is not None:
+            try:
+                await asyncio.to_thread(result_cache.put_segment, segment_hash, transcript, start_time)
+            except sqlite3.Error as e:
+                print(f"Could not cache segment {segment_num}: {e}")
+        
+        return {
+            'success': True,
+            'segment_num': segment_num,
+            'transcript': transcript,
+            'skipped': False
+        }
+        
+    except Exception as e:
+        print(f"Error in segment {segment_num} worker: {e}")
+        return segment_error_result(segment_num, start_time, e, end_time=start_time + duration)
+    
+    finally:
+        await segment_concurrency.release(time.time() - acquired_at, duration, success=success)
+        
+        # Cleanup
+        if video_file is not None:
+            try:
+                await delete_from_gemini(video_file, job=job)
+            except Exception as e:
+                print(f"Could not delete segment {segment_num} upload: {e}")
+
+def segment_error_result(segment_num, start_time, error, end_time=None):
+    """Build the result for a segment whose transcription failed"""
+    
+    return {
+        'success': False,
+        'segment_num': segment_num,
+        'transcript': Transcript.single(
+            start_time, end_time if end_time is not None else start_time,
+            f"[Error transcribing segment starting at {format_timestamp(start_time)}: {str(error)}]"
+        ),
+        'skipped': False
+    }
+
+async def transcribe_video_in_segments(video_path, segment_duration=240, is_audio=None, job=None, media=None):
+    """
+    Transcribe video or audio by breaking it into segments with intelligent optimizations.
+    
+    OPTIMIZATIONS IMPLEMENTED:
+    1. Smart Silence Detection - Skips segments that are >80% silent
+    2. Adaptive Segment Duration - Cuts inside pauses, sized by local content density,
+       with long silences split out into their own skipped segments
+    3. Parallel Processing - Every segment is a task; how many are in flight with
+       Gemini is set by the shared concurrency controller
+    
+    Args:
+        video_path: Path to the media file
+        segment_duration: Fixed segment duration in seconds, used only when the audio can't be analyzed
+        is_audio: Optional boolean, overrides the media type from the probe
+        job: Optional job record to report segment progress to
+        media: MediaInfo of the file, probed here if not given
+    
+    Returns:
+        tuple: (transcript, summaries) - the combined Transcript and, for media of at
+               least SUMMARY_MIN_MEDIA_SECONDS in hierarchical mode, per-segment
+               summaries in time order
+    """
+    
+    print(f"Starting OPTIMIZED segmented transcription...")
+    
+    # OPTIMIZATION #2: Reuse the job's probe instead of running ffprobe again
+    if media is None:
+        media = await probe_media(video_path)
+    if is_audio is None:
+        is_audio = media.is_audio
+    
+    # A resumed job reuses its segment plan and files if they survived the restart
+    plan_checkpoint = get_checkpoint(job, 'segments')
+    if plan_checkpoint is not None and all(
+        os.path.exists(seg_info['path']) or get_checkpoint(job, f"segment:{seg_info['segment_num']}")
+        for seg_info in plan_checkpoint['segments']
+    ):
+        print(f"♻️  Resuming with {len(plan_checkpoint['segments'])} planned segments")
+        total_duration = plan_checkpoint['total_duration']
+        use_proxy = plan_checkpoint['use_proxy']
+        segment_info = plan_checkpoint['segments']
+        segment_dir = os.path.dirname(segment_info[0]['path'])
+    else:
+        segment_info = None
+    
+    if segment_info is None:
+        total_duration = media.duration
+        
+        if not total_duration:
+            # If we can't get duration, process as single file
+            return await transcribe_as_single_file(video_path, is_audio, job=job)
+        
+        # OPTIMIZATION #2: Silence-aware segment boundaries sized by local content density
+        print("Analyzing audio energy for adaptive segmentation...")
+        energy_map = await compute_audio_energy_map(video_path) if media.has_audio else None
+        
+        if energy_map is not None:
+            plan = plan_segments(energy_map, total_duration)
+            num_segments = len(plan)
+            silent_spans = sum(1 for span in plan if span['silent'])
+            print(f"📊 Planned {num_segments} segments ({silent_spans} long silences split out)")
+            cut_points = [span['start'] for span in plan[1:]]
+        else:
+            # No audio to analyze - fall back to fixed-length segments
+            num_segments = int((total_duration // segment_duration) + (1 if total_duration % segment_duration > 0 else 0))
+            print(f"Media will be split into {num_segments} segments of ~{segment_duration}s each")
+            cut_points = [i * segment_duration for i in range(1, num_segments)]
+        
+        # Audio proxies need an audio track; the energy map tells us one decoded fine
+        use_proxy = TRANSCRIPTION_MEDIA == 'audio' and energy_map is not None
+        
+        # Stream copy can only cut on keyframes, and ffmpeg takes the first one after
+        # each cut point. Cutting at the nearest keyframe instead stays closer to the pause
+        if not use_proxy and cut_points:
+            keyframes = await media.keyframe_times()
+            if keyframes:
+                cut_points = snap_to_keyframes(cut_points, keyframes)
+                num_segments = len(cut_points) + 1
+        
+        # Segments of a checkpointed job live in its work directory until the job finishes.
+        # A new plan may cut elsewhere, so results checkpointed for an older one are dropped
+        work_dir = job_work_dir(job)
+        if work_dir is not None:
+            reset_segment_checkpoints(job)
+            segment_dir = os.path.join(work_dir, 'segments')
+            shutil.rmtree(segment_dir, ignore_errors=True)
+            os.makedirs(segment_dir)
+        else:
+            segment_dir = tempfile.mkdtemp(prefix='segments_')
+    
+    try:
+        if segment_info is None:
+            # Step 1: Create ALL segments in one ffmpeg pass (fast - just file splitting)
+            print(f"\n🔪 Creating {num_segments} {'audio proxy ' if use_proxy else ''}segments...")
+            created = await split_media_into_segments(video_path, cut_points, segment_dir, audio_proxy=use_proxy)
+            
+            if not created:
+                print("Segmentation failed, falling back to single-file transcription")
+                return await transcribe_as_single_file(video_path, is_audio, job=job)
+            
+            segment_info = []  # Store segment metadata
+            for i, segment in enumerate(created):
+                silence_ratio = None
+                if energy_map is not None:
+                    silence_ratio = energy_map.silence_ratio(
+                        segment['start_time'], segment['start_time'] + segment['duration']
+                    )
+                
+                segment_info.append({
+                    'path': segment['path'],
+                    'segment_num': i + 1,
+                    'start_time': segment['start_time'],
+                    'duration': segment['duration'],
+                    'silence_ratio': silence_ratio
+                })
+            
+            print(f"✅ Created {len(segment_info)} segments")
+            save_checkpoint(job, 'segments', {
+                'total_duration': total_duration,
+                'use_proxy': use_proxy,
+                'segments': segment_info
+            })
+        
+        update_job_stage(job, 'transcribe', segments_total=len(segment_info), segments_done=0,
+                         segments_skipped=0, segments_failed=0, segments_cached=0)
+        
+        # Step 2: OPTIMIZATION #3 - Process segments in PARALLEL
+        print(f"\n🚀 Processing {len(segment_info)} segments (concurrency limit: {segment_concurrency.limit})...")
+        
+        async def planned_segments():
+            for seg_info in segment_info:
+                yield seg_info
+        
+        summarize = TRANSCRIPT_MODE == 'hierarchical' and total_duration >= SUMMARY_MIN_MEDIA_SECONDS
+        results, summaries = await run_segment_workers(
+            planned_segments(), is_audio or use_proxy, summarize=summarize, job=job,  # Proxies are audio-only
+            source_path=video_path
+        )
+        
+        # Step 3: Combine transcripts in segment order
+        return combine_segment_results(results, summaries, summarize), summaries
+        
+    finally:
+        # Cleanup all segment files (a checkpointed job keeps them until it finishes)
+        if job_work_dir(job) is None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+async def run_segment_workers(segments, is_audio, summarize=False, job=None, source_path=None):
+    """
+    Transcribe segments as they arrive, one worker task per segment.
+    
+    Each result is checkpointed, streamed as a segment event and, with
+    summarize, summarized while the remaining segments are transcribed.
+    
+    Args:
+        segments: Async iterable of segment info dicts ('path', 'segment_num',
+                  'start_time', 'duration', 'silence_ratio'); a live segmenter
+                  may still be yielding while earlier segments are in flight
+        is_audio: Whether the segment files are audio-only
+        summarize: Summarize each transcribed segment
+        job: Optional job record to report segment progress to
+        source_path: Full media file the segments were cut from, if it is on disk
+    
+    Returns:
+        tuple: (results, summaries), both in segment order
+    
+    Raises:
+        Whatever the segments iterable raises, once the segments it did yield are finished
+    """
+    
+    results = []
+    summary_tasks = []
+    resumed_summaries = []
+    segment_info = {}
+    tasks = []
+    finished = asyncio.Queue()  # Done worker tasks, then None once no more segments will come
+    
+    async def start_workers():
+        try:
+            async for seg_info in segments:
+                segment_info[seg_info['segment_num']] = seg_info
+                task = asyncio.create_task(traced(
+                    transcribe_segment_worker(
+                        seg_info['path'],
+                        seg_info['segment_num'],
+                        seg_info['start_time'],
+                        seg_info['duration'],
+                        is_audio,
+                        seg_info['silence_ratio'],
+                        job,
+                        source_path=source_path,
+                        audio_hash=seg_info.get('audio_hash')
+                    ),
+                    f"segment {seg_info['segment_num']}", category='segment',
+                    start_time=seg_info['start_time'], duration=seg_info['duration'],
+                    silence_ratio=seg_info['silence_ratio']
+                ))
+                task.add_done_callback(finished.put_nowait)
+                tasks.append(task)
+        finally:
+            finished.put_nowait(None)
+    
+    feeder = asyncio.create_task(start_workers())
+    
+    try:
+        # Collect results as they complete
+        feeding = True
+        while feeding or len(results) < len(tasks):
+            task = await finished.get()
+            if task is None:
+                feeding = False
+                continue
+            
+            result = task.result()
+            results.append(result)
+            
+            # Finished segments survive a restart; failed ones are retried on resume
+            if result.get('success') and not result.get('resumed'):
+                save_checkpoint(job, f"segment:{result['segment_num']}", {
+                    'transcript': result['transcript'].to_records(),
+                    'skipped': result.get('skipped', False),
+                    'cached': result.get('cached', False)
+                })
+            
+            seg_info = segment_info[result['segment_num']]
+            emit_job_event(
+                job, 'segment',
+                segment_num=result['segment_num'],
+                start_time=seg_info['start_time'],
+                end_time=seg_info['start_time'] + seg_info['duration'],
+                transcript=result['transcript'].to_text(),
+                skipped=result.get('skipped', False),
+                success=result.get('success', True)
+            )
+            
+            # Summaries run alongside the segments still being transcribed
+            if summarize:
+                summary = start_segment_summary(result, seg_info, job)
+                if isinstance(summary, asyncio.Task):
+                    summary_tasks.append(summary)
+                elif summary is not None:
+                    resumed_summaries.append(summary)
+            
+            # Log completion
+            if result.get('resumed'):
+                outcome = 'resumed'
+                print(f"✓ Segment {result['segment_num']} restored from checkpoint")
+            elif result.get('skipped'):
+                outcome = 'skipped'
+                print(f"✓ Segment {result['segment_num']} skipped (silent)")
+            elif result.get('cached'):
+                outcome = 'cached'
+                print(f"✓ Segment {result['segment_num']} reused from cache")
+            elif result.get('success'):
+                outcome = 'transcribed'
+                print(f"✓ Segment {result['segment_num']} completed")
+            else:
+                outcome = 'failed'
+                print(f"✗ Segment {result['segment_num']} failed")
+            SEGMENTS.labels(outcome=outcome).inc()
+            
+            update_job_stage(
+                job, 'transcribe',
+                segments_done=len(results),
+                segments_skipped=sum(1 for r in results if r.get('skipped', False)),
+                segments_failed=sum(1 for r in results if not r.get('success', True)),
+                segments_cached=sum(1 for r in results if r.get('cached', False))
+            )
+        
+        await feeder  # Raise a segmenter failure
+    except BaseException:
+        for task in summary_tasks:
+            task.cancel()
+        raise
+    finally:
+        # If the job is cancelled, stop the remaining segments before their files are removed
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(feeder, *tasks, return_exceptions=True)
+    
+    summaries = resumed_summaries + [summary for summary in await asyncio.gather(*summary_tasks) if summary]
+    summaries.sort(key=lambda x: x['segment_num'])
+    results.sort(key=lambda x: x['segment_num'])
+    return results, summaries
+
+def start_segment_summary(result, seg_info, job=None):
+    """
+    Start summarizing a finished segment.
+    
+    Returns:
+        The checkpointed summary of a resumed job, a Task resolving to a new
+        summary (checkpointed when done), or None for silent and failed segments
+    """
+    
+    if not result.get('success') or result.get('skipped'):
+        return None
+    
+    resumed = get_checkpoint(job, f"summary:{result['segment_num']}")
+    if resumed is not None:
+        return resumed
+    
+    def checkpoint_summary(task):
+        if not task.cancelled() and task.exception() is None and task.result():
+            save_checkpoint(job, f"summary:{result['segment_num']}", task.result())
+    
+    task = asyncio.create_task(traced(
+        summarize_segment(
+            result['transcript'].to_text(),
+            result['segment_num'],
+            seg_info['start_time'],
+            seg_info['start_time'] + seg_info['duration'],
+            job=job
+        ),
+        f"summary {result['segment_num']}", category='segment'
+    ))
+    task.add_done_callback(checkpoint_summary)
+    return task
+
+def combine_segment_results(results, summaries, summarize):
+    """Concatenate segment transcripts (in segment order) and log the segment statistics"""
+    
+    combined_transcript = Transcript.concat(r['transcript'] for r in results)
+    
+    # Calculate statistics
+    total_segments = len(results)
+    skipped_segments = sum(1 for r in results if r.get('skipped', False))
+    failed_segments = sum(1 for r in results if not r.get('success', True))
+    cached_segments = sum(1 for r in results if r.get('cached', False))
+    resumed_segments = sum(
+        1 for r in results if r.get('resumed', False) and not r.get('skipped') and not r.get('cached')
+    )
+    processed_segments = total_segments - skipped_segments - failed_segments - cached_segments - resumed_segments
+    
+    print("\n✅ Transcription complete!")
+    print("   📊 Statistics:")
+    print(f"      • Total segments: {total_segments}")
+    print(f"      • Transcribed: {processed_segments}")
+    print(f"      • Skipped (silent): {skipped_segments}")
+    print(f"      • Reused from cache: {cached_segments}")
+    if resumed_segments:
+        print(f"      • Restored from checkpoint: {resumed_segments}")
+    print(f"      • Failed: {failed_segments}")
+    print(f"   📝 Total transcript: {len(combined_transcript)} lines")
+    
+    if summarize:
+        print(f"   📚 Segment summaries: {len(summaries)}")
+    
+    return combined_transcript
+
+async def download_while_transcribing(video_url, hasher=None, job=None):
+    """
+    Download media while a LiveSegmenter cuts it and its segments are transcribed.
+    
+    Returns:
+        tuple: (video_path, transcription) - the downloaded file and a task that
+               resolves like transcribe_video_in_segments(), or raises ValueError if
+               the media could not be segmented live
+    """
+    
+    work_dir = create_job_work_dir(job)
+    if work_dir is not None:
+        # Segments checkpointed before a restart are only valid for the same cuts
+        if get_checkpoint(job, 'live_segments') != STREAM_SEGMENT_DURATION:
+            reset_segment_checkpoints(job)
+            save_checkpoint(job, 'live_segments', STREAM_SEGMENT_DURATION)
+        segment_dir = os.path.join(work_dir, 'segments')
+        shutil.rmtree(segment_dir, ignore_errors=True)
+        os.makedirs(segment_dir)
+    else:
+        segment_dir = tempfile.mkdtemp(prefix='segments_')
+    
+    live = LiveSegmenter(segment_dir)
+    update_job_stage(job, 'transcribe', 'running', segments_total=0, segments_done=0,
+                     segments_skipped=0, segments_failed=0, segments_cached=0)
+    transcription = asyncio.create_task(transcribe_while_downloading(live, job))
+    
+    try:
+        video_path = await download_video(video_url, hasher=hasher, output_dir=work_dir, on_chunk=live.feed, job=job)
+    except BaseException:
+        transcription.cancel()
+        await live.abort()
+        await asyncio.gather(transcription, return_exceptions=True)
+        if work_dir is None:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+        raise
+    
+    await live.finish()
+    return video_path, transcription
+
+async def transcribe_while_downloading(live, job=None):
+    """
+    Transcribe the segments of a LiveSegmenter as ffmpeg finishes them.
+    
+    Silent segments are found from an energy map of each segment file, since
+    there is no map of the whole file yet. Summaries, if the media turns out
+    to be long enough to need them, start once the last segment is known.
+    
+    Returns:
+        tuple: (transcript, summaries), as from transcribe_video_in_segments()
+    
+    Raises:
+        ValueError: If the media could not be segmented live
+    """
+    
+    segment_info = []
     
-    # Format start time for display
-    start_minutes = int(start_time // 60)
-    start_seconds = int(start_time % 60)
+    async def live_segments():
+        async for segment in live.segments():
+            energy_map = await compute_audio_energy_map(segment['path'])
+            segment['silence_ratio'] = energy_map.silence_ratio() if energy_map is not None else None
+            segment['audio_hash'] = energy_map.pcm_hash if energy_map is not None else None
+            segment_info.append(segment)
+            update_job_stage(job, 'transcribe', segments_total=len(segment_info))
+            yield segment
     
-    prompt = f"""Transcribe ALL spoken audio in this {media_type} segment.
-
-CRITICAL: This segment is part of a longer {media_type} and starts at timestamp [{start_minutes:02d}:{start_seconds:02d}].
-
-Your timestamps MUST start at [{start_minutes:02d}:{start_seconds:02d}] and count UP from there.
-
-For example, if this segment starts at [04:00]:
-- First line should be [04:00] or [04:05] (not [00:00])
-- Second line might be [04:15] (not [00:15])
-- Continue counting up: [04:30], [04:45], [05:00], etc.
-
-Format:
-[MM:SS] Speaker: dialogue
-
-Transcription starting at [{start_minutes:02d}:{start_seconds:02d}]:"""
-
     try:
-        response = model.generate_content(
-            [video_file, prompt],
-            request_options={"timeout": 300}
-        )
-        
-        transcript = response.text.strip()
+        print(f"\n🚀 Transcribing segments while downloading (concurrency limit: {segment_concurrency.limit})...")
+        results, _ = await run_segment_workers(live_segments(), True, job=job)  # Proxies are audio-only
         
-        # Verify timestamps look correct (basic check)
-        import re
-        timestamps = re.findall(r'\[(\d{1,2}):(\d{2})\]', transcript)
-        if timestamps:
-            first_timestamp = int(timestamps[0][0]) * 60 + int(timestamps[0][1])
-            expected_start = start_time
-            
-            # If timestamps are still starting near 0, post-process them
-            if first_timestamp < 60 and expected_start > 60:
-                print(f"Warning: Timestamps appear to restart. Adjusting...")
-                transcript = adjust_timestamps(transcript, start_time)
+        total_duration = sum(seg_info['duration'] for seg_info in segment_info)
+        summaries = []
+        summarize = TRANSCRIPT_MODE == 'hierarchical' and total_duration >= SUMMARY_MIN_MEDIA_SECONDS
+        if summarize:
+            started = [start_segment_summary(r, segment_info[r['segment_num'] - 1], job) for r in results]
+            summaries = [
+                await summary if isinstance(summary, asyncio.Task) else summary
+                for summary in started
+            ]
+            summaries = [summary for summary in summaries if summary]
         
-        print(f"Segment {segment_num} transcribed: {len(transcript)} chars")
+        save_checkpoint(job, 'segments', {
+            'total_duration': total_duration,
+            'use_proxy': True,
+            'segments': segment_info
+        })
         
-        return transcript
+        return combine_segment_results(results, summaries, summarize), summaries
         
-    except Exception as e:
-        print(f"Error transcribing segment {segment_num}: {e}")
-        return f"[Error transcribing segment starting at {start_minutes:02d}:{start_seconds:02d}]"
+    finally:
+        await live.abort()  # No-op once ffmpeg has exited
+        if job_work_dir(job) is None:
+            shutil.rmtree(live.output_dir, ignore_errors=True)
+
+async def transcribe_as_single_file(video_path, is_audio, job=None):
+    """Transcribe media in one request when it cannot be segmented (returns (transcript, []))"""
+    
+    print("Processing as single file...")
+    video_file = await upload_file_and_wait(video_path, "full_media", job=job)
+    
+    try:
+        transcript = await transcribe_segment(video_file, 1, 0, is_audio, job=job)
+    finally:
+        await delete_from_gemini(video_file, job=job)
+    
+    emit_job_event(job, 'segment', segment_num=1, start_time=0, end_time=None,
+                   transcript=transcript.to_text(), skipped=False, success=True)
+    update_job_stage(job, 'transcribe', segments_total=1, segments_done=1)
+    return transcript, []
 
+async def upload_file_and_wait(file_path, display_name, job=None):
+    """
+    Upload a file to Gemini and wait until it is ready for use.
+    
+    Returns:
+        The ACTIVE Gemini file object
+    
+    Raises:
+        ValueError: If Gemini fails to process the file
+    """
+    
+    uploaded = await upload_to_gemini(file_path, display_name, job=job)
+    
+    print(f"Waiting for Gemini to process {display_name}...")
+    try:
+        with stage_timer('file_wait'):
+            return await file_poller.watch(uploaded, os.path.getsize(file_path), job=job)
+    except (ValueError, TimeoutError):
+        await delete_from_gemini(uploaded, job=job)
+        raise
 
-def adjust_timestamps(transcript, offset_seconds):
-    """Adjust timestamps in transcript by adding offset"""
+@timed_stage('upload')
+async def upload_to_gemini(file_path, display_name, job=None):
+    """
+    Upload a file to Gemini, or reuse the upload a resumed job made before its restart.
     
-    import re
+    The file name is checkpointed under display_name, which is unique within a
+    job, until delete_from_gemini() removes the file.
     
-    def replace_timestamp(match):
-        minutes = int(match.group(1))
-        seconds = int(match.group(2))
-        
-        # Add offset
-        total_seconds = (minutes * 60 + seconds) + offset_seconds
-        new_minutes = total_seconds // 60
-        new_seconds = total_seconds % 60
-        
-        return f"[{new_minutes:02d}:{new_seconds:02d}]"
+    Returns:
+        The uploaded Gemini file object (possibly still PROCESSING)
+    """
+    
+    name = get_checkpoint(job, f"upload:{display_name}")
+    if name is not None:
+        try:
+            uploaded = await gemini_scheduler.call('get_file', model_backend.get_file, name, job=job)
+            print(f"♻️  Reusing earlier upload of {display_name}")
+            return uploaded
+        except Exception as e:
+            print(f"Earlier upload of {display_name} is gone ({e}), uploading again")
     
-    # Replace all timestamps [MM:SS]
-    adjusted = re.sub(r'\[(\d{1,2}):(\d{2})\]', replace_timestamp, transcript)
+    annotate_span(file=display_name, bytes=os.path.getsize(file_path))
+    uploaded = await gemini_scheduler.call(
+        'upload', model_backend.upload_file,
+        path=file_path,
+        display_name=display_name,
+        mime_type=get_mime_type(file_path),
+        job=job
+    )
+    save_checkpoint(job, f"upload:{display_name}", uploaded.name)
+    return uploaded
+
+async def delete_from_gemini(uploaded, job=None):
+    """Delete an uploaded file and forget its checkpoint"""
     
-    return adjusted
+    await gemini_scheduler.call('delete', model_backend.delete_file, uploaded.name, job=job)
+    clear_checkpoint(job, f"upload:{uploaded.display_name}")
 
-def transcribe_segment_worker(segment_path, segment_num, start_time, duration, is_audio):
+async def extract_scene_keyframes(video_path, duration, output_dir, max_frames=MAX_KEYFRAMES):
     """
-    Worker function to transcribe a single segment - designed for parallel execution.
+    Extract a bounded set of keyframes at scene changes.
+    
+    Only keyframes are decoded (-skip_frame nokey), so this is fast even for long
+    high-resolution files. Frames are spaced at least duration/max_frames apart,
+    and a frame is also taken after long stretches without a scene change so
+    static shots are still represented.
     
     Args:
-        segment_path: Path to the segment file
-        segment_num: Segment number (for logging)
-        start_time: Start time in seconds from beginning of full media
-        duration: Duration of this segment
-        is_audio: Whether this is audio-only media
+        video_path: Path to the full media file
+        duration: Media duration in seconds
+        output_dir: Directory that receives the JPEG files
+        max_frames: Maximum number of keyframes to extract
     
     Returns:
-        dict: Result containing transcript or error info
+        list: (timestamp_seconds, jpeg_path) tuples in time order
     """
     
+    min_gap = max(duration / max_frames, 1.0)
+    select = (
+        f"select='isnan(prev_selected_t)"
+        f"+gte(t-prev_selected_t,{min_gap:.3f})*gt(scene,{SCENE_CHANGE_THRESHOLD})"
+        f"+gte(t-prev_selected_t,{min_gap * 3:.3f})'"
+    )
+    
+    cmd = [
+        'ffmpeg',
+        '-skip_frame', 'nokey',
+        '-i', video_path,
+        '-an',
+        '-vf', f"{select},showinfo,scale={KEYFRAME_WIDTH}:-2",
+        '-vsync', 'vfr',
+        '-frames:v', str(max_frames),
+        '-q:v', '5',
+        '-y',
+        os.path.join(output_dir, 'keyframe_%03d.jpg')
+    ]
+    
     try:
-        # Check for silence first (OPTIMIZATION #1: Smart Silence Detection)
-        silence_ratio = detect_silence_ratio(segment_path)
-        
-        if silence_ratio is not None and silence_ratio > 0.80:
-            # Segment is >80% silent - skip transcription
-            start_minutes = int(start_time // 60)
-            start_seconds = int(start_time % 60)
-            end_time = start_time + duration
-            end_minutes = int(end_time // 60)
-            end_seconds = int(end_time % 60)
-            
-            print(f"⏭️  Segment {segment_num} is {silence_ratio*100:.1f}% silent - skipping transcription")
-            
-            return {
-                'success': True,
-                'segment_num': segment_num,
-                'transcript': f"[{start_minutes:02d}:{start_seconds:02d} - {end_minutes:02d}:{end_seconds:02d}] [Mostly silent - no significant audio content]",
-                'skipped': True
-            }
-        
-        # Upload segment to Gemini
-        print(f"Uploading segment {segment_num}...")
-        mime_type = get_mime_type(segment_path)
-        video_file = genai.upload_file(
-            path=segment_path,
-            display_name=f"segment_{segment_num}",
-            mime_type=mime_type
-        )
-        
-        # Wait for processing
-        while video_file.state.name == "PROCESSING":
-            time.sleep(3)
-            video_file = genai.get_file(video_file.name)
-        
-        if video_file.state.name == "FAILED":
-            return {
-                'success': False,
-                'segment_num': segment_num,
-                'transcript': f"[Segment {segment_num} processing failed]",
-                'skipped': False
-            }
+        result = await run_command(cmd, timeout=600)
         
-        # Transcribe segment
-        transcript = transcribe_segment(video_file, segment_num, start_time, is_audio)
+        if result.returncode != 0:
+            print(f"Error extracting keyframes: {result.stderr[-2000:]}")
+            return []
         
-        # Cleanup
-        genai.delete_file(video_file.name)
+        timestamps = [float(t) for t in re.findall(r'Parsed_showinfo.*?pts_time:\s*([\d.]+)', result.stderr)]
+        frames = sorted(f for f in os.listdir(output_dir) if f.startswith('keyframe_'))
         
-        return {
-            'success': True,
-            'segment_num': segment_num,
-            'transcript': transcript,
-            'skipped': False
-        }
+        keyframes = list(zip(timestamps, (os.path.join(output_dir, f) for f in frames)))
+        print(f"Extracted {len(keyframes)} scene keyframes")
+        return keyframes
         
     except Exception as e:
-        print(f"Error in segment {segment_num} worker: {e}")
-        start_minutes = int(start_time // 60)
-        start_seconds = int(start_time % 60)
-        return {
-            'success': False,
-            'segment_num': segment_num,
-            'transcript': f"[Error transcribing segment starting at {start_minutes:02d}:{start_seconds:02d}: {str(e)}]",
-            'skipped': False
-        }
+        print(f"Error extracting keyframes: {e}")
+        return []
 
-def transcribe_video_in_segments(video_path, segment_duration=240, is_audio=None, max_workers=4):
-    """
-    Transcribe video or audio by breaking it into segments with intelligent optimizations.
+async def extract_audio_proxy(video_path, output_path):
+    """Encode the full audio track as a small mono Opus file"""
     
-    OPTIMIZATIONS IMPLEMENTED:
-    1. Smart Silence Detection - Skips segments that are >80% silent
-    2. Adaptive Segment Duration - Adjusts segment size based on content density
-    3. Parallel Processing - Processes multiple segments simultaneously
+    cmd = [
+        'ffmpeg',
+        '-i', video_path,
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(PROXY_SAMPLE_RATE),
+        '-c:a', 'libopus',
+        '-b:a', PROXY_BITRATE,
+        '-application', 'voip',
+        '-y',
+        output_path
+    ]
     
-    Args:
-        video_path: Path to the media file
-        segment_duration: Base duration of each segment in seconds (may be adjusted)
-        is_audio: Optional boolean, if provided skips media type detection
-        max_workers: Maximum number of parallel transcription workers (default: 4)
+    result = await run_command(cmd, timeout=1800)
+    
+    if result.returncode != 0:
+        print(f"Error creating audio proxy: {result.stderr[-2000:]}")
+        return False
+    
+    return True
+
+async def build_analysis_media(video_path, is_audio, duration, job=None):
     """
+    Build the media parts sent with the context and analysis prompts.
     
-    print(f"Starting OPTIMIZED segmented transcription...")
+    In 'summary' mode the parts are scene keyframes sent inline, plus an
+    uploaded audio proxy when SUMMARY_AUDIO asks for one, so the upload no
+    longer grows with the resolution of the source. In 'full' mode the whole
+    source file is uploaded as before.
     
-    # OPTIMIZATION #2: Use provided is_audio flag to avoid re-detection
-    if is_audio is None:
-        is_audio = is_audio_only(video_path)
-    
-    # Get file extension for segments
-    _, ext = os.path.splitext(video_path)
-    
-    # Get media duration
-    total_duration = get_video_duration(video_path)
-    
-    if not total_duration:
-        # If we can't get duration, process as single file
-        print("Processing as single file...")
-        mime_type = get_mime_type(video_path)
-        video_file = genai.upload_file(
-            path=video_path, 
-            display_name="full_media",
-            mime_type=mime_type
-        )
-        
-        while video_file.state.name == "PROCESSING":
-            time.sleep(5)
-            video_file = genai.get_file(video_file.name)
-        
-        transcript = transcribe_segment(video_file, 1, 0, is_audio)
-        genai.delete_file(video_file.name)
-        
-        return transcript
+    Args:
+        video_path: Path to the full media file
+        is_audio: Boolean indicating if media is audio-only
+        duration: Media duration in seconds, or None if unknown
+        job: Optional job record that receives Gemini call counts
     
-    # OPTIMIZATION #2: Adaptive Segment Duration Based on Content
-    print("Analyzing content density for adaptive segmentation...")
-    content_density = analyze_media_content_density(video_path)
-    
-    # Adjust segment duration based on content density
-    if content_density == 'sparse':
-        segment_duration = 600  # 10 minutes for sparse content (lots of silence)
-        print(f"📊 Using LONG segments (10 min) for sparse content")
-    elif content_density == 'dense':
-        segment_duration = 180  # 3 minutes for dense content
-        print(f"📊 Using SHORT segments (3 min) for dense content")
-    else:
-        segment_duration = 300  # 5 minutes for moderate content
-        print(f"📊 Using MEDIUM segments (5 min) for moderate content")
+    Returns:
+        tuple: (parts, uploaded_files) - content parts for generate_content and
+               the Gemini files that must be deleted afterwards
+    """
+    
+    media_type = "audio" if is_audio else "video"
     
-    # Calculate number of segments
-    num_segments = int((total_duration // segment_duration) + (1 if total_duration % segment_duration > 0 else 0))
-    print(f"Media will be split into {num_segments} segments of ~{segment_duration}s each")
+    if ANALYSIS_MEDIA == 'full' or not duration:
+        print(f"\nUploading full {media_type} for context and analysis...")
+        video_file = await upload_file_and_wait(video_path, f"full_{media_type}_analysis", job=job)
+        return [video_file], [video_file]
     
-    all_segment_files = []
-    segment_info = []  # Store segment metadata
+    parts = []
+    uploaded_files = []
+    work_dir = tempfile.mkdtemp(prefix='summary_')
     
     try:
-        # Step 1: Create ALL segments first (fast - just file splitting)
-        print(f"\n🔪 Creating {num_segments} segments...")
-        for i in range(num_segments):
-            start_time = i * segment_duration
-            duration = min(segment_duration, total_duration - start_time)
-            
-            if duration <= 0:
-                break
-            
-            # Create segment file with proper extension
-            segment_path = tempfile.NamedTemporaryFile(delete=False, suffix=ext).name
-            all_segment_files.append(segment_path)
+        if not is_audio:
+            print("\nExtracting scene keyframes for context and analysis...")
+            keyframes = await extract_scene_keyframes(video_path, duration, work_dir)
             
-            if create_video_segment(video_path, start_time, duration, segment_path):
-                segment_info.append({
-                    'path': segment_path,
-                    'segment_num': i + 1,
-                    'start_time': start_time,
-                    'duration': duration
-                })
-            else:
-                segment_info.append({
-                    'path': None,
-                    'segment_num': i + 1,
-                    'start_time': start_time,
-                    'duration': duration,
-                    'creation_failed': True
-                })
-        
-        print(f"✅ Created {len(segment_info)} segments")
+            if keyframes:
+                parts.append("The following keyframes were sampled from the video at scene changes, in order:")
+                for timestamp, frame_path in keyframes:
+                    with open(frame_path, 'rb') as f:
+                        frame_data = f.read()
+                    parts.append(f"Keyframe at [{format_timestamp(timestamp)}]:")
+                    parts.append({"mime_type": "image/jpeg", "data": frame_data})
         
-        # Step 2: OPTIMIZATION #3 - Process segments in PARALLEL
-        print(f"\n🚀 Processing {len(segment_info)} segments with {max_workers} parallel workers...")
-        
-        results = []
+        if SUMMARY_AUDIO == 'always' or (SUMMARY_AUDIO == 'audio-only' and is_audio):
+            print("Creating audio proxy for context and analysis...")
+            proxy_path = os.path.join(work_dir, 'audio_proxy.ogg')
+            if await extract_audio_proxy(video_path, proxy_path):
+                audio_file = await upload_file_and_wait(proxy_path, f"{media_type}_audio_proxy", job=job)
+                uploaded_files.append(audio_file)
+                parts.append(audio_file)
         
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all transcription jobs
-            future_to_segment = {}
-            
-            for seg_info in segment_info:
-                if seg_info.get('creation_failed'):
-                    # Handle failed segment creation immediately
-                    results.append({
-                        'success': False,
-                        'segment_num': seg_info['segment_num'],
-                        'transcript': f"[Segment {seg_info['segment_num']} creation failed]",
-                        'skipped': False
-                    })
-                else:
-                    # Submit for parallel processing
-                    future = executor.submit(
-                        transcribe_segment_worker,
-                        seg_info['path'],
-                        seg_info['segment_num'],
-                        seg_info['start_time'],
-                        seg_info['duration'],
-                        is_audio
-                    )
-                    future_to_segment[future] = seg_info['segment_num']
-            
-            # Collect results as they complete
-            for future in as_completed(future_to_segment):
-                segment_num = future_to_segment[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                    
-                    # Log completion
-                    if result.get('skipped'):
-                        print(f"✓ Segment {segment_num} skipped (silent)")
-                    else:
-                        print(f"✓ Segment {segment_num} completed")
-                        
-                except Exception as e:
-                    print(f"✗ Segment {segment_num} failed: {e}")
-                    results.append({
-                        'success': False,
-                        'segment_num': segment_num,
-                        'transcript': f"[Segment {segment_num} failed: {str(e)}]",
-                        'skipped': False
-                    })
-        
-        # Step 3: Sort results by segment number and combine transcripts
-        results.sort(key=lambda x: x['segment_num'])
-        all_transcripts = [r['transcript'] for r in results]
-        combined_transcript = "\n\n".join(all_transcripts)
-        
-        # Calculate statistics
-        total_segments = len(results)
-        skipped_segments = sum(1 for r in results if r.get('skipped', False))
-        failed_segments = sum(1 for r in results if not r.get('success', True))
-        processed_segments = total_segments - skipped_segments - failed_segments
-        
-        print(f"\n✅ Transcription complete!")
-        print(f"   📊 Statistics:")
-        print(f"      • Total segments: {total_segments}")
-        print(f"      • Transcribed: {processed_segments}")
-        print(f"      • Skipped (silent): {skipped_segments}")
-        print(f"      • Failed: {failed_segments}")
-        print(f"   📝 Total transcript: {len(combined_transcript)} characters")
-        
-        return combined_transcript
+        return parts, uploaded_files
         
     finally:
-        # Cleanup all segment files
-        for segment_file in all_segment_files:
-            try:
-                if os.path.exists(segment_file):
-                    os.remove(segment_file)
-            except:
-                pass
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-def get_video_context(video_file, transcript, is_audio):
+@timed_stage('context')
+async def get_video_context(video_file, transcript, is_audio, job=None, prompt_transcript=None):
     """Extract basic video/audio context: setting, mood, people, purpose
     
     Args:
-        video_file: Already uploaded Gemini file object
+        video_file: Already uploaded Gemini file object, or a list of content parts
+                    (inline keyframes, audio proxy) from build_analysis_media()
         transcript: Full transcript text
         is_audio: Boolean indicating if media is audio-only
+        job: Optional job record that receives Gemini call counts
+        prompt_transcript: Transcript material already fitted to the token budget by
+                           prepare_prompt_transcript(); excerpts are used when None
     """
     
     print("Analyzing media context...")
@@ -676,8 +3339,8 @@ def get_video_context(video_file, transcript, is_audio):
     # OPTIMIZATION #1 & #2: Use provided video_file and is_audio flag
     media_type = "audio" if is_audio else "video"
     
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
+    model = model_backend.model(
+        "gemini-2.5-flash",
         generation_config={
             "max_output_tokens": 2048,
             "temperature": 0.4,
@@ -685,7 +3348,9 @@ def get_video_context(video_file, transcript, is_audio):
     )
     
     # For very long transcripts, provide excerpts
-    if len(transcript) > 30000:
+    if prompt_transcript is not None:
+        transcript_excerpt = prompt_transcript
+    elif len(transcript) > 30000:
         third = len(transcript) // 3
         transcript_excerpt = (
             transcript[:third] + 
@@ -756,11 +3421,14 @@ Why does this video seem to exist? What appears to be its intended goal or messa
 Write in a natural, conversational style as if describing the video to someone who hasn't seen it. Be specific and concrete in your observations."""
 
     try:
-        response = model.generate_content(
-            [video_file, prompt],
+        media_parts = video_file if isinstance(video_file, list) else [video_file]
+        context = await generate_text(
+            model,
+            [*media_parts, prompt],
+            job=job,
+            stage='context',
             request_options={"timeout": 300}  # 5 minute timeout for context
         )
-        context = response.text
         print(f"Context analysis complete: {len(context)} characters")
         
         # OPTIMIZATION #1: Don't delete file here - managed by process_video
@@ -774,13 +3442,18 @@ Write in a natural, conversational style as if describing the video to someone w
         # Don't delete file here - will be cleaned up by process_video
         raise
 
-def analyze_video_content(video_file, transcript, is_audio):
+@timed_stage('analysis')
+async def analyze_video_content(video_file, transcript, is_audio, job=None, prompt_transcript=None):
     """Generate accessible psychological analysis of the video or audio
     
     Args:
-        video_file: Already uploaded Gemini file object
+        video_file: Already uploaded Gemini file object, or a list of content parts
+                    (inline keyframes, audio proxy) from build_analysis_media()
         transcript: Full transcript text
         is_audio: Boolean indicating if media is audio-only
+        job: Optional job record that receives Gemini call counts
+        prompt_transcript: Transcript material already fitted to the token budget by
+                           prepare_prompt_transcript(); excerpts are used when None
     """
     
     print("Generating psychological analysis...")
@@ -788,8 +3461,8 @@ def analyze_video_content(video_file, transcript, is_audio):
     # OPTIMIZATION #1 & #2: Use provided video_file and is_audio flag
     media_type = "audio" if is_audio else "video"
     
-    model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash",
+    model = model_backend.model(
+        "gemini-2.5-flash",
         generation_config={
             "max_output_tokens": 8192,
             "temperature": 0.7,
@@ -797,7 +3470,9 @@ def analyze_video_content(video_file, transcript, is_audio):
     )
     
     # For very long transcripts, provide strategic excerpts
-    if len(transcript) > 30000:
+    if prompt_transcript is not None:
+        transcript_for_prompt = prompt_transcript
+    elif len(transcript) > 30000:
         print(f"Transcript is long ({len(transcript)} chars), using strategic excerpts for analysis...")
         third = len(transcript) // 3
         transcript_for_prompt = (
@@ -869,79 +3544,663 @@ Stepping back, what's the deeper human experience being expressed or explored he
 
 Your analysis should feel like a thoughtful conversation about the human dimensions of this {media_type}."""
 
-    try:
-        response = model.generate_content(
-            [video_file, prompt],
-            request_options={"timeout": 600}  # 10 minute timeout for analysis
-        )
-        analysis = response.text
-        print(f"Psychological analysis complete: {len(analysis)} characters")
-        
-        # OPTIMIZATION #1: Don't delete file here - managed by process_video
-        return analysis
-        
-    except Exception as e:
-        print(f"Error during psychological analysis: {e}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
-        # Don't delete file here - will be cleaned up by process_video
-        raise
+    try:
+        media_parts = video_file if isinstance(video_file, list) else [video_file]
+        analysis = await generate_text(
+            model,
+            [*media_parts, prompt],
+            job=job,
+            stage='analysis',
+            request_options={"timeout": 600}  # 10 minute timeout for analysis
+        )
+        print(f"Psychological analysis complete: {len(analysis)} characters")
+        
+        # OPTIMIZATION #1: Don't delete file here - managed by process_video
+        return analysis
+        
+    except Exception as e:
+        print(f"Error during psychological analysis: {e}")
+        print(f"Error type: {type(e).__name__}")
+        import traceback
+        traceback.print_exc()
+        # Don't delete file here - will be cleaned up by process_video
+        raise
+
+class ResultCache:
+    """
+    Persistent cache of finished job results in SQLite.
+    
+    Results are keyed by a hash of the media content plus the settings that
+    shape the output, so the same file fetched from any URL is analyzed once.
+    A second index maps URL + ETag/Last-Modified to the content hash, which lets
+    a repeat request skip even the download. Segment transcripts are cached
+    too, keyed by a hash of the segment file, so edited cuts and re-uploads
+    only transcribe the parts that changed. Each table's size is bounded by
+    evicting its least recently used entries.
+    """
+    
+    def __init__(self, path, max_bytes, segment_max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.segment_hits = 0
+        self.segment_misses = 0
+        self._db = None
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS results (
+                    cache_key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    transcript TEXT,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT NOT NULL,
+                    validator TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    PRIMARY KEY (url, validator)
+                );
+                CREATE TABLE IF NOT EXISTS segments (
+                    cache_key TEXT PRIMARY KEY,
+                    transcript TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS segments_last_used ON segments (last_used);
+            """)
+        return self._db
+    
+    def get(self, content_hash):
+        """
+        Look up a result by media content hash.
+        
+        Returns:
+            tuple: (result dict, Transcript or None), or None on a miss
+        """
+        
+        key = result_cache_key(content_hash)
+        
+        with self.lock:
+            db = self._connect()
+            row = db.execute("SELECT result, transcript FROM results WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            db.execute("UPDATE results SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+            db.commit()
+            self.hits += 1
+        
+        result, transcript = row
+        return json.loads(result), Transcript.from_records(json.loads(transcript)) if transcript else None
+    
+    def content_hash_for_url(self, url, validator):
+        """Content hash last downloaded from url while it carried this validator, if any"""
+        
+        with self.lock:
+            row = self._connect().execute(
+                "SELECT content_hash FROM urls WHERE url = ? AND validator = ?", (url, validator)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def put(self, content_hash, result, transcript=None, url=None, validator=None):
+        """Store a finished result (and remember which URL it came from), then evict to size"""
+        
+        key = result_cache_key(content_hash)
+        result_json = json.dumps(result)
+        transcript_json = json.dumps(transcript.to_records()) if transcript is not None else None
+        size = len(result_json) + len(transcript_json or '')
+        now = time.time()
+        
+        with self.lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+                (key, result_json, transcript_json, size, now, now)
+            )
+            if url and validator:
+                self._remember_url(db, url, validator, content_hash)
+            self._evict(db, 'results', self.max_bytes)
+            db.commit()
+    
+    def remember_url(self, url, validator, content_hash):
+        """Point url + validator at a content hash so the next request can skip the download"""
+        
+        with self.lock:
+            db = self._connect()
+            self._remember_url(db, url, validator, content_hash)
+            db.commit()
+    
+    def _remember_url(self, db, url, validator, content_hash):
+        db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?)", (url, validator, content_hash))
+    
+    def get_segment(self, segment_hash, start_time):
+        """
+        Look up a segment transcript by segment content hash.
+        
+        Returns:
+            Transcript: The stored transcript re-based to start_time, or None on a miss
+        """
+        
+        key = segment_cache_key(segment_hash)
+        
+        with self.lock:
+            db = self._connect()
+            row = db.execute("SELECT transcript FROM segments WHERE cache_key = ?", (key,)).fetchone()
+            if row is None:
+                self.segment_misses += 1
+                return None
+            
+            db.execute("UPDATE segments SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+            db.commit()
+            self.segment_hits += 1
+        
+        return Transcript.from_records(json.loads(row[0])).shifted(int(start_time))
+    
+    def put_segment(self, segment_hash, transcript, start_time):
+        """Store a segment transcript with offsets relative to the segment start, then evict to size"""
+        
+        key = segment_cache_key(segment_hash)
+        transcript_json = json.dumps(transcript.shifted(-int(start_time)).to_records())
+        now = time.time()
+        
+        with self.lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO segments VALUES (?, ?, ?, ?, ?)",
+                (key, transcript_json, len(transcript_json), now, now)
+            )
+            self._evict(db, 'segments', self.segment_max_bytes)
+            db.commit()
+    
+    def _evict(self, db, table, max_bytes):
+        total = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0]
+        if total <= max_bytes:
+            return
+        
+        for key, size in db.execute(f"SELECT cache_key, size FROM {table} ORDER BY last_used").fetchall():
+            if total <= max_bytes:
+                break
+            db.execute(f"DELETE FROM {table} WHERE cache_key = ?", (key,))
+            total -= size
+            print(f"🗑️  Evicted cached {table[:-1]} {key[:12]} ({size} bytes)")
+    
+    def stats(self):
+        with self.lock:
+            db = self._connect()
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            segments, segment_total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments").fetchone()
+            return {
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'segments': {
+                    'entries': segments,
+                    'bytes': segment_total,
+                    'max_bytes': self.segment_max_bytes,
+                    'hits': self.segment_hits,
+                    'misses': self.segment_misses
+                }
+            }
+
+def result_cache_key(content_hash):
+    """Cache key for a media hash: the settings that change the output are part of it"""
+    
+    settings = '|'.join([VERSION, TRANSCRIPTION_MEDIA, ANALYSIS_MEDIA, SUMMARY_AUDIO, TRANSCRIPT_MODE])
+    return hashlib.sha256(f"{content_hash}|{settings}".encode()).hexdigest()
+
+def segment_cache_key(segment_hash):
+    """Cache key for a segment_content_hash(): transcription settings are part of it"""
+    
+    return hashlib.sha256(f"{segment_hash}|{VERSION}|{TRANSCRIPTION_MEDIA}".encode()).hexdigest()
+
+async def segment_content_hash(segment_path, start_time, duration, is_audio, source_path=None, audio_hash=None):
+    """
+    Content hash of a segment for the segment cache.
+    
+    Audio-only segments are hashed by their decoded PCM, read from the source
+    window when the source is on disk. The segment files themselves are not
+    hashed: the proxy encoder runs across the whole file, so a segment's bytes
+    depend on the audio before it. The hash matches wherever the window decodes
+    to the same samples: re-uploads, and the same audio stream re-muxed or
+    paired with other video, as long as the container trims the encoder delay
+    the same way (AAC moved from MP4 to Matroska decodes shifted). Lossy
+    re-encodes decode to different samples and never match. Windows are cut at
+    times measured from the start of the file, so the same audio behind a
+    different intro lands in other windows.
+    
+    Live-segmented jobs have no source on disk yet and use audio_hash, the
+    decode of the proxy segment itself. Video segments are stream copies whose
+    pictures are transcribed too, so they are hashed by their bytes.
+    
+    Returns:
+        str: Hash prefixed with what was hashed ('audio:' or 'file:')
+    
+    Raises:
+        OSError, RuntimeError: If the file can't be read or decoded
+    """
+    
+    if not is_audio:
+        return f"file:{await asyncio.to_thread(hash_file, segment_path)}"
+    if source_path is not None:
+        return f"audio:{await hash_decoded_audio(source_path, start_time, duration)}"
+    if audio_hash is None:
+        audio_hash = await hash_decoded_audio(segment_path)
+    return f"audio:{audio_hash}"
+
+def hash_file(path, hasher=None):
+    """sha256 (or the given hasher's digest) of a file's contents"""
+    
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+result_cache = (
+    ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_BYTES, SEGMENT_CACHE_MAX_BYTES)
+    if RESULT_CACHE_PATH else None
+)
+
+class JobStore:
+    """
+    Durable state of unfinished jobs in SQLite, so a restarted worker resumes them.
+    
+    Each queued job is recorded with its URL and options. While it runs, the
+    pipeline writes named checkpoints as JSON: the download, the probe, the
+    segment plan, each finished segment transcript and summary, the names of
+    Gemini files it uploaded, and the context and analysis outputs. The job's
+    media and segment files live in a work directory under JOB_WORK_DIR. A job
+    and its work directory are removed once it completes or fails.
+    
+    Checkpoint writes are queued to one writer thread, which commits whatever
+    has piled up in a single transaction, in order. Callers on the engine loop
+    never wait for SQLite.
+    """
+    
+    def __init__(self, path, work_dir):
+        self.path = path
+        self.work_dir = work_dir
+        self.lock = threading.Lock()
+        self._db = None
+        self._writes = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+    
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    video_url TEXT NOT NULL,
+                    force INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    job_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    PRIMARY KEY (job_id, name)
+                );
+            """)
+        return self._db
+    
+    def add(self, job):
+        """Record a newly queued job"""
+        
+        with self.lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, 0)",
+                (job['job_id'], job['video_url'], int(job['force']), job['created_at'])
+            )
+            db.commit()
+    
+    def _queue_write(self, sql, params):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='job-store-writer', daemon=True)
+                self._writer.start()
+        self._writes.put((sql, params))
+    
+    def _write_loop(self):
+        while True:
+            batch = [self._writes.get()]
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                with self.lock:
+                    db = self._connect()
+                    try:
+                        for sql, params in batch:
+                            db.execute(sql, params)
+                        db.commit()
+                    except sqlite3.Error:
+                        db.rollback()
+                        raise
+            except sqlite3.Error as e:
+                print(f"Could not write {len(batch)} job store change(s): {e}")
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+    
+    def flush(self):
+        """Block until every queued write is committed"""
+        
+        self._writes.join()
+    
+    def save(self, job_id, name, value):
+        # Serialized now: the caller may change value after this returns
+        self._queue_write("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (job_id, name, json.dumps(value)))
+    
+    def delete(self, job_id, name):
+        self._queue_write("DELETE FROM checkpoints WHERE job_id = ? AND name = ?", (job_id, name))
+    
+    def delete_prefix(self, job_id, prefix):
+        """Remove the checkpoints whose names start with prefix"""
+        
+        self._queue_write(
+            "DELETE FROM checkpoints WHERE job_id = ? AND substr(name, 1, ?) = ?",
+            (job_id, len(prefix), prefix)
+        )
+    
+    def unfinished(self):
+        """
+        Jobs left behind by an earlier process, oldest first, each counted as one more attempt.
+        
+        Returns:
+            list: (job_id, video_url, force, created_at, attempts, checkpoints dict) tuples
+        """
+        
+        with self.lock:
+            db = self._connect()
+            db.execute("UPDATE jobs SET attempts = attempts + 1")
+            db.commit()
+            rows = db.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+            
+            unfinished = []
+            for job_id, video_url, force, created_at, attempts in rows:
+                checkpoints = {
+                    name: json.loads(value)
+                    for name, value in db.execute("SELECT name, value FROM checkpoints WHERE job_id = ?", (job_id,))
+                }
+                unfinished.append((job_id, video_url, bool(force), created_at, attempts, checkpoints))
+        
+        return unfinished
+    
+    def remove(self, job_id):
+        """Forget a finished job and delete its work directory"""
+        
+        # Queued behind the job's own checkpoint writes, so none of them lands afterwards
+        self._queue_write("DELETE FROM checkpoints WHERE job_id = ?", (job_id,))
+        self._queue_write("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        
+        shutil.rmtree(os.path.join(self.work_dir, job_id), ignore_errors=True)
+
+job_store = JobStore(JOB_STORE_PATH, JOB_WORK_DIR) if JOB_STORE_PATH else None
+
+async def fetch_url_validator(video_url):
+    """
+    ETag/Last-Modified of a URL from a HEAD request.
+    
+    Returns:
+        str: Validator identifying this version of the resource, or None if the
+             server gives neither (the URL key is then not used)
+    """
+    
+    try:
+        response = await get_http_client().head(video_url, timeout=30)
+        if response.status_code >= 400:
+            return None
+    except httpx.HTTPError as e:
+        print(f"HEAD request failed ({e}), skipping URL cache lookup")
+        return None
+    
+    etag = response.headers.get('etag')
+    last_modified = response.headers.get('last-modified')
+    if not etag and not last_modified:
+        return None
+    return f"etag={etag or ''};last-modified={last_modified or ''};length={response.headers.get('content-length', '')}"
+
+def cached_job_result(job, cached, transcript, start_time):
+    """Finish a job from a cached result: mark every stage cached and time this request"""
+    
+    result, processing_time = dict(cached), time.time() - start_time
+    result['cached'] = True
+    result['processing_time_seconds'] = int(processing_time)
+    result['processing_time_formatted'] = f"{int(processing_time // 60)}m {int(processing_time % 60)}s"
+    
+    for stage in PIPELINE_STAGES:
+        if job['stages'][stage]['status'] == 'pending':
+            update_job_stage(job, stage, 'cached')
+    
+    with jobs_lock:
+        job['transcript'] = transcript
+    
+    print(f"⚡ Served from result cache in {processing_time * 1000:.0f}ms")
+    return result
+
+async def process_video_async(video_url, job=None, force=False):
+    """Main processing function with optimized segmented transcription and dual analysis
+    
+    Runs on the engine loop: ffmpeg runs as async subprocesses, the download and
+    Gemini calls are awaited, and independent stages run as concurrent tasks.
+    The run is recorded as a span tree in the job's trace, returned under 'trace'.
+    
+    Args:
+        video_url: URL of the media to analyze
+        job: Optional job record that receives per-stage progress updates
+        force: Recompute even if the result cache has this media
+    """
+    
+    if job is None:
+        job = new_job_record(video_url)  # Untracked record so stats are still collected
+    
+    with trace_span('process_video', category='job', trace=job['trace'], video_url=video_url, force=force):
+        result = await run_pipeline(video_url, job, force)
+    
+    result['trace'] = job['trace'].to_chrome()
+    return result
 
-def process_video(video_url):
-    """Main processing function with optimized segmented transcription and dual analysis"""
+async def run_pipeline(video_url, job, force=False):
+    """The stages of process_video_async(), from cache lookup and download to analysis"""
     
-    import time
     start_time = time.time()
     
     print("Starting OPTIMIZED media processing...")
-    print("Optimizations: Silence Detection + Adaptive Segments + Parallel Processing")
+    print("Optimizations: Silence Detection + Adaptive Segments + Parallel Processing + Pipelined Stages")
+    
+    def finish_stage(stage, **progress):
+        """Done-callback marking a stage task done or failed, streaming its text output"""
+        
+        def callback(task):
+            failed = task.cancelled() or task.exception() is not None
+            update_job_stage(job, stage, 'failed' if failed else 'done', **progress)
+            if not failed and stage in ('context', 'analysis'):
+                save_checkpoint(job, stage, task.result())  # Kept even if the other one fails
+                if stage_progress(job, stage, 'partial'):
+                    save_checkpoint(job, f"partial:{stage}", True)
+                emit_job_event(job, stage, text=task.result())
+        
+        return callback
     
-    video_path = download_video(video_url)
+    # A resumed job continues from the media it downloaded before the restart
+    validator = None
+    live_transcription = None
+    download = get_checkpoint(job, 'download')
+    if download is not None and not os.path.exists(download['path']):
+        download = None
+    
+    if download is None:
+        # OPTIMIZATION: Repeat requests are answered from the result cache, by URL before downloading
+        if result_cache is not None and not force:
+            validator = await fetch_url_validator(video_url)
+            content_hash = await asyncio.to_thread(result_cache.content_hash_for_url, video_url, validator) if validator else None
+            cached = await asyncio.to_thread(result_cache.get, content_hash) if content_hash else None
+            if cached:
+                return cached_job_result(job, *cached, start_time)
+        
+        update_job_stage(job, 'download', 'running')
+        hasher = hashlib.sha256()
+        if STREAM_SEGMENTS and TRANSCRIPTION_MEDIA == 'audio' and get_checkpoint(job, 'transcript') is None:
+            # OPTIMIZATION: Cut and transcribe segments while the rest of the file downloads
+            video_path, live_transcription = await download_while_transcribing(video_url, hasher=hasher, job=job)
+        else:
+            video_path = await download_video(video_url, hasher=hasher, output_dir=create_job_work_dir(job), job=job)
+        content_hash = hasher.hexdigest()
+        update_job_stage(job, 'download', 'done', content_hash=content_hash)
+        
+        # ...and by content, for the same media behind a different or changed URL
+        if result_cache is not None and not force:
+            cached = await asyncio.to_thread(result_cache.get, content_hash)
+            if cached:
+                if live_transcription is not None:
+                    live_transcription.cancel()
+                    await asyncio.gather(live_transcription, return_exceptions=True)
+                os.remove(video_path)
+                if validator:
+                    await asyncio.to_thread(result_cache.remember_url, video_url, validator, content_hash)
+                return cached_job_result(job, *cached, start_time)
+        
+        save_checkpoint(job, 'download', {'path': video_path, 'content_hash': content_hash, 'validator': validator})
+    else:
+        print("♻️  Resuming with media downloaded before the restart")
+        video_path, content_hash, validator = download['path'], download['content_hash'], download['validator']
+        update_job_stage(job, 'download', 'done', content_hash=content_hash)
     
     try:
         # OPTIMIZATION: Detect media type ONCE at the start
-        is_audio = is_audio_only(video_path)
+        # (one ffprobe call; the MediaInfo is passed to every later stage)
+        update_job_stage(job, 'probe', 'running')
+        probe = get_checkpoint(job, 'probe')
+        if probe is None:
+            media = await probe_media(video_path)
+            if not media.probe_failed:
+                save_checkpoint(job, 'probe', media.probe)
+        else:
+            media = MediaInfo(video_path, probe)
+        is_audio, duration = media.is_audio, media.duration
         media_type = "audio" if is_audio else "video"
         print(f"Media type detected: {media_type}")
+        update_job_stage(job, 'probe', 'done', **media.describe())
         
-        # Get duration for statistics
-        duration = get_video_duration(video_path)
-        
-        # Transcribe with all optimizations enabled
-        # Adaptive segment duration is now handled inside transcribe_video_in_segments
-        transcript = transcribe_video_in_segments(
-            video_path, 
-            segment_duration=300,  # Base duration, will be adjusted adaptively
-            is_audio=is_audio,
-            max_workers=4  # Parallel processing with 4 workers
-        )
-        
-        # OPTIMIZATION: Upload full video ONCE for both context and analysis
-        print(f"\nUploading full {media_type} for context and analysis...")
-        mime_type = get_mime_type(video_path)
-        video_file = genai.upload_file(
-            path=video_path, 
-            display_name=f"full_{media_type}_analysis",
-            mime_type=mime_type
-        )
-        
-        while video_file.state.name == "PROCESSING":
-            print(f"Processing {media_type} for Gemini analysis...")
-            time.sleep(5)
-            video_file = genai.get_file(video_file.name)
+        # Context and analysis finished before a restart are not generated again
+        outputs = {stage: get_checkpoint(job, stage) for stage in ('context', 'analysis')}
         
-        if video_file.state.name == "FAILED":
-            raise ValueError(f"{media_type.capitalize()} upload failed for analysis")
+        # OPTIMIZATION: Prepare analysis media while the segments are transcribed -
+        # it doesn't depend on the transcript
+        media_task = None
+        if None in outputs.values():
+            update_job_stage(job, 'upload', 'running')
+            media_task = asyncio.create_task(
+                traced(build_analysis_media(video_path, is_audio, duration, job), 'analysis_media', mode=ANALYSIS_MEDIA)
+            )
+            media_task.add_done_callback(finish_stage('upload', mode=ANALYSIS_MEDIA))
+        else:
+            update_job_stage(job, 'upload', 'done', mode=ANALYSIS_MEDIA)
         
         try:
-            # Use the same uploaded file for both analyses
-            context = get_video_context(video_file, transcript, is_audio)
-            analysis = analyze_video_content(video_file, transcript, is_audio)
+            # Transcribe with all optimizations enabled
+            # Adaptive segment duration is now handled inside transcribe_video_in_segments
+            transcribed = get_checkpoint(job, 'transcript')
+            if transcribed is None:
+                transcript_lines = None
+                if live_transcription is not None:
+                    try:
+                        transcript_lines, summaries = await live_transcription
+                    except ValueError as e:
+                        print(f"Live segmenting failed ({e}), segmenting the downloaded file instead")
+                
+                if transcript_lines is None:
+                    update_job_stage(job, 'transcribe', 'running')
+                    transcript_lines, summaries = await transcribe_video_in_segments(
+                        video_path, 
+                        segment_duration=300,  # Fixed fallback, used only when audio can't be analyzed
+                        is_audio=is_audio,
+                        job=job,  # Parallelism comes from the shared adaptive concurrency controller
+                        media=media
+                    )
+                save_checkpoint(job, 'transcript', {
+                    'lines': transcript_lines.to_records(),
+                    'summaries': summaries,
+                    'failed_segments': stage_progress(job, 'transcribe', 'segments_failed', 0)
+                })
+                
+                # The segments are no longer needed once the whole transcript is checkpointed
+                work_dir = job_work_dir(job)
+                if work_dir is not None:
+                    shutil.rmtree(os.path.join(work_dir, 'segments'), ignore_errors=True)
+            else:
+                transcript_lines = Transcript.from_records(transcribed['lines'])
+                summaries = transcribed['summaries']
+                update_job_stage(job, 'transcribe', segments_failed=transcribed.get('failed_segments', 0))
+            transcript = transcript_lines.to_text()
+            with jobs_lock:
+                job['transcript'] = transcript_lines  # Served in time windows by /jobs/<id>/transcript
+            update_job_stage(job, 'transcribe', 'done')
+            
+            # Reduce over segment summaries if the transcript is too long for the prompts
+            prepared = get_checkpoint(job, 'prompt_transcript')
+            if prepared is None:
+                prepared = {'text': await prepare_prompt_transcript(transcript, summaries, job=job)}
+                save_checkpoint(job, 'prompt_transcript', prepared)
+            prompt_transcript = prepared['text']
+            
+            media_parts = None
+            if media_task is not None:
+                media_parts, _ = await media_task
+            
+            # OPTIMIZATION: Context and analysis don't depend on each other - run both at once
+            generators = {'context': get_video_context, 'analysis': analyze_video_content}
+            stage_tasks = {}
+            for stage, text in outputs.items():
+                if text is not None:
+                    update_job_stage(job, stage, 'done', partial=bool(get_checkpoint(job, f"partial:{stage}")))
+                    emit_job_event(job, stage, text=text)
+                    continue
+                
+                update_job_stage(job, stage, 'running')
+                task = asyncio.create_task(
+                    generators[stage](media_parts, transcript, is_audio, job, prompt_transcript=prompt_transcript)
+                )
+                task.add_done_callback(finish_stage(stage))
+                stage_tasks[stage] = task
+            
+            # Both calls use the uploaded media, so let both finish before cleanup
+            if stage_tasks:
+                await asyncio.wait(stage_tasks.values())
+            for stage, task in stage_tasks.items():
+                outputs[stage] = task.result()
+            context, analysis = outputs['context'], outputs['analysis']
+            
         finally:
-            # Clean up uploaded file
-            print(f"Cleaning up uploaded {media_type} from Gemini...")
-            genai.delete_file(video_file.name)
+            # Clean up uploaded files, waiting for the upload if it's still running
+            if media_task is not None:
+                await asyncio.wait([media_task])
+                if not media_task.cancelled() and not media_task.exception():
+                    _, uploaded_files = media_task.result()
+                    for uploaded in uploaded_files:
+                        print(f"Cleaning up {uploaded.display_name} from Gemini...")
+                        await delete_from_gemini(uploaded, job=job)
         
         # Calculate processing time
         end_time = time.time()
@@ -951,7 +4210,7 @@ def process_video(video_url):
         
         print(f"\n🎉 Processing complete! Total time: {minutes}m {seconds}s")
         
-        return {
+        result = {
             "transcript": transcript,
             "transcript_length": len(transcript),
             "context": context,
@@ -959,15 +4218,434 @@ def process_video(video_url):
             "analysis": analysis,
             "analysis_length": len(analysis),
             "video_duration": duration,
+            "gemini_stats": get_job_stats(job),
             "processing_time_seconds": int(processing_time),
             "processing_time_formatted": f"{minutes}m {seconds}s"
         }
+        
+        # A result with failed segments or cut-off outputs is returned once but never served again
+        if result_cache is not None and is_clean_run(job):
+            try:
+                await asyncio.to_thread(
+                    result_cache.put, content_hash, result, transcript_lines, url=video_url, validator=validator
+                )
+            except sqlite3.Error as e:
+                print(f"Could not store result in cache: {e}")
+        elif result_cache is not None:
+            print("Result has failed segments or partial outputs, not caching it")
+        
+        return result
     
     finally:
-        if os.path.exists(video_path):
+        if live_transcription is not None and not live_transcription.done():
+            live_transcription.cancel()
+            await asyncio.gather(live_transcription, return_exceptions=True)
+        
+        # A checkpointed job keeps its media until run_job() finishes it
+        if job_work_dir(job) is None and os.path.exists(video_path):
             os.remove(video_path)
             print(f"Cleaned up: {video_path}")
 
+def process_video(video_url, job=None):
+    """Blocking wrapper around process_video_async for callers outside the engine loop"""
+    
+    return asyncio.run_coroutine_threadsafe(process_video_async(video_url, job=job), get_engine_loop()).result()
+
+def create_job(video_url, force=False):
+    """
+    Register a new analysis job and schedule it on the engine loop.
+    
+    Args:
+        video_url: URL of the media to analyze
+        force: Recompute even if the result cache has this media
+    
+    Returns:
+        dict: The job record, or None if the queue is full
+    """
+    
+    with jobs_lock:
+        prune_finished_jobs()
+        
+        pending = sum(1 for j in jobs.values() if j['status'] in ('queued', 'running'))
+        if pending >= JOB_WORKERS + JOB_QUEUE_LIMIT:
+            return None
+        
+        job = new_job_record(video_url)
+        job['force'] = force
+        job['durable'] = job_store is not None
+        jobs[job['job_id']] = job
+    
+    if job['durable']:
+        try:
+            job_store.add(job)
+        except sqlite3.Error as e:
+            print(f"Could not record job {job['job_id']}, it will not survive a restart: {e}")
+            job['durable'] = False
+    
+    asyncio.run_coroutine_threadsafe(run_job(job), get_engine_loop())
+    print(f"Queued job {job['job_id']} for {video_url}")
+    return job
+
+def new_job_record(video_url):
+    """Build a fresh job record in the 'queued' state"""
+    
+    job_id = uuid.uuid4().hex
+    return {
+        'job_id': job_id,
+        'status': 'queued',
+        'video_url': video_url,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'stage': None,
+        'stages': {name: {'status': 'pending'} for name in PIPELINE_STAGES},
+        'stats': {'gemini_calls': 0, 'gemini_retries': 0, 'gemini_rate_limited': 0},
+        'result': None,
+        'error': None,
+        'events': [],
+        'event_condition': threading.Condition(jobs_lock),  # Notified when this job records an event
+        'event_waiters': set(),  # (loop, asyncio.Event) of streams served by asgi_app
+        'transcript': None,
+        'durable': False,  # Checkpointed to job_store
+        'checkpoints': {},
+        'trace': JobTrace(job_id)  # Span tree of the run (GET /jobs/<id>/trace)
+    }
+
+def resume_unfinished_jobs():
+    """
+    Requeue the jobs an earlier process left unfinished, from their last checkpoints.
+    
+    Called once at startup. A job that has already been resumed JOB_MAX_RESUMES
+    times is failed instead, in case it is what keeps taking the worker down.
+    
+    Returns:
+        int: Number of jobs requeued
+    """
+    
+    if job_store is None:
+        return 0
+    
+    try:
+        unfinished = job_store.unfinished()
+    except sqlite3.Error as e:
+        print(f"Could not read unfinished jobs: {e}")
+        return 0
+    
+    resumed = 0
+    for job_id, video_url, force, created_at, attempts, checkpoints in unfinished:
+        if attempts > JOB_MAX_RESUMES:
+            print(f"Giving up on job {job_id} after {attempts} restarts")
+            job_store.remove(job_id)
+            continue
+        
+        job = new_job_record(video_url)
+        job.update(job_id=job_id, created_at=created_at, force=force, durable=True, checkpoints=checkpoints)
+        job['trace'] = JobTrace(job_id)
+        job['stats']['resumes'] = attempts
+        
+        with jobs_lock:
+            jobs[job_id] = job
+        
+        asyncio.run_coroutine_threadsafe(run_job(job), get_engine_loop())
+        print(f"Resuming job {job_id} for {video_url} ({len(checkpoints)} checkpoints)")
+        resumed += 1
+    
+    return resumed
+
+async def run_job(job):
+    """Execute a queued job once a job slot is free and record its outcome"""
+    
+    async with job_slots:
+        with jobs_lock:
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            append_job_event(job, 'status', status='running')
+        
+        try:
+            result = await process_video_async(job['video_url'], job=job, force=job.get('force', False))
+            with jobs_lock:
+                job['result'] = result
+                job['status'] = 'completed'
+        except Exception as e:
+            print(f"Job {job['job_id']} failed: {e}")
+            import traceback
+            traceback.print_exc()
+            with jobs_lock:
+                job['error'] = str(e)
+                job['status'] = 'failed'
+                if job['stage'] and job['stages'][job['stage']]['status'] == 'running':
+                    job['stages'][job['stage']]['status'] = 'failed'
+        finally:
+            with jobs_lock:
+                job['finished_at'] = time.time()
+                
+                # Final event: clients fetch the full result from the status endpoint
+                final = {'status': job['status']}
+                if job['status'] == 'completed':
+                    final['processing_time_formatted'] = job['result']['processing_time_formatted']
+                else:
+                    final['message'] = job['error']
+                append_job_event(job, 'status', **final)
+            JOBS_FINISHED.labels(status=job['status']).inc()
+            
+            # An interrupted job keeps its checkpoints so the next process can resume it
+            if job['durable'] and job['status'] in ('completed', 'failed'):
+                await asyncio.to_thread(job_store.remove, job['job_id'])  # Deletes the work directory
+
+def update_job_stage(job, stage, status=None, **progress):
+    """
+    Record stage status and progress counters on a job.
+    
+    Args:
+        job: Job record, or None when running outside the job queue
+        stage: One of PIPELINE_STAGES
+        status: Optional new status ('running', 'done', 'failed')
+        **progress: Extra progress fields stored on the stage (e.g. segments_done)
+    """
+    
+    if job is None:
+        return
+    
+    with jobs_lock:
+        stage_info = job['stages'][stage]
+        if status:
+            stage_info['status'] = status
+            if status == 'running':
+                stage_info['started_at'] = time.time()
+                job['stage'] = stage
+            elif status in ('done', 'failed'):
+                stage_info['finished_at'] = time.time()
+        stage_info.update(progress)
+        append_job_event(job, 'stage', stage=stage, **stage_info)
+
+def emit_job_event(job, event, **data):
+    """
+    Record an event on a job's stream and wake up its listeners.
+    
+    Args:
+        job: Job record, or None when running outside the job queue
+        event: Event type ('status', 'stage', 'segment', 'context', 'analysis',
+               'context_delta', 'analysis_delta')
+        **data: JSON-serializable event payload
+    """
+    
+    if job is None:
+        return
+    
+    with jobs_lock:
+        append_job_event(job, event, **data)
+
+def append_job_event(job, event, **data):
+    """Append an event to a job's stream (caller holds jobs_lock)"""
+    
+    job['events'].append({'id': len(job['events']) + 1, 'event': event, 'data': data})
+    job['event_condition'].notify_all()  # Wakes only this job's streams
+    for loop, wakeup in job['event_waiters']:
+        loop.call_soon_threadsafe(wakeup.set)
+
+def stream_job_events(job, after=0):
+    """
+    Yield a job's events as Server-Sent Events until the job finishes.
+    
+    Args:
+        job: Job record
+        after: Id of the last event the client already has (from Last-Event-ID)
+    """
+    
+    while True:
+        with job['event_condition']:
+            job['event_condition'].wait_for(
+                lambda: len(job['events']) > after or job['finished_at'] is not None,
+                timeout=EVENT_HEARTBEAT_SECONDS
+            )
+            pending = job['events'][after:]
+            finished = job['finished_at'] is not None
+        
+        if pending:
+            for event in pending:
+                yield format_sse_event(event)
+            after = pending[-1]['id']
+        elif finished:
+            return
+        else:
+            yield ": keep-alive\n\n"
+
+async def stream_job_events_async(job, after=0):
+    """
+    stream_job_events() for asgi_app: waits on the event loop instead of holding a thread.
+    
+    Each wait registers an asyncio.Event in the job's event_waiters, which
+    append_job_event() sets from whichever thread records the next event.
+    """
+    
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        wakeup = asyncio.Event()
+        waiter = (loop, wakeup)
+        with jobs_lock:
+            pending = job['events'][after:]
+            finished = job['finished_at'] is not None
+            if not pending and not finished:
+                job['event_waiters'].add(waiter)
+        
+        if pending:
+            for event in pending:
+                yield format_sse_event(event)
+            after = pending[-1]['id']
+            continue
+        if finished:
+            return
+        
+        try:
+            await asyncio.wait_for(wakeup.wait(), EVENT_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield ": keep-alive\n\n"
+        finally:
+            with jobs_lock:
+                job['event_waiters'].discard(waiter)
+
+def format_sse_event(event):
+    """Render a job event as a Server-Sent Events message"""
+    
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+def stage_progress(job, stage, key, default=None):
+    """A progress field of a job stage, e.g. segments_failed (default if not set)"""
+    
+    with jobs_lock:
+        return job['stages'][stage].get(key, default)
+
+def is_clean_run(job):
+    """Whether a job finished without failed segments or partial outputs, so its result may be cached"""
+    
+    with jobs_lock:
+        stages = job['stages']
+        return not stages['transcribe'].get('segments_failed') and not any(
+            info.get('partial') for info in stages.values()
+        )
+
+def record_job_stat(job, key, amount=1):
+    """Increment a job counter such as gemini_retries (no-op without a job)"""
+    
+    if job is None:
+        return
+    
+    with jobs_lock:
+        job['stats'][key] = job['stats'].get(key, 0) + amount
+
+def get_job_stats(job):
+    """Copy of a job's counters"""
+    
+    with jobs_lock:
+        return dict(job['stats'])
+
+def get_checkpoint(job, name, default=None):
+    """Checkpointed value of a job, e.g. a finished segment after a restart (default if none)"""
+    
+    if job is None:
+        return default
+    
+    with jobs_lock:
+        return job['checkpoints'].get(name, default)
+
+def save_checkpoint(job, name, value):
+    """
+    Persist a JSON-serializable value on a durable job (no-op for other jobs).
+    
+    Checkpoint names: 'download', 'probe', 'segments', 'segment:<n>',
+    'summary:<n>', 'upload:<display name>', 'transcript', 'prompt_transcript',
+    'context' and 'analysis'.
+    """
+    
+    if job is None or not job['durable']:
+        return
+    
+    with jobs_lock:
+        job['checkpoints'][name] = value
+    
+    job_store.save(job['job_id'], name, value)
+
+def clear_checkpoint(job, name):
+    """Forget one checkpoint of a durable job"""
+    
+    if job is None or not job['durable']:
+        return
+    
+    with jobs_lock:
+        job['checkpoints'].pop(name, None)
+    
+    job_store.delete(job['job_id'], name)
+
+def clear_checkpoints(job, prefix):
+    """Forget every checkpoint of a durable job whose name starts with prefix"""
+    
+    if job is None or not job['durable']:
+        return
+    
+    with jobs_lock:
+        for name in [name for name in job['checkpoints'] if name.startswith(prefix)]:
+            del job['checkpoints'][name]
+    
+    job_store.delete_prefix(job['job_id'], prefix)
+
+def reset_segment_checkpoints(job):
+    """Drop the segment results of a durable job before it is cut differently"""
+    
+    clear_checkpoints(job, 'segment:')
+    clear_checkpoints(job, 'summary:')
+    clear_checkpoints(job, 'upload:segment_')  # Stale uploads expire on Gemini's side
+    clear_checkpoint(job, 'live_segments')
+
+def job_work_dir(job):
+    """Directory holding a durable job's media until it finishes, or None for other jobs"""
+    
+    if job is None or not job['durable']:
+        return None
+    
+    return os.path.join(job_store.work_dir, job['job_id'])
+
+def create_job_work_dir(job):
+    """Create and return job_work_dir(job), or None for jobs that are not durable"""
+    
+    work_dir = job_work_dir(job)
+    if work_dir is not None:
+        os.makedirs(work_dir, exist_ok=True)
+    return work_dir
+
+def get_job_snapshot(job):
+    """Build a JSON-serializable view of a job for the status endpoint"""
+    
+    with jobs_lock:
+        snapshot = {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'video_url': job['video_url'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'stage': job['stage'],
+            'stages': {name: dict(info) for name, info in job['stages'].items()},
+            'stats': dict(job['stats'])
+        }
+        if job['status'] == 'completed':
+            snapshot['result'] = job['result']
+        elif job['status'] == 'failed':
+            snapshot['message'] = job['error']
+    
+    return snapshot
+
+def prune_finished_jobs():
+    """Drop finished jobs older than JOB_RETENTION_SECONDS (caller holds jobs_lock)"""
+    
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    expired = [
+        job_id for job_id, job in jobs.items()
+        if job['finished_at'] and job['finished_at'] < cutoff
+    ]
+    for job_id in expired:
+        del jobs[job_id]
+
 @app.route('/')
 def home():
     try:
@@ -988,7 +4666,7 @@ def home():
             "optimizations": [
                 "Smart silence detection - skips empty segments",
                 "Adaptive segment duration - adjusts based on content density",
-                "Parallel processing - 4 simultaneous workers"
+                "Parallel processing - adaptive concurrency shared across jobs"
             ]
         })
 
@@ -1011,21 +4689,21 @@ def analyze():
                 "message": "URL must start with http:// or https://"
             }), 400
         
-        result = process_video(video_url)
+        job = create_job(video_url, force=bool(data.get('force', False)))
+        
+        if job is None:
+            return jsonify({
+                "status": "error",
+                "message": "Too many jobs in progress, please try again later"
+            }), 503
         
         return jsonify({
-            "status": "success",
+            "status": "queued",
+            "job_id": job['job_id'],
             "video_url": video_url,
-            "transcript": result["transcript"],
-            "transcript_length": result["transcript_length"],
-            "context": result["context"],
-            "context_length": result["context_length"],
-            "analysis": result["analysis"],
-            "analysis_length": result["analysis_length"],
-            "video_duration_seconds": result.get("video_duration"),
-            "processing_time_seconds": result.get("processing_time_seconds"),
-            "processing_time_formatted": result.get("processing_time_formatted")
-        })
+            "status_url": f"/jobs/{job['job_id']}",
+            "events_url": f"/jobs/{job['job_id']}/events"
+        }), 202
         
     except Exception as e:
         print(f"Error: {str(e)}")
@@ -1036,12 +4714,154 @@ def analyze():
             "message": str(e)
         }), 500
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    
+    return jsonify(get_job_snapshot(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_event_stream(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    
+    # EventSource reconnects with Last-Event-ID, so a dropped stream resumes where it stopped
+    after = request.headers.get('Last-Event-ID') or request.args.get('after') or '0'
+    if not after.isdigit():
+        return jsonify({
+            "status": "error",
+            "message": f"Invalid event id: {after}"
+        }), 400
+    
+    return Response(
+        stream_job_events(job, int(after)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/jobs/<job_id>/trace')
+def job_trace(job_id):
+    """Span trace of a job, running or finished - load it in chrome://tracing or ui.perfetto.dev"""
+    
+    with jobs_lock:
+        job = jobs.get(job_id)
+    
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    
+    return jsonify(job['trace'].to_chrome())
+
+TRANSCRIPT_FORMATS = {
+    'text': ('text/plain', Transcript.to_text),
+    'ndjson': ('application/x-ndjson', Transcript.to_ndjson),
+    'srt': ('application/x-subrip', Transcript.to_srt),
+    'vtt': ('text/vtt', Transcript.to_vtt),
+}
+
+@app.route('/jobs/<job_id>/transcript')
+def job_transcript(job_id):
+    """
+    Transcript of a job, optionally limited to a time window.
+    
+    Query parameters: format (json, ndjson, srt, vtt or text; default json),
+    start and end (seconds or [HH:]MM:SS).
+    """
+    
+    with jobs_lock:
+        job = jobs.get(job_id)
+        transcript = job['transcript'] if job else None
+    
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown job: {job_id}"
+        }), 404
+    
+    if transcript is None:
+        return jsonify({
+            "status": "error",
+            "message": "Transcript is not ready yet"
+        }), 409
+    
+    output_format = request.args.get('format', 'json')
+    if output_format != 'json' and output_format not in TRANSCRIPT_FORMATS:
+        return jsonify({
+            "status": "error",
+            "message": f"Unknown format: {output_format}"
+        }), 400
+    
+    try:
+        start = parse_timestamp(request.args['start']) if 'start' in request.args else None
+        end = parse_timestamp(request.args['end']) if 'end' in request.args else None
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    
+    if start is not None or end is not None:
+        transcript = transcript.window(start, end)
+    
+    if output_format == 'json':
+        return jsonify({
+            "status": "ok",
+            "job_id": job_id,
+            "start": start,
+            "end": end,
+            "speakers": transcript.speakers,
+            "lines": transcript.to_records()
+        })
+    
+    mimetype, render = TRANSCRIPT_FORMATS[output_format]
+    return Response(render(transcript), mimetype=mimetype)
+
+@app.route('/concurrency')
+def concurrency():
+    return jsonify(segment_concurrency.snapshot())
+
+def count_jobs(status):
+    """Number of jobs currently in the given status"""
+    
+    with jobs_lock:
+        return sum(1 for j in jobs.values() if j['status'] == status)
+
+JOBS_RUNNING.set_function(lambda: count_jobs('running'))
+JOBS_QUEUED.set_function(lambda: count_jobs('queued'))
+SEGMENT_CONCURRENCY_LIMIT.set_function(lambda: segment_concurrency.limit)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    
+    return Response(generate_latest(), content_type=CONTENT_TYPE_LATEST)
+
 @app.route('/health')
 def health():
+    with jobs_lock:
+        queued_jobs = sum(1 for j in jobs.values() if j['status'] == 'queued')
+        running_jobs = sum(1 for j in jobs.values() if j['status'] == 'running')
+    
     return jsonify({
         "status": "healthy",
         "version": VERSION,
         "gemini_api_configured": bool(GOOGLE_API_KEY),
+        "model_backend": model_backend.name,
         "ffmpeg_available": os.system('which ffmpeg > /dev/null 2>&1') == 0,
         "supported_formats": {
             "video": ["mp4", "mov", "avi", "mkv"],
@@ -1050,10 +4870,114 @@ def health():
         "optimizations": {
             "silence_detection": "Skips segments >80% silent",
             "adaptive_segments": "Adjusts segment size based on content density",
-            "parallel_processing": "Processes 4 segments simultaneously"
-        }
+            "parallel_processing": f"Adaptive: {segment_concurrency.limit} segments in flight (max {SEGMENT_CONCURRENCY_MAX})",
+            "transcription_media": TRANSCRIPTION_MEDIA
+        },
+        "gemini_limits": {
+            "requests_per_minute": GEMINI_RPM,
+            "tokens_per_minute": GEMINI_TPM,
+            "max_retries": GEMINI_MAX_RETRIES
+        },
+        "jobs": {
+            "workers": JOB_WORKERS,
+            "queued": queued_jobs,
+            "running": running_jobs,
+            "checkpointed": job_store is not None
+        },
+        "result_cache": result_cache.stats() if result_cache is not None else None
     })
 
+wsgi_bridge = None
+
+JOB_EVENTS_PATH = re.compile(r'^/jobs/([^/]+)/events$')
+
+async def send_json_response(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def serve_job_events(scope, receive, send, job_id):
+    """GET /jobs/<id>/events under asgi_app - same responses as the Flask route, without a thread"""
+    
+    with jobs_lock:
+        job = jobs.get(job_id)
+    
+    if job is None:
+        await send_json_response(send, 404, {"status": "error", "message": f"Unknown job: {job_id}"})
+        return
+    
+    # EventSource reconnects with Last-Event-ID, so a dropped stream resumes where it stopped
+    from urllib.parse import parse_qs
+    headers = {name.lower(): value for name, value in scope.get('headers', [])}
+    query = parse_qs(scope.get('query_string', b'').decode())
+    after = headers.get(b'last-event-id', b'').decode() or query.get('after', [''])[0] or '0'
+    if not after.isdigit():
+        await send_json_response(send, 400, {"status": "error", "message": f"Invalid event id: {after}"})
+        return
+    
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')
+    ]})
+    
+    async def stream():
+        async for message in stream_job_events_async(job, int(after)):
+            await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    
+    # Stop streaming as soon as the client goes away
+    tasks = [asyncio.create_task(stream()), asyncio.create_task(wait_for_disconnect())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None and not isinstance(task.exception(), OSError):
+            raise task.exception()
+
+async def asgi_app(scope, receive, send):
+    """
+    ASGI entry point, e.g. `uvicorn gemini_video_analyzer:asgi_app`.
+    
+    Jobs run as tasks on the server's own event loop, so concurrent jobs and
+    segments cost no extra threads. Job event streams are served here on the
+    loop too, so open streams don't take threads from the WSGI bridge whose
+    pool (WSGI_THREADS) serves the other Flask routes.
+    """
+    
+    global wsgi_bridge
+    
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                attach_engine_loop(asyncio.get_running_loop())
+                resume_unfinished_jobs()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if job_store is not None:
+                    await asyncio.to_thread(job_store.flush)  # Queued checkpoints reach the disk
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    match = JOB_EVENTS_PATH.match(scope.get('path', '')) if scope['type'] == 'http' else None
+    if match and scope['method'] == 'GET':
+        await serve_job_events(scope, receive, send, match.group(1))
+        return
+    
+    if wsgi_bridge is None:
+        from a2wsgi import WSGIMiddleware
+        wsgi_bridge = WSGIMiddleware(app, workers=WSGI_THREADS)
+    
+    await wsgi_bridge(scope, receive, send)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
+    resume_unfinished_jobs()  # Runs them on the background engine loop, as asgi_app's startup does on its own
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,311 @@
+"""
+Load test: concurrent /analyze requests against the HTTP service.
+
+Starts the service the way the Dockerfile does (uvicorn on asgi_app, one
+worker) with the stub model backend and the caches disabled, serves a local
+media corpus over HTTP, and runs --users closed-loop clients. Each client
+submits a job for a file drawn from the weighted --mix, polls it to the end,
+and submits the next. Reported: jobs per minute, end-to-end p50/p95/p99
+latency (submit to completed), error rate (failed jobs, rejected and errored
+requests) and the peak RSS of the server's process tree (ffmpeg included).
+
+The stub's latencies are pinned (STUB_SETTINGS) and it injects no 429s
+unless --stub-rate-limit is given; the stub settings used are in the report.
+Server settings under test are passed with --env, so runs with different
+worker counts or concurrency limits can be compared:
+
+    python loadtest.py --users 8 --duration 300
+    python loadtest.py --users 16 --env JOB_WORKERS=16 --env SEGMENT_CONCURRENCY_MAX=32 --json run.json
+    python loadtest.py --mix speech_5min=3 video_1080p_1min=1
+    python loadtest.py --stub-rate-limit 0.05                  # Share of Gemini calls answered with a 429
+    python loadtest.py --target http://staging:8080 --media-url http://media-host:8000   # Existing deployment
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from synthetic_media import CASES, generate_media, serve_media
+
+DEFAULT_MIX = ['speech_5min=2', 'silence_heavy_30min=1', 'video_1080p_1min=1']
+
+# Stub backend behaviour, pinned so the caller's environment can't skew a run (--env still overrides)
+STUB_SETTINGS = {
+    'STUB_UPLOAD_MBPS': '50',
+    'STUB_PROCESSING_SECONDS_PER_MB': '0.2',
+    'STUB_GENERATE_SECONDS': '1.0',
+    'STUB_GENERATE_SECONDS_PER_MB': '0.1',
+    'STUB_SEED': '0'
+}
+
+def parse_mix(items):
+    """Parse 'case=weight' items (a bare case name weighs 1) into {case: weight}"""
+    
+    mix = {}
+    for item in items:
+        name, _, weight = item.partition('=')
+        if name not in CASES:
+            raise ValueError(f"Unknown case {name!r}, expected one of: {', '.join(sorted(CASES))}")
+        mix[name] = float(weight or 1)
+    return mix
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def stub_settings(rate_limit_probability, overrides):
+    """STUB_* environment for the server: the pinned defaults, the 429 rate, then --env overrides"""
+    
+    settings = dict(STUB_SETTINGS, STUB_RATE_LIMIT_PROBABILITY=str(rate_limit_probability))
+    settings.update(item.split('=', 1) for item in overrides if item.startswith('STUB_'))
+    return settings
+
+def start_server(port, stub, overrides):
+    """
+    Start the service as the Dockerfile does, with the stub backend and no caches.
+    
+    Args:
+        port: Port to listen on
+        stub: STUB_* settings for the stub backend
+        overrides: Extra environment for the server (KEY=VALUE strings)
+    
+    Returns:
+        subprocess.Popen of the server
+    """
+    
+    env = dict(os.environ)
+    env.update({
+        'MODEL_BACKEND': 'stub',
+        'GOOGLE_API_KEY': env.get('GOOGLE_API_KEY', 'stub'),
+        'RESULT_CACHE_PATH': '',  # Every job does the full work
+        'JOB_STORE_PATH': ''
+    })
+    env.update(stub)
+    env.update(item.split('=', 1) for item in overrides)
+    
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'gemini_video_analyzer:asgi_app',
+         '--host', '127.0.0.1', '--port', str(port), '--workers', '1', '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL
+    )
+
+async def wait_until_healthy(client, base_url, server, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            if (await client.get(f"{base_url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{base_url} not healthy after {timeout}s")
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux /proc)"""
+    
+    children = {}
+    rss = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+            with open(f"/proc/{entry}/statm") as f:
+                rss[int(entry)] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += rss.get(current, 0)
+        stack.extend(children.get(current, []))
+    return total
+
+async def sample_rss(pid, stats, interval=0.5):
+    """Record the peak RSS of a process tree until cancelled"""
+    
+    while True:
+        stats['peak_rss'] = max(stats['peak_rss'], await asyncio.to_thread(process_tree_rss, pid))
+        await asyncio.sleep(interval)
+
+async def run_user(client, base_url, media, mix, deadline, stats, poll_interval, job_timeout):
+    """One closed-loop client: submit a job, wait for it to finish, repeat until the deadline"""
+    
+    names, weights = list(mix), list(mix.values())
+    while time.time() < deadline and (stats['limit'] is None or stats['submitted'] < stats['limit']):
+        name = random.choices(names, weights)[0]
+        stats['submitted'] += 1
+        started = time.perf_counter()
+        
+        try:
+            response = await client.post(f"{base_url}/analyze", json={'video_url': media[name], 'force': True})
+            if response.status_code != 202:
+                stats['rejected' if response.status_code == 503 else 'errors'] += 1
+                await asyncio.sleep(poll_interval)  # Back off from a full queue
+                continue
+            status_url = f"{base_url}{response.json()['status_url']}"
+            
+            while True:
+                await asyncio.sleep(poll_interval)
+                job = (await client.get(status_url)).json()
+                if job['status'] in ('completed', 'failed'):
+                    break
+                if time.perf_counter() - started > job_timeout:
+                    raise TimeoutError(f"job not finished after {job_timeout}s")
+        except (httpx.HTTPError, TimeoutError, ValueError, KeyError) as e:
+            print(f"Request for {name} failed: {type(e).__name__}: {e}")
+            stats['errors'] += 1
+            continue
+        
+        if job['status'] == 'completed':
+            stats['latencies'].append(time.perf_counter() - started)
+            stats['completed_by_case'][name] = stats['completed_by_case'].get(name, 0) + 1
+        else:
+            print(f"Job for {name} failed: {job.get('message')}")
+            stats['failed'] += 1
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)"""
+    
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+def build_report(stats, elapsed, args):
+    completed = len(stats['latencies'])
+    attempts = completed + stats['failed'] + stats['rejected'] + stats['errors']
+    return {
+        'users': args.users,
+        'elapsed_seconds': round(elapsed, 1),
+        'server_env': args.env,
+        'stub_settings': stats['stub'],
+        'mix': stats['mix'],
+        'completed': completed,
+        'completed_by_case': stats['completed_by_case'],
+        'failed': stats['failed'],
+        'rejected': stats['rejected'],
+        'errors': stats['errors'],
+        'jobs_per_minute': round(completed / (elapsed / 60), 2) if elapsed else 0,
+        'error_rate': round((attempts - completed) / attempts, 4) if attempts else 0,
+        'latency_seconds': {
+            name: round(value, 2) if value is not None else None
+            for name, value in (('p50', percentile(stats['latencies'], 0.50)),
+                                ('p95', percentile(stats['latencies'], 0.95)),
+                                ('p99', percentile(stats['latencies'], 0.99)))
+        },
+        'peak_rss_mb': round(stats['peak_rss'] / (1024 * 1024), 1) if stats['peak_rss'] else None
+    }
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    
+    if args.media_url:
+        media_url = args.media_url.rstrip('/')
+        media = {name: f"{media_url}/{name}.{'m4a' if CASES[name]['kind'] == 'audio' else 'mp4'}" for name in mix}
+    else:
+        os.makedirs(args.media_dir, exist_ok=True)
+        files = {name: generate_media(name, CASES[name], args.media_dir) for name in mix}
+        media_url = serve_media(args.media_dir)
+        media = {name: f"{media_url}/{file_name}" for name, file_name in files.items()}
+    
+    server = None
+    stub = None  # Unknown for a remote target
+    if args.target:
+        base_url = args.target.rstrip('/')
+    else:
+        port = free_port()
+        stub = stub_settings(args.stub_rate_limit, args.env)
+        server = start_server(port, stub, args.env)
+        base_url = f"http://127.0.0.1:{port}"
+    
+    stats = {
+        'mix': mix, 'stub': stub, 'submitted': 0, 'limit': args.requests, 'latencies': [], 'completed_by_case': {},
+        'failed': 0, 'rejected': 0, 'errors': 0, 'peak_rss': 0
+    }
+    
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            await wait_until_healthy(client, base_url, server)
+            sampler = asyncio.create_task(sample_rss(server.pid, stats)) if server is not None else None
+            
+            print(f"Running {args.users} users against {base_url} for up to {args.duration}s...")
+            started = time.perf_counter()
+            deadline = time.time() + args.duration
+            await asyncio.gather(*(
+                run_user(client, base_url, media, mix, deadline, stats, args.poll_interval, args.job_timeout)
+                for _ in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+            
+            if sampler is not None:
+                sampler.cancel()
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+    
+    return build_report(stats, elapsed, args)
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /analyze load test against the stub model backend")
+    parser.add_argument('--users', type=int, default=4, help="Concurrent closed-loop clients")
+    parser.add_argument('--duration', type=float, default=300, help="Seconds to keep submitting jobs")
+    parser.add_argument('--requests', type=int, help="Stop after submitting this many jobs in total")
+    parser.add_argument('--mix', nargs='+', default=DEFAULT_MIX, help="case=weight items from synthetic_media.CASES")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Server setting to test (repeatable), e.g. JOB_WORKERS=16")
+    parser.add_argument('--stub-rate-limit', type=float, default=0.0,
+                        help="Share of stub upload/generate calls answered with a 429 (default: none)")
+    parser.add_argument('--target', help="Load an already running service instead of starting one (no RSS)")
+    parser.add_argument('--media-url', help="Base URL of an existing corpus (<case>.m4a / <case>.mp4) instead of a local one")
+    parser.add_argument('--media-dir', default=os.path.join(tempfile.gettempdir(), 'video_analyzer_benchmark'),
+                        help="Where the generated corpus is kept between runs")
+    parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between job status checks")
+    parser.add_argument('--job-timeout', type=float, default=3600, help="Give up on a job after this many seconds")
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+    
+    if any('=' not in item for item in args.env):
+        parser.error("--env takes KEY=VALUE")
+    
+    report = asyncio.run(run(args))
+    
+    latency = report['latency_seconds']
+    print(f"\nCompleted {report['completed']} jobs in {report['elapsed_seconds']}s with {report['users']} users")
+    print(f"Throughput:  {report['jobs_per_minute']} jobs/min")
+    print(f"Latency:     p50 {latency['p50']}s  p95 {latency['p95']}s  p99 {latency['p99']}s")
+    print(f"Errors:      {report['error_rate']:.1%} ({report['failed']} failed, {report['rejected']} rejected, {report['errors']} request errors)")
+    print(f"Peak RSS:    {report['peak_rss_mb']} MB" if report['peak_rss_mb'] else "Peak RSS:    n/a (remote target)")
+    if report['stub_settings']:
+        print(f"Stub:        {' '.join(f'{key}={value}' for key, value in sorted(report['stub_settings'].items()))}")
+    
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
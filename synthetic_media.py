@@ -0,0 +1,75 @@
+"""
+Synthetic media corpus shared by benchmark.py and loadtest.py.
+
+Media is generated with ffmpeg's lavfi sources (speech-like tones, long
+silences, 1080p test video) and served from a local HTTP server. This module
+neither imports the analyzer nor touches the environment, so importing it
+leaves the caller's configuration alone.
+"""
+
+import os
+import subprocess
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# Voiced tone with a wandering pitch and syllable-rate loudness, pausing about a third of the time
+SPEECH = "0.4*sin(2*PI*(170+30*sin(2*PI*2.3*t))*t)*(0.55+0.45*sin(2*PI*4.1*t))*gt(sin(2*PI*0.31*t)+0.5,0)"
+# The same speech for one minute in every five, silent otherwise
+SPARSE_SPEECH = f"({SPEECH})*lt(mod(t,300),60)"
+
+CASES = {
+    'speech_5min': {'kind': 'audio', 'audio': SPEECH, 'duration': 300},
+    'speech_30min': {'kind': 'audio', 'audio': SPEECH, 'duration': 1800},
+    'silence_heavy_30min': {'kind': 'audio', 'audio': SPARSE_SPEECH, 'duration': 1800},
+    'video_1080p_1min': {'kind': 'video', 'audio': SPEECH, 'duration': 60},
+    'video_1080p_5min': {'kind': 'video', 'audio': SPEECH, 'duration': 300},
+    'speech_120min': {'kind': 'audio', 'audio': SPEECH, 'duration': 7200, 'long': True},
+    'silence_heavy_120min': {'kind': 'audio', 'audio': SPARSE_SPEECH, 'duration': 7200, 'long': True},
+    'video_1080p_20min': {'kind': 'video', 'audio': SPEECH, 'duration': 1200, 'long': True},
+}
+
+def generate_media(name, case, media_dir):
+    """
+    Generate a case's media file with ffmpeg lavfi, reusing it if already there.
+    
+    Returns:
+        str: File name inside media_dir
+    """
+    
+    duration = case['duration']
+    if case['kind'] == 'audio':
+        file_name = f"{name}.m4a"
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f"aevalsrc='{case['audio']}':s=16000:d={duration}",
+            '-ac', '1', '-c:a', 'aac', '-b:a', '64k'
+        ]
+    else:
+        file_name = f"{name}.mp4"
+        cmd = [
+            'ffmpeg', '-y', '-v', 'error',
+            '-f', 'lavfi', '-i', f"testsrc2=s=1920x1080:r=30:d={duration}",
+            '-f', 'lavfi', '-i', f"aevalsrc='{case['audio']}':s=48000:d={duration}",
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28', '-g', '60',
+            '-c:a', 'aac', '-b:a', '96k', '-shortest', '-movflags', '+faststart'
+        ]
+    
+    path = os.path.join(media_dir, file_name)
+    if not os.path.exists(path):
+        print(f"Generating {file_name} ({duration}s)...")
+        partial_path = os.path.join(media_dir, f"partial_{file_name}")  # Keeps the extension ffmpeg picks the muxer from
+        subprocess.run(cmd + [partial_path], check=True)
+        os.replace(partial_path, path)
+    return file_name
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_media(media_dir):
+    """Serve media_dir over HTTP on a free local port; returns the base URL"""
+    
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=media_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"